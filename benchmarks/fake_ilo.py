@@ -0,0 +1,405 @@
+"""
+Local stand-in for an iLO that answers RIBCL requests from synthetic fixtures
+
+Every connection gets a fresh copy of the fixture chosen at startup. The
+fixtures are generated by make_fixtures.py with the sections and fields of each
+generation, not captured from real boards, so element order, whitespace and
+firmware quirks may differ from what a real iLO sends. The same data is served
+over Redfish too, laid out like an iLO5 does.
+
+    python benchmarks/fake_ilo.py --fixture ilo4 --port 8443 --latency 0.5
+"""
+from __future__ import print_function
+import argparse
+import base64
+import json
+import os
+import shutil
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+import xml.etree.ElementTree as etree
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    # Python 3
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+BOARDS = {
+    'ilo3': ('ProLiant DL380 G7', 'iLO3', '1.88'),
+    'ilo4': ('ProLiant DL380p Gen8', 'iLO4', '2.55'),
+    'ilo5': ('ProLiant DL380 Gen10', 'iLO5', '1.40'),
+    'ilo4_large': ('ProLiant DL380 Gen9', 'iLO4', '2.55'),
+}
+
+OK = '<RESPONSE\r\n    STATUS="0x0000"\r\n    MESSAGE=\'No error\'\r\n     />\r\n'
+DOCUMENT = '<?xml version="1.0"?>\r\n<RIBCL VERSION="2.23">\r\n%s%s</RIBCL>\r\n'
+
+
+# RIBCL status -> Redfish Status
+REDFISH_STATUS = {
+    'OK': {'Health': 'OK', 'State': 'Enabled'},
+    'Good, In Use': {'Health': 'OK', 'State': 'Enabled'},
+    'Not Installed': {'State': 'Absent'},
+    'Not Present': {'State': 'Absent'},
+    'Rebuilding': {'Health': 'Warning', 'State': 'Updating'},
+    'Unknown': {'State': 'Enabled'},
+}
+
+# HEALTH_AT_A_GLANCE element -> AggregateHealthStatus member
+AGGREGATE_HEALTH = {
+    'BIOS_HARDWARE': 'BiosOrHardwareHealth', 'FANS': 'Fans', 'TEMPERATURE': 'Temperatures',
+    'POWER_SUPPLIES': 'PowerSupplies', 'BATTERY': 'SmartStorageBattery', 'PROCESSOR': 'Processors',
+    'MEMORY': 'Memory', 'NETWORK': 'Network', 'STORAGE': 'Storage',
+}
+
+
+def error(status, message):
+    return '<RESPONSE\r\n    STATUS="0x%04X"\r\n    MESSAGE=\'%s\'\r\n     />\r\n' % (status, message)
+
+
+class FakeIlo(object):
+    """
+    Answers the RIBCL commands the exporter sends with canned payloads
+    """
+
+    def __init__(self, fixture='ilo4', login='admin', password='admin', latency=0.0, blade=False):
+        with open(os.path.join(FIXTURES_DIR, '%s.xml' % fixture)) as f:
+            self.embedded_health = f.read()
+        self.product_name, self.management_processor, self.firmware_version = BOARDS[fixture]
+        self.login = login
+        self.password = password
+        self.latency = latency
+        self.blade = blade
+        self.requests = 0
+        self._redfish = None
+
+    def payload(self, command):
+        if command == 'GET_EMBEDDED_HEALTH':
+            return self.embedded_health
+        if command == 'GET_PRODUCT_NAME':
+            return '<GET_PRODUCT_NAME>\r\n<PRODUCT_NAME VALUE ="%s"/>\r\n</GET_PRODUCT_NAME>\r\n' % self.product_name
+        if command == 'GET_SERVER_NAME':
+            return '<SERVER_NAME VALUE="fake-%s.example.com"/>\r\n' % self.management_processor.lower()
+        if command == 'GET_HOST_DATA':
+            return ('<GET_HOST_DATA>\r\n'
+                    '<SMBIOS_RECORD TYPE="0" B64_DATA="AAAA">\r\n<FIELD NAME="Subject" VALUE="BIOS Information"/>\r\n'
+                    '<FIELD NAME="Family" VALUE="P70"/>\r\n<FIELD NAME="Date" VALUE="02/17/2017"/>\r\n</SMBIOS_RECORD>\r\n'
+                    '<SMBIOS_RECORD TYPE="1" B64_DATA="AAAA">\r\n<FIELD NAME="Subject" VALUE="System Information"/>\r\n'
+                    '<FIELD NAME="Product Name" VALUE="%s"/>\r\n<FIELD NAME="Serial Number" VALUE="CZJ3100XXX      "/>\r\n'
+                    '</SMBIOS_RECORD>\r\n'
+                    '<SMBIOS_RECORD TYPE="226" B64_DATA="AAAA">\r\n<FIELD NAME="Subject" VALUE="HPE Information"/>\r\n'
+                    '<FIELD NAME="Serial Number" VALUE="CZJ3100XXX"/>\r\n<FIELD NAME="UUID" VALUE="1234"/>\r\n'
+                    '</SMBIOS_RECORD>\r\n</GET_HOST_DATA>\r\n' % self.product_name)
+        if command == 'GET_HOST_POWER_STATUS':
+            return '<GET_HOST_POWER\r\n    HOST_POWER="ON"\r\n    />\r\n'
+        if command == 'GET_FW_VERSION':
+            return ('<GET_FW_VERSION\r\n    FIRMWARE_VERSION = "%s"\r\n    FIRMWARE_DATE = "Aug 16 2017"\r\n'
+                    '    MANAGEMENT_PROCESSOR = "%s"\r\n    LICENSE_TYPE = "iLO Advanced"\r\n    />\r\n'
+                    % (self.firmware_version, self.management_processor))
+        if command == 'GET_OA_INFO' and self.blade:
+            return ('<GET_OA_INFO>\r\n<IPADDRESS VALUE="192.168.1.1"/>\r\n<ENCL VALUE="c7000name"/>\r\n'
+                    '<LOCATION VALUE="7"/>\r\n</GET_OA_INFO>\r\n')
+        if command == 'GET_POWER_READINGS':
+            return ('<GET_POWER_READINGS>\r\n<PRESENT_POWER_READING VALUE="141" UNIT="Watts"/>\r\n'
+                    '<AVERAGE_POWER_READING VALUE="139" UNIT="Watts"/>\r\n'
+                    '<MAXIMUM_POWER_READING VALUE="220" UNIT="Watts"/>\r\n'
+                    '<MINIMUM_POWER_READING VALUE="120" UNIT="Watts"/>\r\n</GET_POWER_READINGS>\r\n')
+        return None
+
+    def respond(self, body):
+        """
+        Returns the RIBCL response documents for one request body
+        """
+        self.requests += 1
+        body = body[body.find('<RIBCL'):]
+        try:
+            root = etree.fromstring(body)
+        except etree.ParseError:
+            return DOCUMENT % (error(1, 'Syntax error: Line #1: syntax error near ">" in the line: "".'), '')
+        login = root.find('LOGIN')
+        # protocol detection sends an empty RIBCL document
+        if login is None:
+            return DOCUMENT % (OK, '')
+        if login.get('USER_LOGIN') != self.login or login.get('PASSWORD') != self.password:
+            return DOCUMENT % (error(0x5F, 'Login failed.'), '')
+
+        if self.latency:
+            time.sleep(self.latency)
+        documents = []
+        for category in login:
+            for command in category:
+                payload = self.payload(command.tag)
+                if payload is None:
+                    documents.append(DOCUMENT % (error(0x0C, 'Command not supported on this server.'), ''))
+                else:
+                    documents.append(DOCUMENT % (OK, payload))
+        documents.append(DOCUMENT % (OK, ''))
+        return ''.join(documents)
+
+
+    def redfish(self, path, authorization):
+        """
+        Returns the HTTP status and JSON document of a Redfish GET, collections accept $expand=.
+        """
+        self.requests += 1
+        expected = 'Basic ' + base64.b64encode(('%s:%s' % (self.login, self.password)).encode()).decode()
+        if authorization != expected:
+            return 401, {'error': {'code': 'iLO.0.10.ExtendedInfo'}}
+        if self._redfish is None:
+            self._redfish = self.redfish_resources()
+        path, _, query = path.partition('?')
+        document = self._redfish.get(path)
+        if document is None:
+            return 404, {'error': {'code': 'Base.1.4.ResourceMissingAtURI'}}
+        if self.latency:
+            time.sleep(self.latency)
+        if '$expand=.' in query and 'Members' in document:
+            document = dict(document, Members=[self._redfish[member['@odata.id']] for member in document['Members']])
+        return 200, document
+
+    def redfish_resources(self):
+        """
+        Builds the Redfish documents of the board from its fixture, keyed by path
+        """
+        root = etree.fromstring(self.embedded_health)
+        resources = {}
+
+        def values(element):
+            return dict((child.tag, child.get('VALUE')) for child in element)
+
+        def number(value):
+            try:
+                return int(value.split()[0])
+            except (AttributeError, ValueError):
+                return None
+
+        def add(path, document):
+            document['@odata.id'] = path
+            resources[path] = document
+            return {'@odata.id': path}
+
+        def collection(path, members):
+            return add(path, {'Members': members, 'Members@odata.count': len(members)})
+
+        system = '/redfish/v1/Systems/1/'
+        chassis = '/redfish/v1/Chassis/1/'
+        manager = '/redfish/v1/Managers/1/'
+        health = root.find('HEALTH_AT_A_GLANCE')
+        add(system, {'Id': '1', 'Model': self.product_name, 'SerialNumber': 'CZJ3100XXX',
+                     'HostName': 'fake-%s.example.com' % self.management_processor.lower(), 'PowerState': 'On',
+                     'Oem': {'Hpe': {'AggregateHealthStatus': dict(
+                         (AGGREGATE_HEALTH[element.tag], {'Status': {'Health': element.get('STATUS')}})
+                         for element in (health if health is not None else []) if element.get('STATUS'))}}})
+        add(manager, {'Id': '1', 'Model': self.management_processor.replace('iLO', 'iLO '),
+                      'FirmwareVersion': '%s v%s' % (self.management_processor.replace('iLO', 'iLO '),
+                                                     self.firmware_version)})
+        collection(manager + 'EthernetInterfaces/', [add(manager + 'EthernetInterfaces/1/', {
+            'Id': '1', 'Name': 'Manager Dedicated Network Interface', 'LinkStatus': 'LinkUp',
+            'MACAddress': '00:11:22:33:44:ff', 'IPv4Addresses': [{'Address': '127.0.0.1'}],
+            'Status': {'Health': 'OK', 'State': 'Enabled'}})])
+
+        fans = [values(fan) for fan in root.findall('FANS/FAN')]
+        temperatures = [values(temp) for temp in root.findall('TEMPERATURE/TEMP')]
+        add(chassis + 'Thermal/', {
+            'Fans': [{'Name': fan['LABEL'], 'Reading': number(fan['SPEED']), 'ReadingUnits': 'Percent',
+                      'Status': REDFISH_STATUS[fan['STATUS']]} for fan in fans],
+            'Temperatures': [{'Name': temp['LABEL'], 'PhysicalContext': temp['LOCATION'],
+                              'ReadingCelsius': number(temp['CURRENTREADING']),
+                              'UpperThresholdCritical': number(temp['CAUTION']),
+                              'UpperThresholdFatal': number(temp['CRITICAL']),
+                              'Status': REDFISH_STATUS[temp['STATUS']]} for temp in temperatures]})
+
+        supplies = [values(supply) for supply in root.findall('POWER_SUPPLIES/SUPPLY')]
+        add(chassis + 'Power/', {
+            'PowerControl': [{'PowerConsumedWatts': 141, 'PowerMetrics': {
+                'AverageConsumedWatts': 139, 'MaxConsumedWatts': 220, 'MinConsumedWatts': 120}}],
+            'PowerSupplies': [{'Model': supply['MODEL'], 'SparePartNumber': supply['SPARE'],
+                               'SerialNumber': supply['SERIAL_NUMBER'], 'FirmwareVersion': supply['FIRMWARE_VERSION'],
+                               'PowerCapacityWatts': number(supply['CAPACITY']),
+                               'Status': REDFISH_STATUS[supply['STATUS']],
+                               'Oem': {'Hpe': {'BayNumber': number(supply['LABEL'].split()[-1])}}}
+                              for supply in supplies if supply['LABEL'].startswith('Power Supply')],
+            'Oem': {'Hpe': {'SmartStorageBattery': [
+                {'Index': number(supply['LABEL'].split()[-1]), 'Model': supply['MODEL'],
+                 'SparePartNumber': supply['SPARE'], 'SerialNumber': supply['SERIAL_NUMBER'],
+                 'FirmwareVersion': supply['FIRMWARE_VERSION'], 'MaximumCapWatts': number(supply['CAPACITY']),
+                 'Status': REDFISH_STATUS[supply['STATUS']]}
+                for supply in supplies if supply['LABEL'].startswith('Battery')]}}})
+
+        processors = [values(processor) for processor in root.findall('PROCESSORS/PROCESSOR')]
+        collection(system + 'Processors/', [add(system + 'Processors/%d/' % index, {
+            'Id': str(index), 'Socket': processor['LABEL'], 'Model': processor['NAME'].strip(),
+            'MaxSpeedMHz': number(processor['SPEED']), 'Status': REDFISH_STATUS[processor['STATUS']]})
+            for index, processor in enumerate(processors, 1)])
+
+        summary = root.find('MEMORY/MEMORY_DETAILS_SUMMARY')
+        details = root.find('MEMORY/MEMORY_DETAILS')
+        dimms = []
+        for element in (details if details is not None else []):
+            dimm = values(element)
+            cpu = number(element.tag.split('_')[1])
+            slot = number(dimm['SOCKET'])
+            present = dimm['STATUS'] != 'Not Present'
+            document = {'Id': 'proc%ddimm%d' % (cpu, slot), 'MemoryLocation': {'Socket': cpu, 'Slot': slot},
+                        'Status': REDFISH_STATUS[dimm['STATUS']],
+                        'Oem': {'Hpe': {'DIMMStatus': 'GoodInUse' if present else 'NotPresent'}}}
+            if present:
+                document['Oem']['Hpe'].update({
+                    'Attributes': ['HpeSmartMemory'] if dimm['HP_SMART_MEMORY'] == 'Yes' else [],
+                    'MinimumVoltageVoltsX10': int(float(dimm['MINIMUM_VOLTAGE'].split()[0]) * 10)})
+                document.update({'CapacityMiB': number(dimm['SIZE']), 'OperatingSpeedMhz': number(dimm['FREQUENCY']),
+                                 'PartNumber': element.find('PART').get('NUMBER'), 'RankCount': number(dimm['RANKS']),
+                                 'BaseModuleType': dimm['TECHNOLOGY'], 'MemoryDeviceType': dimm['TYPE'].split()[-1]})
+            dimms.append(add(system + 'Memory/%s/' % document['Id'], document))
+        collection(system + 'Memory/', dimms)
+        resources[system + 'Memory/']['Oem'] = {'Hpe': {'MemoryList': [
+            {'BoardCpuNumber': number(cpu.tag.split('_')[1]), 'BoardNumberOfSockets': number(values(cpu)['NUMBER_OF_SOCKETS']),
+             'BoardTotalMemorySize': number(values(cpu)['TOTAL_MEMORY_SIZE']) * 1024,
+             'BoardOperationalFrequency': number(values(cpu)['OPERATING_FREQUENCY']),
+             'BoardOperationalVoltage': int(float(values(cpu)['OPERATING_VOLTAGE'].split()[0]) * 1000)}
+            for cpu in (summary if summary is not None else [])]}}
+
+        nics = [values(nic) for nic in root.findall('NIC_INFORMATION/NIC')]
+        collection(system + 'EthernetInterfaces/', [add(system + 'EthernetInterfaces/%d/' % index, {
+            'Id': str(index), 'Name': nic['LOCATION'], 'MACAddress': nic['MAC_ADDRESS'],
+            'LinkStatus': 'LinkUp' if nic['STATUS'] == 'OK' else None,
+            'IPv4Addresses': [{'Address': nic['IP_ADDRESS']}] if nic['IP_ADDRESS'] != 'N/A' else [],
+            'Status': REDFISH_STATUS[nic['STATUS']]}) for index, nic in enumerate(nics, 1)])
+
+        controllers = []
+        for c, element in enumerate(root.findall('STORAGE/CONTROLLER'), 1):
+            controller = values(element)
+            path = system + 'SmartStorage/ArrayControllers/%d/' % c
+            disks = []
+            lds = []
+            for l, ld_element in enumerate(element.iter('LOGICAL_DRIVE'), 1):
+                ld = values(ld_element)
+                members = []
+                for pd_element in ld_element.iter('PHYSICAL_DRIVE'):
+                    pd = values(pd_element)
+                    disk = add(path + 'DiskDrives/%d/' % (len(disks) + 1), {
+                        'Model': pd['MODEL'], 'CapacityMiB': number(pd['CAPACITY']) * 1024,
+                        'Location': pd['LOCATION'], 'SerialNumber': pd['SERIAL_NUMBER'],
+                        'Status': REDFISH_STATUS[pd['STATUS']]})
+                    disks.append(disk)
+                    members.append(disk)
+                data_drives = collection(path + 'LogicalDrives/%d/DataDrives/' % l, members)
+                lds.append(add(path + 'LogicalDrives/%d/' % l, {
+                    'LogicalDriveNumber': number(ld['LABEL']), 'CapacityMiB': number(ld['CAPACITY']) * 1024,
+                    'Raid': ld['FAULT_TOLERANCE'].split('/')[0].replace('RAID ', ''),
+                    'Status': REDFISH_STATUS[ld['STATUS']], 'Links': {'DataDrives': data_drives}}))
+            enclosures = [add(path + 'StorageEnclosures/%d/' % e, {
+                'Location': values(enclosure)['LABEL'], 'Status': REDFISH_STATUS[values(enclosure)['STATUS']]})
+                for e, enclosure in enumerate(element.iter('DRIVE_ENCLOSURE'), 1)]
+            controllers.append(add(path, {
+                'Id': str(c), 'Location': controller['LABEL'].replace('Controller in ', ''),
+                'Model': controller['MODEL'], 'SerialNumber': controller['SERIAL_NUMBER'],
+                'Status': REDFISH_STATUS[controller['STATUS']],
+                'CacheModuleStatus': {'Health': controller['CACHE_MODULE_STATUS']},
+                'Links': {'LogicalDrives': collection(path + 'LogicalDrives/', lds),
+                          'PhysicalDrives': collection(path + 'DiskDrives/', disks),
+                          'StorageEnclosures': collection(path + 'StorageEnclosures/', enclosures)}}))
+        collection(system + 'SmartStorage/ArrayControllers/', controllers)
+        return resources
+
+
+def make_certificate(directory):
+    """
+    Writes a self-signed certificate and its key to cert.pem in directory, like the one of a new iLO
+    """
+    certfile = os.path.join(directory, 'cert.pem')
+    subprocess.check_call(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+                           '-subj', '/CN=fake-ilo', '-keyout', certfile, '-out', certfile],
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    return certfile
+
+
+class FakeIloHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body go out in separate writes, kept-alive Redfish connections would wait for delayed ACKs
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('ascii', 'replace')
+        data = self.server.ilo.respond(body).encode('ascii')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/xml')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(b'%x\r\n%s\r\n0\r\n\r\n' % (len(data), data))
+        self.close_connection = True
+
+    def do_GET(self):
+        # Redfish, answered on a kept-alive connection
+        status, document = self.server.ilo.redfish(self.path, self.headers.get('Authorization'))
+        data = json.dumps(document).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeIloServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, ilo, address='127.0.0.1', port=0, certfile=None):
+        HTTPServer.__init__(self, (address, port), FakeIloHandler)
+        self.ilo = ilo
+        self._certdir = None
+        if certfile is None:
+            self._certdir = tempfile.mkdtemp()
+            certfile = make_certificate(self._certdir)
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(certfile)
+        self.socket = context.wrap_socket(self.socket, server_side=True)
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._certdir is not None:
+            shutil.rmtree(self._certdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serves synthetic iLO responses over HTTPS, RIBCL and Redfish')
+    parser.add_argument('--address', type=str, default='127.0.0.1', help='address to serve on')
+    parser.add_argument('--port', type=int, default=8443, help='port to bind')
+    parser.add_argument('--fixture', type=str, default='ilo4', choices=sorted(BOARDS), help='board to replay')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds to wait before answering a request')
+    parser.add_argument('--blade', action='store_true', help='answer GET_OA_INFO like a blade server')
+    args = parser.parse_args()
+
+    server = FakeIloServer(FakeIlo(args.fixture, latency=args.latency, blade=args.blade), args.address, args.port)
+    print('Fake %s on https://%s:%d (login admin/admin)' % (args.fixture, args.address, server.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+"""
+Generates the synthetic GET_EMBEDDED_HEALTH_DATA fixtures replayed by fake_ilo.py
+
+The sections and fields of each generation follow python-hpilo's parser and the
+iLO3, iLO4 and iLO5 scripting guides; the values are made up. These are not
+captures of real boards. Run it again after changing the layouts below:
+
+    python benchmarks/make_fixtures.py
+"""
+from __future__ import print_function
+import os
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def value(tag, val, unit=None):
+    if unit:
+        return '<%s VALUE = "%s" UNIT="%s"/>' % (tag, val, unit)
+    return '<%s VALUE = "%s"/>' % (tag, val)
+
+
+def fans(count):
+    out = ['<FANS>']
+    for i in range(1, count + 1):
+        out += ['<FAN>', value('ZONE', 'System'), value('LABEL', 'Fan %d' % i), value('STATUS', 'OK'),
+                value('SPEED', 19 + i, 'Percentage'), '</FAN>']
+    out.append('</FANS>')
+    return out
+
+
+def temperature(count):
+    out = ['<TEMPERATURE>']
+    for i in range(1, count + 1):
+        out += ['<TEMP>', value('LABEL', '%02d-Sensor %d' % (i, i)), value('LOCATION', 'System'),
+                value('STATUS', 'OK' if i % 5 else 'Not Installed'),
+                value('CURRENTREADING', 20 + i % 40 if i % 5 else 'N/A', 'Celsius' if i % 5 else None),
+                value('CAUTION', 70, 'Celsius'), value('CRITICAL', 100, 'Celsius'), '</TEMP>']
+    out.append('</TEMPERATURE>')
+    return out
+
+
+def power_supplies(count, battery):
+    out = ['<POWER_SUPPLIES>', '<POWER_SUPPLY_SUMMARY>', value('PRESENT_POWER_READING', '141 Watts'),
+           value('POWER_MANAGEMENT_CONTROLLER_FIRMWARE_VERSION', '1.0.9'),
+           value('POWER_SYSTEM_REDUNDANCY', 'Redundant'), value('HIGH_EFFICIENCY_MODE', 'Balanced'),
+           '</POWER_SUPPLY_SUMMARY>']
+    for i in range(1, count + 1):
+        out += ['<SUPPLY>', value('LABEL', 'Power Supply %d' % i), value('PRESENT', 'Yes'),
+                value('STATUS', 'Good, In Use'), value('PDS', 'Yes'), value('HOTPLUG_CAPABLE', 'Yes'),
+                value('MODEL', '656362-B21'), value('SPARE', '660184-001'),
+                value('SERIAL_NUMBER', '5BXRA0D4D6G0%02d' % i), value('CAPACITY', '460 Watts'),
+                value('FIRMWARE_VERSION', '1.00'), '</SUPPLY>']
+    if battery:
+        out += ['<SUPPLY>', value('LABEL', 'Battery 1'), value('PRESENT', 'Yes'), value('STATUS', 'OK'),
+                value('MODEL', '727258-B21'), value('SPARE', '815983-001'),
+                value('SERIAL_NUMBER', '6EZBP0FB2110XX'), value('CAPACITY', '96 Watts'),
+                value('FIRMWARE_VERSION', '1.1'), '</SUPPLY>']
+    out.append('</POWER_SUPPLIES>')
+    return out
+
+
+def processors(count, name):
+    out = ['<PROCESSORS>']
+    for i in range(1, count + 1):
+        out += ['<PROCESSOR>', value('LABEL', 'Proc %d' % i), value('NAME', ' %s      ' % name),
+                value('STATUS', 'OK'), value('SPEED', '2500 MHz'),
+                value('EXECUTION_TECHNOLOGY', '6/6 cores; 12 threads'),
+                value('MEMORY_TECHNOLOGY', '64-bit Capable'), value('INTERNAL_L1_CACHE', '192 KB'),
+                value('INTERNAL_L2_CACHE', '1536 KB'), value('INTERNAL_L3_CACHE', '15360 KB'), '</PROCESSOR>']
+    out.append('</PROCESSORS>')
+    return out
+
+
+def memory(cpus, sockets, technology):
+    out = ['<MEMORY>', '<ADVANCED_MEMORY_PROTECTION>', value('AMP_MODE_STATUS', 'Advanced ECC'),
+           value('CONFIGURED_AMP_MODE', 'Advanced ECC'), '</ADVANCED_MEMORY_PROTECTION>',
+           '<MEMORY_DETAILS_SUMMARY>']
+    for cpu in range(1, cpus + 1):
+        out += ['<CPU_%d>' % cpu, value('NUMBER_OF_SOCKETS', sockets), value('TOTAL_MEMORY_SIZE', '%d GB' % (sockets * 4)),
+                value('OPERATING_FREQUENCY', '1333 MHz'), value('OPERATING_VOLTAGE', '1.35 v'), '</CPU_%d>' % cpu]
+    out += ['</MEMORY_DETAILS_SUMMARY>', '<MEMORY_DETAILS>']
+    for cpu in range(1, cpus + 1):
+        for socket in range(1, sockets + 1):
+            present = socket % 3 != 0
+            out += ['<CPU_%d>' % cpu, value('SOCKET', socket), value('STATUS', 'Good, In Use' if present else 'Not Present'),
+                    value('HP_SMART_MEMORY', 'Yes' if present else 'N/A'),
+                    '<PART NUMBER = "%s"/>' % ('647650-071' if present else 'N/A'),
+                    value('TYPE', 'DIMM DDR3' if present else 'N/A'), value('SIZE', '8192 MB' if present else 'N/A'),
+                    value('FREQUENCY', '1333 MHz' if present else 'N/A'),
+                    value('MINIMUM_VOLTAGE', '1.35 v' if present else 'N/A'),
+                    value('RANKS', 2 if present else 'N/A'),
+                    value('TECHNOLOGY', technology if present else 'N/A'), '</CPU_%d>' % cpu]
+    out += ['</MEMORY_DETAILS>', '</MEMORY>']
+    return out
+
+
+def nics(count):
+    out = ['<NIC_INFORMATION>']
+    for i in range(1, count + 1):
+        out += ['<NIC>', value('NETWORK_PORT', 'Port %d' % i), value('PORT_DESCRIPTION', 'N/A'),
+                value('LOCATION', 'Embedded' if i == 1 else 'Slot %d' % i),
+                value('MAC_ADDRESS', '00:11:22:33:44:%02x' % i),
+                value('IP_ADDRESS', '10.0.0.%d' % i if i == 1 else 'N/A'),
+                value('STATUS', 'OK' if i == 1 else 'Unknown'), '</NIC>']
+    out.append('</NIC_INFORMATION>')
+    return out
+
+
+def storage(controllers, lds, pds):
+    out = ['<STORAGE>']
+    bay = 0
+    for c in range(1, controllers + 1):
+        out += ['<CONTROLLER>', value('LABEL', 'Controller in Slot %d' % c), value('STATUS', 'OK'),
+                value('CONTROLLER_STATUS', 'OK'), value('SERIAL_NUMBER', 'PBKUC0BRH6V%03d' % c),
+                value('MODEL', 'Smart Array P420i Controller'), value('FW_VERSION', '8.00'),
+                value('CACHE_MODULE_STATUS', 'OK'), value('CACHE_MODULE_SERIAL_NUM', 'PBKUD0BRH6V%03d' % c),
+                value('CACHE_MODULE_MEMORY', '1048576 KB'), value('ENCRYPTED_CNTLR_MODE', 'Not Enabled')]
+        for e in range(1, 3):
+            out += ['<DRIVE_ENCLOSURE>', value('LABEL', 'Port %dI Box %d' % (e, e)), value('STATUS', 'OK'),
+                    value('DRIVE_BAY', '%02d' % (pds * lds // 2 + 1)), '</DRIVE_ENCLOSURE>']
+        for ld in range(1, lds + 1):
+            out += ['<LOGICAL_DRIVE>', value('LABEL', '%02d' % ld), value('STATUS', 'OK'),
+                    value('CAPACITY', '279 GiB'), value('FAULT_TOLERANCE', 'RAID 1/RAID 1+0'),
+                    value('LOGICAL_DRIVE_TYPE', 'Data LUN'), value('ENCRYPTION_STATUS', 'Not Encrypted')]
+            for pd in range(1, pds + 1):
+                bay += 1
+                location = 'Port %dI Box %d Bay %d' % (1 + bay % 2, 1 + bay % 2, bay)
+                out += ['<PHYSICAL_DRIVE>', value('LABEL', location),
+                        value('STATUS', 'OK' if bay % 17 else 'Rebuilding'),
+                        value('SERIAL_NUMBER', 'KXH4%06d' % bay), value('MODEL', 'EG0300FCSPH'),
+                        value('CAPACITY', '279 GiB'), value('LOCATION', location), value('FW_VERSION', 'HPD9'),
+                        value('DRIVE_CONFIGURATION', 'Configured'), value('ENCRYPTION_STATUS', 'Not Encrypted'),
+                        value('MEDIA_TYPE', 'HDD'), '</PHYSICAL_DRIVE>']
+            out.append('</LOGICAL_DRIVE>')
+        out.append('</CONTROLLER>')
+    out += ['<DISCOVERY_STATUS>', value('STATUS', 'Discovery Complete'), '</DISCOVERY_STATUS>', '</STORAGE>']
+    return out
+
+
+def health_at_a_glance(sections):
+    out = ['<HEALTH_AT_A_GLANCE>']
+    for section in sections:
+        out.append('<%s STATUS= "OK"/>' % section)
+    out += ['<FANS REDUNDANCY= "Redundant"/>', '</HEALTH_AT_A_GLANCE>']
+    return out
+
+
+def firmware(ilo_version):
+    return ['<FIRMWARE_INFORMATION>', '<INDEX_1>', value('FIRMWARE_NAME', 'iLO'),
+            value('FIRMWARE_VERSION', ilo_version), '</INDEX_1>', '<INDEX_2>',
+            value('FIRMWARE_NAME', 'System ROM'), value('FIRMWARE_VERSION', 'P70 02/17/2017'), '</INDEX_2>',
+            '</FIRMWARE_INFORMATION>']
+
+
+def embedded_health(body):
+    return '\r\n'.join(['<GET_EMBEDDED_HEALTH_DATA>'] + body + ['</GET_EMBEDDED_HEALTH_DATA>']) + '\r\n'
+
+
+LAYOUTS = {
+    # iLO3 has no storage or NIC data in its embedded health
+    'ilo3': lambda: embedded_health(
+        fans(6) + temperature(20) + ['<VRM>', '</VRM>'] + power_supplies(2, False) +
+        processors(2, 'Intel(R) Xeon(R) CPU E5620 @ 2.40GHz') + memory(2, 9, 'RDIMM') + firmware('1.88 Jul 13 2016') +
+        health_at_a_glance(['BIOS_HARDWARE', 'FANS', 'TEMPERATURE', 'POWER_SUPPLIES', 'PROCESSOR', 'MEMORY'])),
+    'ilo4': lambda: embedded_health(
+        fans(7) + temperature(40) + power_supplies(2, False) +
+        processors(2, 'Intel(R) Xeon(R) CPU E5-2640 0 @ 2.50GHz') + memory(2, 12, 'RDIMM') + nics(4) +
+        storage(1, 1, 2) + firmware('2.55 Aug 16 2017') +
+        health_at_a_glance(['BIOS_HARDWARE', 'FANS', 'TEMPERATURE', 'POWER_SUPPLIES', 'PROCESSOR', 'MEMORY',
+                            'NETWORK', 'STORAGE'])),
+    'ilo5': lambda: embedded_health(
+        fans(6) + temperature(50) + power_supplies(2, True) +
+        processors(2, 'Intel(R) Xeon(R) Gold 6130 CPU @ 2.10GHz') + memory(2, 12, 'RDIMM, DDR4') + nics(4) +
+        storage(1, 1, 2) + firmware('1.40 Jan 14 2019') +
+        health_at_a_glance(['BIOS_HARDWARE', 'FANS', 'TEMPERATURE', 'POWER_SUPPLIES', 'BATTERY', 'PROCESSOR',
+                            'MEMORY', 'NETWORK', 'STORAGE'])),
+    # storage node: 4 Smart Array controllers with 96 physical drives each
+    'ilo4_large': lambda: embedded_health(
+        fans(7) + temperature(60) + power_supplies(4, False) +
+        processors(2, 'Intel(R) Xeon(R) CPU E5-2640 v4 @ 2.40GHz') + memory(2, 12, 'RDIMM') + nics(8) +
+        storage(4, 12, 8) + firmware('2.55 Aug 16 2017') +
+        health_at_a_glance(['BIOS_HARDWARE', 'FANS', 'TEMPERATURE', 'POWER_SUPPLIES', 'PROCESSOR', 'MEMORY',
+                            'NETWORK', 'STORAGE'])),
+}
+
+
+def main():
+    for name, layout in sorted(LAYOUTS.items()):
+        path = os.path.join(FIXTURES_DIR, '%s.xml' % name)
+        with open(path, 'w') as f:
+            f.write(layout())
+        print('wrote %s' % path)
+
+
+if __name__ == '__main__':
+    main()
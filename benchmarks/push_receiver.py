@@ -0,0 +1,218 @@
+"""
+Local stand-in for the receivers of --push-url: a Prometheus remote write endpoint and a Pushgateway
+
+Remote write requests are decoded and their series kept, Pushgateway groups are
+replaced on PUT and deleted on DELETE. The next failures requests can be
+answered with an error status, to watch the exporter retry and drop.
+
+    python benchmarks/push_receiver.py --port 9091 --fail 3 --fail-status 503
+"""
+from __future__ import print_function
+import argparse
+import struct
+import threading
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    # Python 3
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+
+
+def _varint(data, position):
+    value = shift = 0
+    while True:
+        byte = bytearray(data[position:position + 1])[0]
+        position += 1
+        value |= (byte & 0x7f) << shift
+        shift += 7
+        if byte < 0x80:
+            return value, position
+
+
+def snappy_decompress(data):
+    """
+    Decompresses a snappy block, literals and copies
+    """
+    length, position = _varint(data, 0)
+    data = bytearray(data)
+    out = bytearray()
+    while position < len(data):
+        tag = data[position]
+        position += 1
+        kind = tag & 3
+        if kind == 0:
+            size = tag >> 2
+            if size >= 60:
+                count = size - 59
+                size = sum(byte << (8 * index) for index, byte in enumerate(data[position:position + count]))
+                position += count
+            size += 1
+            out += data[position:position + size]
+            position += size
+            continue
+        if kind == 1:
+            size = (tag >> 2 & 7) + 4
+            offset = (tag >> 5) << 8 | data[position]
+            position += 1
+        elif kind == 2:
+            size = (tag >> 2) + 1
+            offset = struct.unpack_from('<H', data, position)[0]
+            position += 2
+        else:
+            size = (tag >> 2) + 1
+            offset = struct.unpack_from('<I', data, position)[0]
+            position += 4
+        # copies may overlap what they produce
+        for index in range(size):
+            out.append(out[-offset])
+    if len(out) != length:
+        raise ValueError("snappy block of {} bytes decompressed to {}".format(length, len(out)))
+    return bytes(out)
+
+
+def _fields(data):
+    position = 0
+    while position < len(data):
+        key, position = _varint(data, position)
+        number, wire_type = key >> 3, key & 7
+        if wire_type == 2:
+            size, position = _varint(data, position)
+            yield number, data[position:position + size]
+            position += size
+        elif wire_type == 1:
+            yield number, struct.unpack_from('<d', data, position)[0]
+            position += 8
+        elif wire_type == 0:
+            value, position = _varint(data, position)
+            yield number, value
+        else:
+            raise ValueError("unexpected wire type {}".format(wire_type))
+
+
+def decode_write_request(data):
+    """
+    Returns the (labels, samples) of a WriteRequest, labels a dict and samples a list of (value, timestamp)
+    """
+    timeseries = []
+    for number, encoded in _fields(data):
+        labels = {}
+        samples = []
+        for field, value in _fields(encoded):
+            if field == 1:
+                label = dict(_fields(value))
+                labels[label[1].decode('utf-8')] = label[2].decode('utf-8')
+            elif field == 2:
+                sample = dict(_fields(value))
+                samples.append((sample.get(1, 0.0), sample.get(2, 0)))
+        timeseries.append((labels, samples))
+    return timeseries
+
+
+class PushHandler(BaseHTTPRequestHandler):
+
+    def _answer(self, status):
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def _failing(self):
+        with self.server.lock:
+            if self.server.fail <= 0:
+                return False
+            self.server.fail -= 1
+        self._answer(self.server.fail_status)
+        return True
+
+    def _body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+    def do_POST(self):
+        body = self._body()
+        if self._failing():
+            return
+        try:
+            timeseries = decode_write_request(snappy_decompress(body))
+        except (ValueError, IndexError, KeyError, struct.error) as e:
+            print('malformed write request: %s' % e)
+            self._answer(400)
+            return
+        with self.server.lock:
+            self.server.requests += 1
+            self.server.timeseries.extend(timeseries)
+        self._answer(204)
+
+    def do_PUT(self):
+        body = self._body()
+        if self._failing():
+            return
+        with self.server.lock:
+            self.server.requests += 1
+            self.server.groups[self.path] = body.decode('utf-8')
+        self._answer(200)
+
+    def do_DELETE(self):
+        if self._failing():
+            return
+        with self.server.lock:
+            self.server.requests += 1
+            self.server.groups.pop(self.path, None)
+        self._answer(202)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class PushReceiver(ThreadingMixIn, HTTPServer):
+    """
+    Receives remote write requests on any POST path and Pushgateway groups on PUT and DELETE
+    """
+    daemon_threads = True
+
+    def __init__(self, address='127.0.0.1', port=0, fail=0, fail_status=503, verbose=False):
+        HTTPServer.__init__(self, (address, port), PushHandler)
+        self.fail = fail
+        self.fail_status = fail_status
+        self.verbose = verbose
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.timeseries = []
+        self.groups = {}
+
+    @property
+    def url(self):
+        return 'http://%s:%d' % self.server_address
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Receives the pushes of the exporter, remote write and Pushgateway')
+    parser.add_argument('--address', type=str, default='127.0.0.1', help='address to serve on')
+    parser.add_argument('--port', type=int, default=9091, help='port to bind')
+    parser.add_argument('--fail', type=int, default=0, help='number of requests to answer with --fail-status first')
+    parser.add_argument('--fail-status', type=int, default=503, help='status of the failed requests')
+    args = parser.parse_args()
+
+    server = PushReceiver(args.address, args.port, fail=args.fail, fail_status=args.fail_status, verbose=True)
+    print('Push receiver on %s (remote write: POST /api/v1/write, Pushgateway: PUT /metrics/job/...)' % server.url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print('%d requests, %d series, %d groups' % (server.requests, len(server.timeseries), len(server.groups)))
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
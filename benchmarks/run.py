@@ -0,0 +1,231 @@
+"""
+Benchmarks the exporter against fake iLOs and writes the results as JSON
+
+For every fixture, --targets fake iLOs replaying it are started, the exporter runs in a
+subprocess with the arguments given after "--" and --concurrency clients scrape the targets
+round robin for --duration seconds. Each result has the scrape latency percentiles,
+the throughput, the exporter's CPU time per scrape and its peak RSS (from /proc, Linux only).
+
+    python benchmarks/run.py --fixture ilo4 --fixture ilo4_large --targets 20 --concurrency 10 \\
+        --latency 0.2 --duration 30 --output results.json -- --batch
+"""
+from __future__ import print_function
+import argparse
+import itertools
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from fake_ilo import BOARDS, FakeIlo, FakeIloServer, make_certificate
+
+try:
+    from urllib2 import urlopen
+except ImportError:
+    # Python 3
+    from urllib.request import urlopen
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def percentile(values, p):
+    """
+    Nearest-rank percentile of sorted values
+    """
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, int(round(p / 100.0 * len(values))) - 1))]
+
+
+def process_stats(pid):
+    """
+    Returns the CPU seconds used by process pid and its peak RSS in bytes, or (None, None) without /proc
+    """
+    try:
+        with open('/proc/%d/stat' % pid) as f:
+            # the fields after the parenthesized command name, utime and stime are the 14th and 15th
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open('/proc/%d/status' % pid) as f:
+            hwm = [line.split()[1] for line in f if line.startswith('VmHWM:')]
+    except (IOError, OSError):
+        return None, None
+    cpu = (int(fields[11]) + int(fields[12])) / float(os.sysconf('SC_CLK_TCK'))
+    return cpu, int(hwm[0]) * 1024 if hwm else None
+
+
+class Exporter(object):
+    """
+    The exporter under test, in its own process so its CPU and memory are measured alone
+    """
+
+    def __init__(self, args):
+        self.port = free_port()
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(filter(None, [os.path.join(ROOT_DIR, 'src'), env.get('PYTHONPATH')]))
+        # the exporter logs every request, a pipe nobody reads would fill up and block it
+        self.log = tempfile.TemporaryFile()
+        self.process = subprocess.Popen([sys.executable, '-m', 'hpilo_exporter.main', '--address', '127.0.0.1',
+                                         '--port', str(self.port)] + list(args),
+                                        env=env, stdout=self.log, stderr=subprocess.STDOUT)
+        deadline = time.time() + 30
+        while True:
+            try:
+                socket.create_connection(('127.0.0.1', self.port), 1).close()
+                return
+            except socket.error:
+                if self.process.poll() is not None or time.time() > deadline:
+                    self.stop()
+                    self.log.seek(0)
+                    raise RuntimeError('exporter did not start: %s' % self.log.read().decode('utf-8', 'replace'))
+                time.sleep(0.1)
+
+    def url(self, ilo_port):
+        return ('http://127.0.0.1:%d/metrics?ilo_host=127.0.0.1&ilo_port=%d&ilo_user=admin&ilo_password=admin'
+                % (self.port, ilo_port))
+
+    def stop(self):
+        if self.process.poll() is None:
+            self.process.terminate()
+        self.process.wait()
+        self.log.close()
+
+
+def scrape(url, timeout):
+    start = time.time()
+    try:
+        size = len(urlopen(url, timeout=timeout).read())
+    except Exception:
+        size = None
+    return time.time() - start, size
+
+
+def run_scenario(fixture, options, certfile):
+    ilos = [FakeIloServer(FakeIlo(fixture, latency=options.latency), certfile=certfile).start()
+            for i in range(options.targets)]
+    exporter = Exporter(options.exporter_args)
+    try:
+        urls = [exporter.url(ilo.port) for ilo in ilos]
+        for url in urls * options.warmup:
+            scrape(url, options.timeout)
+
+        latencies = []
+        sizes = []
+        errors = [0]
+        lock = threading.Lock()
+        turns = itertools.count()
+        cpu_before, rss = process_stats(exporter.process.pid)
+        started = time.time()
+        deadline = started + options.duration
+
+        def client():
+            while time.time() < deadline:
+                latency, size = scrape(urls[next(turns) % len(urls)], options.timeout)
+                with lock:
+                    if size is None:
+                        errors[0] += 1
+                    else:
+                        latencies.append(latency)
+                        sizes.append(size)
+
+        clients = [threading.Thread(target=client) for i in range(options.concurrency)]
+        for thread in clients:
+            thread.start()
+        for thread in clients:
+            thread.join()
+        elapsed = time.time() - started
+        cpu_after, rss = process_stats(exporter.process.pid)
+    finally:
+        exporter.stop()
+        for ilo in ilos:
+            ilo.stop()
+
+    latencies.sort()
+    scrapes = len(latencies)
+    return {
+        'fixture': fixture,
+        'targets': options.targets,
+        'concurrency': options.concurrency,
+        'ilo_latency': options.latency,
+        'exporter_args': list(options.exporter_args),
+        'duration': elapsed,
+        'scrapes': scrapes,
+        'errors': errors[0],
+        'throughput': scrapes / elapsed,
+        'latency_seconds': {
+            'mean': sum(latencies) / scrapes if scrapes else None,
+            'p50': percentile(latencies, 50),
+            'p90': percentile(latencies, 90),
+            'p99': percentile(latencies, 99),
+            'max': latencies[-1] if latencies else None,
+        },
+        'response_bytes': sum(sizes) / len(sizes) if sizes else None,
+        'cpu_seconds_per_scrape': (cpu_after - cpu_before) / scrapes if cpu_before is not None and scrapes else None,
+        'peak_rss_bytes': rss,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT_DIR,
+                                       stderr=subprocess.PIPE).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    argv = sys.argv[1:]
+    exporter_args = []
+    if '--' in argv:
+        exporter_args = argv[argv.index('--') + 1:]
+        argv = argv[:argv.index('--')]
+
+    parser = argparse.ArgumentParser(description='Benchmarks the exporter against fake iLOs',
+                                     usage='%(prog)s [options] [-- exporter arguments]')
+    parser.add_argument('--fixture', action='append', choices=sorted(BOARDS),
+                        help='board the fake iLOs replay, repeat for several scenarios (default: all)')
+    parser.add_argument('--targets', type=int, default=10, help='number of fake iLOs')
+    parser.add_argument('--concurrency', type=int, default=10, help='number of concurrent scrapes')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds a fake iLO waits before answering')
+    parser.add_argument('--duration', type=float, default=20, help='seconds each scenario scrapes for')
+    parser.add_argument('--warmup', type=int, default=1, help='unmeasured scrapes of each target first')
+    parser.add_argument('--timeout', type=float, default=30, help='seconds before a scrape counts as an error')
+    parser.add_argument('--output', type=str, default=None, help='file to write the JSON to instead of stdout')
+    options = parser.parse_args(argv)
+    options.exporter_args = exporter_args
+
+    certdir = tempfile.mkdtemp()
+    try:
+        certfile = make_certificate(certdir)
+        results = [run_scenario(fixture, options, certfile) for fixture in options.fixture or sorted(BOARDS)]
+    finally:
+        shutil.rmtree(certdir, ignore_errors=True)
+
+    report = {
+        'timestamp': time.time(),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'results': results,
+    }
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        print(json.dumps(report, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
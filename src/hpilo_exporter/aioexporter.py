@@ -0,0 +1,384 @@
+"""
+Asyncio server that scrapes iLOs without holding a thread per in-flight request
+
+Python 3 only, it is imported by main.py when --asyncio is given.
+"""
+import asyncio
+from collections import OrderedDict
+import os
+import signal
+import ssl
+import time
+from urllib.parse import parse_qs, urlparse
+
+import hpilo
+from prometheus_client import generate_latest, REGISTRY
+
+from hpilo_exporter import collector
+from hpilo_exporter.breaker import CircuitBreakers
+from hpilo_exporter.instrumentation import (COALESCED_SCRAPES, count_error, ILO_ERRORS, REQUEST_TIME,
+                                             SCRAPES_IN_PROGRESS, time_call)
+from hpilo_exporter.metrics import ILOMetrics
+from hpilo_exporter.pool import IloPool
+from hpilo_exporter.registry import TargetRegistry
+from hpilo_exporter.util import print_err
+
+# seconds kept back from Prometheus' scrape timeout to render and send the response
+DEADLINE_MARGIN = 0.5
+
+INDEX = b"""<html>
+<head><title>HP iLO Exporter</title></head>
+<body>
+<h1>HP iLO Exporter</h1>
+<p>Visit <a href="/metrics">Metrics</a> to use.</p>
+</body>
+</html>"""
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 500: 'Internal Server Error'}
+
+
+def split_response(data, protocol):
+    """
+    Strips the HTTP framing from an iLO response, like the end of Ilo._communicate
+    """
+    if protocol == hpilo.ILO_HTTP and data.startswith('HTTP/1.1 200'):
+        header, data = data.split('\r\n\r\n', 1)
+        header = [x.split(':', 1) for x in header.split('\r\n')[1:]]
+        header = dict([(x[0].lower(), x[1].strip()) for x in header])
+        if header.get('transfer-encoding') == 'chunked':
+            _data, data = data, ''
+            while _data:
+                clen, _data = _data.split('\r\n', 1)
+                clen = int(clen, 16)
+                if clen == 0:
+                    break
+                data += _data[:clen]
+                _data = _data[clen + 2:]
+        return header, data
+    elif data.startswith('HTTP/1.1 404'):
+        # iLO2 or older, only seen during protocol detection
+        return None, data
+    elif not data.startswith('<?xml'):
+        raise hpilo.IloError("Remote returned bogus data, maybe it's not an iLO")
+    return None, data
+
+
+async def communicate(ilo, xml, protocol, ssl_context):
+    """
+    Sends a RIBCL document to the iLO and returns the response header and body
+    """
+    try:
+        reader, writer = await asyncio.open_connection(ilo.hostname, ilo.port, ssl=ssl_context)
+    except ssl.SSLError as e:
+        raise hpilo.IloCommunicationError("Cannot establish ssl session with %s:%d: %s" % (ilo.hostname, ilo.port, e))
+    try:
+        if protocol == hpilo.ILO_HTTP:
+            writer.write(ilo.HTTP_HEADER % (len(ilo.XML_HEADER + xml), b''))
+        # XML header and data need to arrive in 2 distinct packets
+        writer.write(ilo.XML_HEADER)
+        await writer.drain()
+        writer.write(xml)
+        await writer.drain()
+
+        chunks = []
+        while True:
+            try:
+                chunk = await reader.read(65536)
+            except (ssl.SSLError, ConnectionResetError) as e:
+                # iLOs tend to drop the connection instead of closing the ssl session
+                if not chunks:
+                    raise hpilo.IloCommunicationError("Communication with %s:%d failed: %s" % (ilo.hostname, ilo.port, e))
+                break
+            if not chunk:
+                break
+            chunks.append(chunk)
+    finally:
+        writer.close()
+    return split_response(b''.join(chunks).decode('ascii', 'iloxml_replace'), protocol)
+
+
+async def respond(writer, status, body, content_type='text/plain'):
+    writer.write(('HTTP/1.1 %d %s\r\nContent-Type: %s\r\nContent-Length: %d\r\nConnection: close\r\n\r\n'
+                  % (status, REASONS[status], content_type, len(body))).encode('latin-1') + body)
+    await writer.drain()
+
+
+class AsyncILOExporterServer(object):
+    """
+    Asyncio implementation of ILOExporterServer.
+
+    Every scrape sends its queries as one batched RIBCL document over asyncio streams. At most
+    max_concurrency iLOs are queried at once and one iLO never gets two concurrent logins. A scrape
+    is cancelled once Prometheus' X-Prometheus-Scrape-Timeout-Seconds deadline passes. Concurrent
+    scrapes of the same iLO and credentials share one collection, which also answers the scrapes
+    arriving within coalesce_ttl seconds after it finished. An iLO whose circuit breaker is open
+    is answered right away with hpilo_up 0. The protocols of at most max_protocols iLOs are
+    remembered, least recently scraped first out. Parsing and rendering run in the loop's default
+    executor, so that a large response doesn't hold up the other connections.
+    """
+
+    def __init__(self, address='0.0.0.0', port=8080, endpoint="/metrics", max_concurrency=100, timeout=10,
+                 collectors=None, coalesce_ttl=0, breaker_threshold=3, breaker_backoff=15, breaker_max_backoff=600,
+                 config=None, config_check_interval=5, max_protocols=1024, pool_size=256, pool_idle_timeout=300):
+        self._address = address
+        self._port = port
+        self.endpoint = endpoint
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.collectors = collectors or list(collector.DEFAULT_COLLECTORS)
+        self._ssl_context = collector.SSL_CONTEXT
+        self._semaphore = None
+        # (ilo_host, ilo_port) -> [lock, number of scrapes holding or waiting for it], only while there are some
+        self._host_locks = {}
+        self.max_protocols = max_protocols
+        self._protocols = OrderedDict()
+        # the Ilo objects building the RIBCL documents and parsing the responses, they never connect
+        self.pool = IloPool(max_size=pool_size, idle_timeout=pool_idle_timeout, timeout=timeout)
+        self.coalesce_ttl = coalesce_ttl
+        self._flights = {}
+        self.breakers = CircuitBreakers(threshold=breaker_threshold, backoff=breaker_backoff,
+                                        max_backoff=breaker_max_backoff)
+        self.registry = None
+        if config:
+            self.registry = TargetRegistry(config, check_interval=config_check_interval)
+            self.registry.on_change(self.forget_target)
+
+    def forget_target(self, target):
+        """
+        Drops the detected protocol of a target whose --config entry changed, called from the registry's thread
+        """
+        self._protocols.pop((target.ilo_host, target.ilo_port), None)
+        self.pool.invalidate(target.ilo_host, target.ilo_port, target.ilo_user)
+
+    def print_info(self):
+        print_err("Starting asyncio exporter on: http://{}:{}{}".format(self._address, self._port, self.endpoint))
+        print_err("Press Ctrl+C to quit")
+
+    def deadline(self, headers):
+        """
+        Returns the seconds a scrape may take, from Prometheus' scrape timeout header if present
+        """
+        try:
+            return max(float(headers['x-prometheus-scrape-timeout-seconds']) - DEADLINE_MARGIN, DEADLINE_MARGIN)
+        except (KeyError, ValueError):
+            return self.timeout
+
+    async def detect_protocol(self, ilo):
+        key = (ilo.hostname, ilo.port)
+        protocol = self._protocols.pop(key, None)
+        if protocol is None:
+            header, data = await communicate(ilo, b'<RIBCL VERSION="2.0"></RIBCL>', hpilo.ILO_HTTP, self._ssl_context)
+            protocol = hpilo.ILO_HTTP if header else hpilo.ILO_RAW
+        self._protocols[key] = protocol
+        while len(self._protocols) > self.max_protocols:
+            self._protocols.popitem(last=False)
+        return protocol
+
+    async def scrape(self, ilo_host, ilo_port, ilo_user, ilo_password, collectors):
+        """
+        Collects one snapshot from an iLO
+        """
+        ilo = self.pool.acquire(ilo_host, ilo_port, ilo_user, ilo_password)
+        queries = collector.queries_for(collectors)
+        xml, processors = collector.prepare_batch(ilo, queries)
+
+        key = (ilo_host, ilo_port)
+        host_lock = self._host_locks.setdefault(key, [asyncio.Lock(), 0])
+        host_lock[1] += 1
+        try:
+            with SCRAPES_IN_PROGRESS.track_inprogress():
+                async with self._semaphore:
+                    async with host_lock[0]:
+                        protocol = await self.detect_protocol(ilo)
+                        with time_call('batch', ilo_host):
+                            header, data = await communicate(ilo, xml, protocol, self._ssl_context)
+        finally:
+            # dropped with its last user, any ilo_host scraped would stay forever otherwise
+            host_lock[1] -= 1
+            if not host_lock[1]:
+                del self._host_locks[key]
+
+        snapshot = await asyncio.get_event_loop().run_in_executor(None, self._parse, ilo, data, processors, queries,
+                                                                   collectors)
+        self.pool.release(ilo)
+        return snapshot
+
+    @staticmethod
+    def _parse(ilo, data, processors, queries, collectors):
+        results = collector.parse_batch(ilo, data, processors, queries, collector.pruned_tags(collectors))
+        return collector.build_snapshot(results, ilo.hostname)
+
+    @staticmethod
+    def render(snapshot, collectors, ilo_host, up, duration):
+        """
+        Returns the exposition of a snapshot, or of hpilo_up alone without one, run in an executor
+        """
+        metrics = ILOMetrics()
+        if snapshot is None:
+            metrics.watch_target(ilo_host, up, duration)
+        else:
+            metrics.watch_snapshot(snapshot, collectors)
+        return metrics.generate() + generate_latest(REGISTRY)
+
+    def coalesced_scrape(self, ilo_host, ilo_port, ilo_user, ilo_password, collectors, deadline):
+        """
+        Returns an awaitable of the snapshot, shared with the concurrent scrapes of the same iLO
+        """
+        key = (ilo_host, ilo_port, ilo_user, ilo_password, tuple(collectors))
+        flight = self._flights.get(key)
+        if flight is None:
+            # the first scrape's deadline bounds the collection everyone waits for
+            flight = self._flights[key] = asyncio.ensure_future(
+                asyncio.wait_for(self.scrape(ilo_host, ilo_port, ilo_user, ilo_password, collectors), deadline))
+            flight.add_done_callback(lambda flight: self._landed(key, flight))
+        else:
+            COALESCED_SCRAPES.inc()
+        # a waiter running out of time must not cancel the collection the others wait for
+        return asyncio.shield(flight)
+
+    def _landed(self, key, flight):
+        ilo_host, ilo_port = key[:2]
+        if flight.cancelled():
+            # nothing was learned about the iLO, another scrape may probe it
+            self.breakers.release(ilo_host, ilo_port)
+        elif isinstance(flight.exception(), asyncio.TimeoutError):
+            self.breakers.failure(ilo_host, ilo_port)
+        else:
+            self.breakers.record(ilo_host, ilo_port, flight.exception())
+        if flight.cancelled() or flight.exception() is not None or not self.coalesce_ttl:
+            self._forget(key, flight)
+        else:
+            asyncio.get_event_loop().call_later(self.coalesce_ttl, self._forget, key, flight)
+
+    def _forget(self, key, flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    async def metrics(self, query_components, headers):
+        """
+        Scrapes the iLO named in the query and returns the response status and body
+        """
+        start_time = time.time()
+        target_name = query_components.get('target', [''])[0]
+        if target_name:
+            target = self.registry.get(target_name) if self.registry is not None else None
+            if target is None:
+                print_err("unknown target %s" % target_name)
+                return 404, b''
+            ilo_host, ilo_port, ilo_user, ilo_password = (target.ilo_host, target.ilo_port,
+                                                          target.ilo_user, target.ilo_password)
+        else:
+            try:
+                ilo_host = query_components.get('ilo_host', [''])[0] or os.environ['ilo_host']
+                ilo_user = query_components.get('ilo_user', [''])[0] or os.environ['ilo_user']
+                ilo_password = query_components.get('ilo_password', [''])[0] or os.environ['ilo_password']
+            except KeyError as e:
+                print_err("missing parameter %s" % e)
+                return 500, b''
+            try:
+                ilo_port = int(query_components.get('ilo_port', [''])[0] or os.environ['ilo_port'])
+            except KeyError:
+                ilo_port = 443
+            except ValueError as e:
+                print_err("invalid ilo_port: {}".format(e))
+                return 400, b''
+        collectors = self.collectors
+        if 'collect[]' in query_components:
+            try:
+                collectors = collector.select_collectors(query_components['collect[]'])
+            except ValueError as e:
+                print_err(e)
+                return 500, b''
+
+        loop = asyncio.get_event_loop()
+        if not self.breakers.allow(ilo_host, ilo_port):
+            return 200, await loop.run_in_executor(None, self.render, None, collectors, ilo_host, False,
+                                                   time.time() - start_time)
+
+        deadline = self.deadline(headers)
+        try:
+            snapshot = await asyncio.wait_for(
+                self.coalesced_scrape(ilo_host, ilo_port, ilo_user, ilo_password, collectors, deadline), deadline)
+        except asyncio.TimeoutError:
+            ILO_ERRORS.labels(ilo_host=ilo_host, error='timeout').inc()
+            print_err("ILO {} did not answer within {:.1f}s".format(ilo_host, deadline))
+            return 500, b''
+        except hpilo.IloLoginFailed as e:
+            count_error(ilo_host, e)
+            print_err("ILO login failed")
+            return 500, b''
+        except OSError as e:
+            count_error(ilo_host, e)
+            print_err("ILO invalid address or port: {}".format(e))
+            return 500, b''
+        except hpilo.IloError as e:
+            count_error(ilo_host, e)
+            print_err(e)
+            return 500, b''
+
+        REQUEST_TIME.observe(time.time() - start_time)
+        return 200, await loop.run_in_executor(None, self.render, snapshot, collectors, ilo_host, True, 0)
+
+    async def handle(self, reader, writer):
+        try:
+            request_line = (await reader.readline()).decode('latin-1').split()
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+
+            content_type = 'text/plain'
+            if len(request_line) < 2 or request_line[0] != 'GET':
+                status, body = 400, b''
+            else:
+                url = urlparse(request_line[1])
+                if url.path == self.endpoint:
+                    status, body = await self.metrics(parse_qs(url.query), headers)
+                elif url.path == '/':
+                    status, body, content_type = 200, INDEX, 'text/html'
+                else:
+                    status, body = 404, b''
+
+            await respond(writer, status, body, content_type)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as e:
+            print_err("handling a request failed: {!r}".format(e))
+            try:
+                await respond(writer, 500, b'')
+            except ConnectionError:
+                pass
+        finally:
+            writer.close()
+            # Python 3.7 and later
+            if hasattr(writer, 'wait_closed'):
+                try:
+                    await writer.wait_closed()
+                except (ConnectionError, ssl.SSLError):
+                    pass
+
+    def run(self):
+        self.print_info()
+
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        server = loop.run_until_complete(asyncio.start_server(self.handle, self._address, self._port))
+        if self.registry is not None:
+            print_err("Serving {} targets from {}".format(len(self.registry), self.registry.path))
+            self.registry.start()
+            loop.add_signal_handler(signal.SIGHUP, self.registry.request_reload)
+
+        try:
+            loop.run_forever()
+        except KeyboardInterrupt:
+            print_err("Killing exporter")
+        finally:
+            if self.registry is not None:
+                self.registry.stop()
+            server.close()
+            loop.run_until_complete(server.wait_closed())
+            loop.close()
@@ -0,0 +1,125 @@
+"""
+Per-target circuit breakers, so unreachable iLOs fail fast instead of holding a thread for their timeout
+"""
+import threading
+import time
+
+from hpilo_exporter.instrumentation import BREAKER_STATE, enable, error_kind
+
+CLOSED = 0
+OPEN = 1
+HALF_OPEN = 2
+
+# errors meaning the iLO is unreachable, a failed login proves it answers
+TRIPPING_ERRORS = ('timeout', 'communication')
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of scraping a target whose breaker is open
+    """
+
+
+class _Breaker(object):
+    __slots__ = ('state', 'failures', 'backoff', 'retry_at', 'probing')
+
+    def __init__(self):
+        self.state = CLOSED
+        self.failures = 0
+        self.backoff = 0
+        self.retry_at = 0
+        # whether the probe of the half-open breaker is running
+        self.probing = False
+
+
+class CircuitBreakers(object):
+    """
+    Opens the breaker of a target after threshold consecutive timeouts or communication errors.
+
+    While open, scrapes of the target are refused. Once backoff seconds passed one scrape is let
+    through as a probe, and the others are refused until it is over: its success closes the breaker,
+    its failure opens it again for twice as long, up to max_backoff. Only a success closes a breaker,
+    an error that doesn't trip it, such as a failed login, lets the next scrape probe again.
+    A threshold of 0 disables the breakers.
+    """
+
+    def __init__(self, threshold=3, backoff=15, max_backoff=600):
+        self.threshold = threshold
+        self.base_backoff = backoff
+        self.max_backoff = max_backoff
+        self._breakers = {}
+        self._lock = threading.Lock()
+        if threshold:
+            enable(BREAKER_STATE)
+
+    def _set_state(self, ilo_host, breaker, state):
+        breaker.state = state
+        BREAKER_STATE.labels(ilo_host=ilo_host).set(state)
+
+    def allow(self, ilo_host, ilo_port):
+        """
+        Tells whether the target may be scraped now, letting one probe through once the backoff is over
+        """
+        if not self.threshold:
+            return True
+        with self._lock:
+            breaker = self._breakers.get((ilo_host, ilo_port))
+            if breaker is None or breaker.state == CLOSED:
+                return True
+            if breaker.probing or time.time() < breaker.retry_at:
+                return False
+            breaker.probing = True
+            self._set_state(ilo_host, breaker, HALF_OPEN)
+            return True
+
+    def record(self, ilo_host, ilo_port, error=None):
+        """
+        Records the outcome of a scrape of the target, error is the exception it raised if any
+        """
+        if error is None:
+            self.success(ilo_host, ilo_port)
+        elif error_kind(error) in TRIPPING_ERRORS:
+            self.failure(ilo_host, ilo_port)
+        else:
+            self.release(ilo_host, ilo_port)
+
+    def release(self, ilo_host, ilo_port):
+        """
+        Ends a probe whose outcome says nothing about the reachability of the target, the next scrape probes again
+        """
+        with self._lock:
+            breaker = self._breakers.get((ilo_host, ilo_port))
+            if breaker is not None:
+                breaker.probing = False
+
+    def success(self, ilo_host, ilo_port):
+        with self._lock:
+            breaker = self._breakers.pop((ilo_host, ilo_port), None)
+            if breaker is not None:
+                self._set_state(ilo_host, breaker, CLOSED)
+
+    def failure(self, ilo_host, ilo_port):
+        if not self.threshold:
+            return
+        key = (ilo_host, ilo_port)
+        with self._lock:
+            breaker = self._breakers.get(key)
+            if breaker is None:
+                breaker = self._breakers[key] = _Breaker()
+            elif breaker.state == OPEN:
+                # a scrape that started before the breaker opened
+                return
+            breaker.probing = False
+            breaker.failures += 1
+            if breaker.state == HALF_OPEN:
+                breaker.backoff = min(breaker.backoff * 2, self.max_backoff)
+            elif breaker.failures >= self.threshold:
+                breaker.backoff = self.base_backoff
+            else:
+                return
+            breaker.retry_at = time.time() + breaker.backoff
+            self._set_state(ilo_host, breaker, OPEN)
+
+    def state(self, ilo_host, ilo_port):
+        breaker = self._breakers.get((ilo_host, ilo_port))
+        return CLOSED if breaker is None else breaker.state
@@ -0,0 +1,335 @@
+"""
+Fetches data from an iLO, either one query per round trip or batched into one RIBCL document
+"""
+from _socket import gaierror
+import re
+import ssl
+import hpilo
+
+from hpilo_exporter.instrumentation import count_error, SCRAPES_IN_PROGRESS, time_call
+
+# (result key, hpilo.Ilo method) in the order they are sent to the iLO
+QUERIES = [
+    ('product_name', 'get_product_name'),
+    ('server_name', 'get_server_name'),
+    ('host_data', 'get_host_data'),
+    ('embedded_health', 'get_embedded_health'),
+    ('host_power_status', 'get_host_power_status'),
+    ('fw_version', 'get_fw_version'),
+    ('oa_info', 'get_oa_info'),
+]
+
+# queries only sent when a collector asks for them
+OPTIONAL_QUERIES = [
+    ('power_readings', 'get_power_readings'),
+]
+
+# queries whose results change with every scrape, the others only on hardware or firmware maintenance
+LIVE_QUERIES = [query for query in QUERIES + OPTIONAL_QUERIES
+                if query[0] in ('embedded_health', 'host_power_status', 'power_readings')]
+INVENTORY_QUERIES = [query for query in QUERIES if query not in LIVE_QUERIES]
+
+# results every snapshot needs for its labels
+LABEL_KEYS = ('product_name', 'server_name', 'host_data')
+
+# collector name -> (result keys, GET_EMBEDDED_HEALTH_DATA elements) it reads, see metrics.SECTIONS
+COLLECTORS = {
+    'health': (('embedded_health',), ('HEALTH_AT_A_GLANCE',)),
+    'battery': (('embedded_health',), ('POWER_SUPPLIES',)),
+    'storage': (('embedded_health',), ('STORAGE',)),
+    'temperature': (('embedded_health',), ('TEMPERATURE',)),
+    'processor': (('embedded_health',), ('PROCESSORS',)),
+    'memory': (('embedded_health',), ('MEMORY',)),
+    'fan': (('embedded_health',), ('FANS',)),
+    'power_supply': (('embedded_health',), ('POWER_SUPPLIES',)),
+    'running': (('host_power_status',), ()),
+    'nic': (('embedded_health', 'fw_version'), ('NIC_INFORMATION',)),
+    'firmware': (('fw_version',), ()),
+    'oa': (('oa_info',), ()),
+    'power': (('power_readings',), ()),
+}
+
+# everything but power, whose readings cost an extra query
+DEFAULT_COLLECTORS = ['health', 'battery', 'storage', 'temperature', 'processor', 'memory', 'fan',
+                      'power_supply', 'running', 'nic', 'firmware', 'oa']
+
+HEALTH_TAGS = sorted(set(tag for keys, tags in COLLECTORS.values() for tag in tags))
+
+# errors that mean the whole target is unusable, not just one query
+FATAL_ERRORS = (hpilo.IloLoginFailed, hpilo.IloCommunicationError, gaierror)
+
+
+def create_ssl_context():
+    # iLOs ship self-signed certificates, so the peer is not verified
+    ssl_context = ssl.create_default_context(ssl.Purpose.SERVER_AUTH)
+    # Sadly, ancient iLO's aren't dead yet, so let's enable sslv3 by default
+    ssl_context.options &= ~ssl.OP_NO_SSLv3
+    ssl_context.check_hostname = False
+    ssl_context.verify_mode = ssl.CERT_NONE
+    ssl_context.set_ciphers(('ECDH+AESGCM:DH+AESGCM:ECDH+AES256:DH+AES256:ECDH+AES128:DH+AES:ECDH+HIGH:'
+                             'DH+HIGH:ECDH+3DES:DH+3DES:RSA+AESGCM:RSA+AES:RSA+HIGH:RSA+3DES:!aNULL:'
+                             '!eNULL:!MD5'))
+    return ssl_context
+
+
+# shared by all connections, building a context and loading its ciphers is not free
+SSL_CONTEXT = create_ssl_context()
+
+
+def connect(ilo_host, ilo_port, ilo_user, ilo_password, timeout=10):
+    return hpilo.Ilo(hostname=ilo_host,
+                     login=ilo_user,
+                     password=ilo_password,
+                     port=ilo_port, timeout=timeout, ssl_context=SSL_CONTEXT)
+
+
+def select_collectors(names):
+    """
+    Validates a list of collector names, possibly comma separated, None or empty selects DEFAULT_COLLECTORS
+    """
+    collectors = [name.strip() for value in names or [] for name in value.split(',') if name.strip()]
+    unknown = [name for name in collectors if name not in COLLECTORS]
+    if unknown:
+        raise ValueError("unknown collector %s" % ', '.join(unknown))
+    return collectors or list(DEFAULT_COLLECTORS)
+
+
+def queries_for(collectors):
+    """
+    Returns the queries the collectors need, in the order of QUERIES
+    """
+    keys = set(LABEL_KEYS)
+    for name in collectors:
+        keys.update(COLLECTORS[name][0])
+    return [query for query in QUERIES + OPTIONAL_QUERIES if query[0] in keys]
+
+
+def pruned_tags(collectors):
+    """
+    Returns the GET_EMBEDDED_HEALTH_DATA elements none of the collectors reads
+    """
+    kept = set(tag for name in collectors for tag in COLLECTORS[name][1])
+    return [tag for tag in HEALTH_TAGS if tag not in kept]
+
+
+def prune_embedded_health(data, tags):
+    """
+    Cuts the given top level elements out of a GET_EMBEDDED_HEALTH_DATA response before python-hpilo parses it
+    """
+    if '<GET_EMBEDDED_HEALTH_DATA' not in data:
+        return data
+    for tag in tags:
+        # the sections have no attributes, the HEALTH_AT_A_GLANCE entries of the same name do
+        data = re.sub(r'<%s>.*?</%s>\s*' % (tag, tag), '', data, count=1, flags=re.DOTALL)
+    return data
+
+
+def fetch_sequential(ilo, queries=QUERIES):
+    """
+    Runs every query in its own round trip.
+
+    :return: dict of result key to parsed result, or to the exception the query raised
+    """
+    results = {}
+    for key, method in queries:
+        try:
+            with time_call(method, ilo.hostname):
+                results[key] = getattr(ilo, method)()
+        except FATAL_ERRORS as e:
+            count_error(ilo.hostname, e)
+            raise
+        except Exception as e:
+            count_error(ilo.hostname, e)
+            results[key] = e
+    return results
+
+
+def prepare_batch(ilo, queries=QUERIES):
+    """
+    Queues queries with python-hpilo's delayed mode.
+
+    :return: the serialized RIBCL document and the processors that parse each query's response
+    """
+    ilo.delayed = True
+    try:
+        for key, method in queries:
+            getattr(ilo, method)()
+        root, inner = ilo._elements
+        processors = ilo._processors
+    finally:
+        ilo._elements = None
+        ilo._processors = []
+        ilo.delayed = False
+
+    if hasattr(hpilo.etree, 'tostringlist'):
+        xml = b"\r\n".join(hpilo.etree.tostringlist(root)) + b'\r\n'
+    else:
+        xml = hpilo.etree.tostring(root)
+    return xml, processors
+
+
+def answers(message, processor):
+    """
+    Tells whether a response document carries the payload a query's processor expects
+    """
+    if getattr(processor[0], '__name__', None) != '_process_info_tag':
+        return True
+    returntags = processor[1]
+    if not isinstance(returntags, (list, tuple)):
+        returntags = [returntags]
+    return any(message.find(tag) is not None for tag in returntags)
+
+
+def parse_batch(ilo, data, processors, queries=QUERIES, prune=()):
+    """
+    Parses the response to a document built by prepare_batch.
+
+    Unlike Ilo.call_delayed, a query answered with an error status only fails its own
+    result instead of the whole batch, so e.g. get_oa_info on a rack server does not
+    throw away the embedded health data.
+
+    :param prune: GET_EMBEDDED_HEALTH_DATA elements to drop unparsed
+    :return: dict of result key to parsed result, or to the exception the query raised
+    """
+    # the response is one RIBCL document per query, in the order they were sent. A payload is matched
+    # to its query by its tag, so a missing or extra document doesn't shift the later results
+    results = {}
+    pending = list(zip([key for key, method in queries], processors))
+    while data and pending:
+        pos = data.find('<?xml', 5)
+        if pos == -1:
+            chunk, data = data, None
+        else:
+            chunk, data = data[:pos], data[pos:]
+        if prune:
+            chunk = prune_embedded_health(chunk, prune)
+        try:
+            message = ilo._parse_message(chunk)
+        except hpilo.IloLoginFailed:
+            raise
+        except hpilo.IloError as e:
+            # an error status doesn't name its command, it answers the first query still waiting
+            key, processor = pending.pop(0)
+            results[key] = e
+            continue
+        # _parse_message returns None for documents without a payload
+        if message is None:
+            continue
+        for index, (key, processor) in enumerate(pending):
+            if answers(message, processor):
+                break
+        else:
+            continue
+        # the queries before it got no answer of their own
+        for skipped, _ in pending[:index]:
+            results[skipped] = hpilo.IloError("No response to %s" % skipped)
+        del pending[:index + 1]
+        try:
+            results[key] = processor[0](message, *processor[1:])
+        except Exception as e:
+            results[key] = e
+
+    for key, processor in pending:
+        results[key] = hpilo.IloError("No response to %s" % key)
+    return results
+
+
+def fetch_batched(ilo, queries=QUERIES, prune=()):
+    """
+    Sends all queries in one RIBCL document.
+
+    :return: dict of result key to parsed result, or to the exception the query raised
+    """
+    if not queries:
+        return {}
+    xml, processors = prepare_batch(ilo, queries)
+    try:
+        if not ilo.protocol:
+            ilo._detect_protocol()
+        with time_call('batch', ilo.hostname):
+            header, data = ilo._communicate(xml, ilo.protocol)
+        return parse_batch(ilo, data, processors, queries, prune)
+    except Exception as e:
+        count_error(ilo.hostname, e)
+        raise
+
+
+def fetch(ilo, queries, batched=False, prune=()):
+    """
+    Runs queries with fetch_batched or fetch_sequential, only a batch is pruned.
+
+    ilo is an hpilo.Ilo, or another backend with its attributes, query methods and a fetch(queries, prune)
+    of its own, see redfish.RedfishClient
+    """
+    if not isinstance(ilo, hpilo.Ilo):
+        return ilo.fetch(queries, prune)
+    if batched:
+        return fetch_batched(ilo, queries, prune)
+    return fetch_sequential(ilo, queries)
+
+
+def result(results, key, default=None):
+    """
+    Returns the result of one query, or default if the query failed
+    """
+    value = results.get(key, default)
+    if isinstance(value, Exception):
+        return default
+    return value
+
+
+def collect(ilo, ilo_host, batched=False, inventory=None, collectors=None):
+    """
+    Queries an iLO and returns a snapshot dict the ILOMetrics.watch_* methods consume
+
+    :param inventory: an InventoryCache, when given only LIVE_QUERIES are sent while it has the iLO's inventory
+    :param collectors: names of the COLLECTORS to query data for, DEFAULT_COLLECTORS if None. Batched
+                       scrapes also skip parsing the embedded health sections no collector reads.
+    """
+    with SCRAPES_IN_PROGRESS.track_inprogress():
+        return _collect(ilo, ilo_host, batched, inventory, collectors or DEFAULT_COLLECTORS)
+
+
+def _collect(ilo, ilo_host, batched, inventory, collectors):
+    queries = queries_for(collectors)
+    prune = pruned_tags(collectors)
+
+    cached = inventory.lookup(ilo) if inventory is not None else None
+    if cached is None:
+        if inventory is not None:
+            # the cached inventory serves every selection, so it is always fetched whole
+            queries = queries + [query for query in INVENTORY_QUERIES if query not in queries]
+        results = fetch(ilo, queries, batched, prune)
+        if inventory is not None:
+            inventory.store(ilo.hostname, ilo.port, results)
+    else:
+        results = fetch(ilo, [query for query in queries if query in LIVE_QUERIES], batched, prune)
+        results.update(cached)
+    return build_snapshot(results, ilo_host)
+
+
+def build_snapshot(results, ilo_host):
+    """
+    Turns the results of fetch_sequential or fetch_batched into a snapshot dict
+    """
+    # embedded health is the payload of a scrape, there is nothing to export without it
+    if isinstance(results.get('embedded_health'), Exception):
+        raise results['embedded_health']
+
+    server_name = result(results, 'server_name') or ilo_host
+    try:
+        server_serial_num = [d["Serial Number"] for d in results['host_data'] if "Serial Number" in d][1]
+    except Exception:
+        server_serial_num = "Unknown Serial Number"
+
+    return {
+        'ilo_host': ilo_host,
+        'product_name': result(results, 'product_name', "Unknown HP Server"),
+        'server_name': server_name,
+        'server_serial_num': server_serial_num,
+        'embedded_health': results.get('embedded_health'),
+        'host_power_status': result(results, 'host_power_status'),
+        'fw_version': result(results, 'fw_version'),
+        'oa_info': result(results, 'oa_info'),
+        'power_readings': result(results, 'power_readings'),
+    }
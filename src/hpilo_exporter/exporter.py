@@ -3,29 +3,51 @@ Pulls data from specified iLO and presents as Prometheus metrics
 """
 from __future__ import print_function
 from _socket import gaierror
-import sys
+import hashlib
 import hpilo
-import ssl
+import json
 import time
 import os
-from prometheus_client import generate_latest, Summary, Gauge, CollectorRegistry, REGISTRY
+import signal
+import socket
+import threading
+from multiprocessing.pool import ThreadPool
+from prometheus_client import generate_latest, REGISTRY
+
+from hpilo_exporter import collector
+from hpilo_exporter.breaker import CircuitBreakers, CircuitOpenError
+from hpilo_exporter.instrumentation import COALESCED_SCRAPES, REQUEST_TIME
+from hpilo_exporter.inventory import InventoryCache
+from hpilo_exporter.journal import EventJournal, read_events
+from hpilo_exporter.metrics import GroupMetrics, ILOMetrics, RenderCache
+from hpilo_exporter.poller import Poller, Target
+from hpilo_exporter.pool import IloPool
+from hpilo_exporter.push import Pusher, Pushgateway, RemoteWrite
+from hpilo_exporter.registry import TargetRegistry
+from hpilo_exporter.singleflight import SingleFlight
+from hpilo_exporter.stream import accepts_gzip, ChunkedWriter
+from hpilo_exporter.store import HostSeries
+from hpilo_exporter.util import print_err
+from hpilo_exporter.workers import FORWARD_TIMEOUT, HashRing, multiprocess_registry, reuse_port, Supervisor
 
 try:
     from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from httplib import HTTPConnection, HTTPException
     from SocketServer import ThreadingMixIn
     from urllib2 import build_opener, Request, HTTPHandler
-    from urllib import quote_plus
+    from urllib import quote_plus, urlencode
     from urlparse import parse_qs, urlparse
 except ImportError:
     # Python 3
+    from http.client import HTTPConnection, HTTPException
     from http.server import BaseHTTPRequestHandler, HTTPServer
     from socketserver import ThreadingMixIn
     from urllib.request import build_opener, Request, HTTPHandler
-    from urllib.parse import quote_plus, parse_qs, urlparse
+    from urllib.parse import quote_plus, parse_qs, urlencode, urlparse
 
 
-def print_err(*args, **kwargs):
-    print(*args, file=sys.stderr, **kwargs)
+# request headers a worker passes on with a request for an iLO another worker owns
+FORWARDED_HEADERS = ('Accept-Encoding', 'If-None-Match', 'X-Prometheus-Scrape-Timeout-Seconds')
 
 
 class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
@@ -33,260 +55,264 @@ class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
     timeout = 30
 
 
-def translate(st):
-    if st.upper() in ['OK', 'GOOD, IN USE', 'ON']:
-        return 0
-    elif st.upper() == 'DEGRADED':
-        return 1
-    elif st.upper() in ['OFF'] or st in ['Permanent Failure']:
-        return 2
-    elif st.upper() == 'ABSENT':
-        return -1
-    else:
-        return 3
-
-
 class RequestHandler(BaseHTTPRequestHandler):
     """
     Endpoint handler
     """
-    # P is all metrics prefix
-    P = 'hpilo_'
 
     def __init__(self, request, client_address, server):
-
-        self.registry = None
-        self.registry = CollectorRegistry(self)
-        self.process_registry = REGISTRY
-        self.gauges = {
-            'vrm': Gauge(self.P + 'vrm_status', 'HP iLO vrm status',
-                         ["product_name", "server_name", "server_serial_num"], registry=self.registry),
-            'drive': Gauge(self.P + 'drive_status', 'HP iLO drive status',
-                           ["product_name", "server_name", "server_serial_num"], registry=self.registry),
-            'battery': Gauge(self.P + 'battery_status', 'HP iLO battery status',
-                             ["product_name", "server_name", "server_serial_num"], registry=self.registry),
-            'battery_detail': Gauge(self.P + 'battery_detail', 'HP iLO battery detailed status', ["label", "present", "model", "spare", "serial_number", "capacity", "firmware_version", "product_name", "server_name", "server_serial_num"], registry=self.registry),
-            'storage': Gauge(self.P + 'storage_status', 'HP iLO storage status',
-                             ["product_name", "server_name", "server_serial_num"], registry=self.registry),
-            'fans': Gauge(self.P + 'fans_status', 'HP iLO all fans status',
-                          ["product_name", "server_name", "server_serial_num"], registry=self.registry),
-            'bios_hardware': Gauge(self.P + 'bios_hardware_status', 'HP iLO bios_hardware status',
-                                   ["product_name", "server_name", "server_serial_num"], registry=self.registry),
-            'memory': Gauge(self.P + 'memory_status', 'HP iLO memory status',
-                            ["product_name", "server_name", "server_serial_num"], registry=self.registry),
-            'memory_detail': Gauge(self.P + 'memory_detail_status', 'HP iLO memory detailed status',
-                                   ["product_name", "server_name", "server_serial_num", "cpu_id", "socket_id", "frequency", "hp_smart_memory", "minimum_voltage", "part_number", "ranks", "size", "technology", "mem_type"], registry=self.registry),
-            'memory_detail_summary': Gauge(self.P + 'memory_detail_summary', 'HP iLO memory Summary',
-                                           ["product_name", "server_name", "server_serial_num", "cpu_id", "operating_frequency", "operating_voltage"], registry=self.registry),
-            'power_supplies': Gauge(self.P + 'power_supplies_status', 'HP iLO power_supplies status',
-                                    ["product_name", "server_name", "server_serial_num"], registry=self.registry),
-            'power_supplies_readings': Gauge(self.P + 'power_supplies_readings', 'HP iLO power_supplies readings',
-                                             ["product_name", "server_name", "server_serial_num"], registry=self.registry),
-            'processor': Gauge(self.P + 'processor_status', 'HP iLO processor status',
-                               ["product_name", "server_name", "server_serial_num"], registry=self.registry),
-            'processor_detail': Gauge(self.P + 'processor_detail_status', 'HP iLO processor detailed status',
-                               ["product_name", "server_name", "server_serial_num", "cpu_id", "name", "speed"], registry=self.registry),
-            'network': Gauge(self.P + 'network_status', 'HP iLO network status',
-                             ["product_name", "server_name", "server_serial_num"], registry=self.registry),
-            'temperature': Gauge(self.P + 'temperature_status', 'HP iLO temperature status',
-                                 ["product_name", "server_name", "server_serial_num"], registry=self.registry),
-            'firmware_version': Gauge(self.P + 'firmware_version', 'HP iLO firmware version',
-                                      ["product_name", "server_name", "server_serial_num"], registry=self.registry),
-            'nic_status': Gauge(self.P + 'nic_status', 'HP iLO NIC status',
-                                ["product_name", "server_name", "nic_name", "ip_address", "server_serial_num"], registry=self.registry),
-            'storage_cache_health': Gauge(self.P + 'storage_cache_health_status', 'Cache Module status',
-                                          ["product_name", "server_name", "controller", "server_serial_num"], registry=self.registry),
-            'storage_controller_health': Gauge(self.P + 'storage_controller_health_status', 'Controller status',
-                                               ["product_name", "server_name", "controller", "server_serial_num"], registry=self.registry),
-            'storage_enclosure_health': Gauge(self.P + 'storage_enclosure_health_status', 'Enclosure status',
-                                              ["product_name", "server_name", "controller", "enc", "server_serial_num"],
-                                              registry=self.registry),
-            'storage_ld_health': Gauge(self.P + 'storage_ld_health_status', 'LD status',
-                                       ["product_name", "server_name", "controller", "logical_drive", "server_serial_num"],
-                                       registry=self.registry),
-            'storage_pd_health': Gauge(self.P + 'storage_pd_health_status', 'PD status',
-                                       ["product_name", "server_name", "controller", "logical_drive", "physical_drive", "server_serial_num"],
-                                       registry=self.registry),
-            'temperature_value': Gauge(self.P + 'temperature_value', 'Temperature value',
-                                       ["product_name", "server_name", "sensor", "server_serial_num"], registry=self.registry),
-            'fan': Gauge(self.P + 'fan_status', 'HP iLO one fan status',
-                         ["product_name", "server_name", "fan", "server_serial_num"], registry=self.registry),
-            'fan_speed': Gauge(self.P + 'fan_speed', 'HP iLO one fan value',
-                               ["product_name", "server_name", "fan", "server_serial_num"], registry=self.registry),
-            'power_supply': Gauge(self.P + 'power_supply_status', 'HP iLO one power supply power',
-                                  ["product_name", "server_name", "ps", "server_serial_num"], registry=self.registry),
-            'running': Gauge(self.P + 'running_status', 'HP iLO running status',
-                             ["product_name", "server_name", "server_serial_num"], registry=self.registry),
-            'oa_info': Gauge(self.P + 'onboard_administrator_info', 'HP iLO OnBoard Administrator Info',
-                             ["product_name", "server_name", "oa_ip", "encl", "location_bay", "server_serial_num"], registry=self.registry),
-        }
+        self.metrics = None
+        self.process_registry = server.process_registry
+        self.collectors = None
         BaseHTTPRequestHandler.__init__(self, request, client_address, server)
 
-    def watch_health_at_glance(self):
-        health_at_glance = self.embedded_health['health_at_a_glance']
-        if health_at_glance is not None:
-            for key, value in health_at_glance.items():
-                for status in value.items():
-                    if status[0] == 'status':
-                        health = status[1].upper()
-                        self.gauges[key].labels(product_name=self.product_name,
-                                                server_name=self.server_name, server_serial_num=self.server_serial_num).set(translate(health))
-
-    def watch_temperature(self):
-        temperature_values = self.embedded_health.get('temperature', {})
-        if temperature_values is not None:
-            for t_key, t_value in temperature_values.items():
-                s_name = t_key
-                s_value = t_value.get('currentreading', 'N/A')
-                if type(s_value[0]) is int:
-                    self.gauges['temperature_value'].labels(product_name=self.product_name,
-                                                            server_name=self.server_name,
-                                                            server_serial_num=self.server_serial_num,
-                                                            sensor=s_name).set(int(s_value[0]))
-
-    def watch_processor(self):
-        processors_values = self.embedded_health.get('processors', {})
-        if processors_values is not None:
-            for p_key, p_value in processors_values.items():
-                s_cpuid = p_key
-                s_name = p_value.get('name', 'N/A') 
-                s_speed = p_value.get('speed', 'N/A')
-                s_status = p_value.get('status', 'N/A')
-                self.gauges["processor_detail"].labels(product_name=self.product_name, server_name=self.server_name, server_serial_num=self.server_serial_num, cpu_id=s_cpuid.split()[1], name=s_name.strip(), speed=s_speed).set(translate(s_status))
-
-    def watch_memory(self):
-        memory_values = self.embedded_health.get('memory', {}).get('memory_details', {})
-        if memory_values is not None:
-            for cpu_key, cpu_value in memory_values.items():
-                for socket_key, socket_value in cpu_value.items():
-                    s_status = socket_value.get('status', 'N/A')
-                    if s_status != "Not Present":
-                        socket_id = socket_value.get('socket', 'N/A')
-                        frequency = socket_value.get('frequency', 'N/A')
-                        hp_smart_memory = socket_value.get('hp_smart_memory', 'N/A')
-                        minimum_voltage = socket_value.get('minimum_voltage', 'N/A')
-                        part_number = socket_value.get('part', {}).get('number', 'N/A')
-                        ranks = socket_value.get('ranks', 'N/A')
-                        size = socket_value.get('size', 'N/A')
-                        technology = socket_value.get('technology', 'N/A')
-                        memory_type = socket_value.get('type', 'N/A')
-                        self.gauges["memory_detail"].labels(product_name=self.product_name, server_name=self.server_name, server_serial_num=self.server_serial_num, cpu_id=cpu_key, socket_id=socket_id, frequency=frequency, hp_smart_memory=hp_smart_memory, minimum_voltage=minimum_voltage, part_number=part_number, ranks=ranks, size=size, technology=technology, mem_type=memory_type).set(translate(s_status))
-
-    def watch_memory_summary(self):
-        memory_values = self.embedded_health.get('memory', {})
-        if memory_values is not None:
-            memory_details_summary = self.embedded_health.get('memory', {}).get('memory_details_summary', {})
-            if memory_details_summary is not None:
-               for cpu_idx, cpu in memory_details_summary.items():
-                   total_memory_size = 0 if (cpu['total_memory_size'] == 'N/A') else int(cpu['total_memory_size'].split()[0])
-                   self.gauges["memory_detail_summary"].labels(product_name=self.product_name, server_name=self.server_name, server_serial_num=self.server_serial_num, cpu_id=cpu_idx.split("_")[1], operating_frequency=cpu['operating_frequency'], operating_voltage=cpu['operating_voltage']).set(total_memory_size)
-
-    def watch_fan(self):
-        fan_values = self.embedded_health.get('fans', {})
-        if fan_values is not None:
-            for f_key, f_value in fan_values.items():
-                s_name = f_key
-                s_speed = f_value.get('speed', 'N/A')
-                s_status = f_value.get('status', 'N/A')
-                if type(s_speed[0]) is int:
-                    self.gauges['fan_speed'].labels(product_name=self.product_name,
-                                                    server_name=self.server_name,
-                                                    server_serial_num=self.server_serial_num,
-                                                    fan=s_name).set(int(s_speed[0]))
-                self.gauges['fan'].labels(product_name=self.product_name,
-                                          server_name=self.server_name,
-                                          server_serial_num=self.server_serial_num,
-                                          fan=s_name).set(translate(s_status))
-
-    def watch_ps(self):
-        ps_values = self.embedded_health.get('power_supplies', {})
-        if ps_values is not None:
-            for p_key, p_value in ps_values.items():
-                s_name = p_key
-                s_value = p_value.get('status', 'ABSENT')
-                self.gauges['power_supply'].labels(product_name=self.product_name,
-                                                   server_name=self.server_name,
-                                                   server_serial_num=self.server_serial_num,
-                                                   ps=s_name).set(translate(s_value))
-
-        ps_readings_values = self.embedded_health.get('power_supply_summary', {})
-        if ps_readings_values is not None:
-            if 'present_power_reading' in ps_readings_values:
-                # TODO: implement error handling
-                readings = ps_readings_values['present_power_reading']
-                self.gauges["power_supplies_readings"].labels(product_name=self.product_name, server_name=self.server_name, server_serial_num=self.server_serial_num).set(int(readings.split()[0]))
-
-    def watch_battery(self):
-        power_supplies = self.embedded_health.get('power_supplies', {})
-        if power_supplies is not None:
-            if 'Battery 1' in power_supplies:
-                batt = power_supplies['Battery 1']
-                label_b = batt['label']
-                present_b = batt['present']
-                status_b = batt['status']
-                model_b = batt['model']
-                spare_b = batt['spare']
-                serial_number_b = batt['serial_number']
-                capacity_b = batt['capacity']
-                firmware_version_b = batt['firmware_version']
-                self.gauges["battery_detail"].labels(label=label_b, present=present_b, model=model_b, spare=spare_b, serial_number=serial_number_b, capacity=capacity_b, firmware_version=firmware_version_b, product_name=self.product_name, server_name=self.server_name, server_serial_num=self.server_serial_num).set(translate(status_b))
-
-    def watch_disks(self):
-        storage_health = self.embedded_health.get('storage', {})
-        if storage_health is not None:
-            for c_key, c_value in storage_health.items():
-                c_model = c_key + ', ' + c_value.get('model', '')
-                cache_health = c_value.get('cache_module_status', 'absent')
-                self.gauges['storage_cache_health'].labels(product_name=self.product_name,
-                                                           server_name=self.server_name,
-                                                           server_serial_num=self.server_serial_num,
-                                                           controller=c_model).set(
-                    translate(cache_health))
-                controller_health = c_value.get('controller_status', 'unknown')
-                self.gauges['storage_controller_health'].labels(product_name=self.product_name, server_name=self.server_name, server_serial_num=self.server_serial_num, controller=c_model).set(translate(controller_health))
-                e_key = 0
-                enlist = c_value.get('drive_enclosures', [])
-                if enlist is not None:
-                    for e_value in enlist:
-                        enclosure_health = e_value.get('status', 'unknown')
-                        self.gauges['storage_enclosure_health'].labels(product_name=self.product_name,
-                                                                       server_name=self.server_name,
-                                                                       server_serial_num=self.server_serial_num, controller=c_model, enc=e_key).set(translate(enclosure_health))
-                        e_key = e_key + 1
-                ld_list = c_value.get('logical_drives', [])
-                if ld_list is not None:
-                    ld_key = 0
-                    for ld_value in ld_list:
-                        ld_status = ld_value.get('status', 'unknown')
-                        ld_name = 'LD_' + str(ld_key) + ', ' + ld_value.get('capacity', '') + ', ' + ld_value.get(
-                            'fault_tolerance', '')
-                        self.gauges['storage_ld_health'].labels(product_name=self.product_name,
-                                                                server_name=self.server_name,
-                                                                server_serial_num=self.server_serial_num,
-                                                                controller=c_model,
-                                                                logical_drive=ld_name).set(
-                            translate(ld_status))
-
-                        pd_list = ld_value.get('physical_drives', [])
-                        if pd_list is not None:
-                            pd_key = 0
-                            for pd_value in pd_list:
-                                pd_status = pd_value.get('status', 'unknown')
-                                pd_name = pd_value.get('model', '') + ', ' + pd_value.get('capacity', '') + ', ' + \
-                                          pd_value.get('location', 'N' + str(pd_key))
-                                self.gauges['storage_pd_health'].labels(product_name=self.product_name,
-                                                                        server_name=self.server_name,
-                                                                        server_serial_num=self.server_serial_num,
-                                                                        controller=c_model,
-                                                                        logical_drive=ld_name,
-                                                                        physical_drive=pd_name).set(
-                                    translate(pd_status))
-                                pd_key = pd_key + 1
-                        ld_key = ld_key + 1
-
-    def return_error(self):
-        self.send_response(500)
+    def publish_metrics(self):
+        # generate and publish metrics
+        metrics = self.metrics.generate()
+        process_metrics = generate_latest(self.process_registry)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain')
+        self.end_headers()
+        self.wfile.write(metrics)
+        self.wfile.write(process_metrics)
+
+    def stream_metrics(self, snapshot, start_time, polled=False, ilo_host=None):
+        """
+        Writes the metrics of snapshot to the client section by section instead of rendering them first.
+
+        With a render cache, the iLO's gauges are rendered first, mostly from the cache, and tagged with a
+        weak ETag: a client sending it back in If-None-Match gets a 304 while they don't change.
+        """
+        self.metrics = ILOMetrics()
+        parts = None
+        if self.server.renders is not None and ilo_host:
+            parts = []
+            self.metrics.stream(snapshot, parts.append, self.collectors, self.server.renders.families(ilo_host))
+            # the snapshot age and the exporter's own metrics change every time, they aren't part of the tag
+            etag = 'W/"{}"'.format(hashlib.md5(b''.join(parts)).hexdigest())
+            if etag in [tag.strip() for tag in self.headers.get('If-None-Match', '').split(',')]:
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.end_headers()
+                REQUEST_TIME.observe(time.time() - start_time)
+                return snapshot
+
+        gzip = accepts_gzip(self.headers.get('Accept-Encoding'))
+        # HTTP/1.0 clients get a body delimited by the end of the connection
+        chunked = self.request_version == 'HTTP/1.1'
+        if chunked:
+            self.protocol_version = 'HTTP/1.1'
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain')
+        if gzip:
+            self.send_header('Content-Encoding', 'gzip')
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        if parts is not None:
+            self.send_header('ETag', etag)
+        self.send_header('Connection', 'close')
+        self.end_headers()
+
+        out = ChunkedWriter(self.wfile, chunked=chunked, gzip=gzip)
+        if parts is not None:
+            for part in parts:
+                out.write(part)
+        else:
+            self.metrics.stream(snapshot, out.write, self.collectors)
+        if polled:
+            self.metrics.watch_poll(snapshot)
+
+        # get the amount of time the request took
+        REQUEST_TIME.observe(time.time() - start_time)
+
+        out.write(self.metrics.generate())
+        out.write(generate_latest(self.process_registry))
+        out.close()
+
+    def return_error(self, status=500):
+        self.send_response(status)
+        self.end_headers()
+
+    def forward(self, ilo_host):
+        """
+        Passes the request on to the worker owning ilo_host, so that the same process and its sessions
+        and caches serve every scrape of an iLO
+
+        :return: False if this process owns ilo_host, or doesn't run as a worker
+        """
+        if self.server.ring is None:
+            return False
+        owner = self.server.ring.node(ilo_host)
+        if owner == self.server.worker_index:
+            return False
+        headers = dict((name, self.headers.get(name)) for name in FORWARDED_HEADERS if self.headers.get(name))
+        try:
+            response, body = self.fetch(owner, self.path, headers)
+        except (socket.error, HTTPException) as e:
+            print_err("passing the scrape of {} to worker {} failed: {}".format(ilo_host, owner, e))
+            self.return_error()
+            return True
+        self.send_response(response.status)
+        for name in ('Content-Type', 'Content-Encoding', 'ETag'):
+            if response.getheader(name):
+                self.send_header(name, response.getheader(name))
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        return True
+
+    def fetch(self, owner, path, headers=None):
+        """
+        Sends a GET of path to the worker owner, returns the response and its body
+        """
+        connection = HTTPConnection('127.0.0.1', self.server.peers[owner], timeout=FORWARD_TIMEOUT)
+        try:
+            connection.request('GET', path, headers=headers or {})
+            response = connection.getresponse()
+            return response, response.read()
+        finally:
+            connection.close()
+
+    def scrape(self, ilo_host, ilo_port, ilo_user, ilo_password):
+        """
+        Collects a snapshot of one iLO, shared with the concurrent scrapes of the same iLO and credentials
+
+        :raises CircuitOpenError: if the iLO failed too often lately and is not probed yet
+        """
+        if not self.server.breakers.allow(ilo_host, ilo_port):
+            raise CircuitOpenError("circuit breaker of {}:{} is open".format(ilo_host, ilo_port))
+        key = (ilo_host, ilo_port, ilo_user, ilo_password, tuple(self.collectors))
+        snapshot, shared = self.server.flights.do(key, self._scrape, ilo_host, ilo_port, ilo_user, ilo_password)
+        if shared:
+            COALESCED_SCRAPES.inc()
+            # a probe answered with a recent result learned nothing, the next scrape probes again
+            self.server.breakers.release(ilo_host, ilo_port)
+        return snapshot
+
+    def _scrape(self, ilo_host, ilo_port, ilo_user, ilo_password):
+        try:
+            with self.server.pool.session(ilo_host, ilo_port, ilo_user, ilo_password) as ilo:
+                snapshot = collector.collect(ilo, ilo_host, batched=self.server.batch,
+                                             inventory=self.server.inventory, collectors=self.collectors)
+        except Exception as e:
+            self.server.breakers.record(ilo_host, ilo_port, e)
+            raise
+        self.server.breakers.record(ilo_host, ilo_port)
+        return snapshot
+
+    def collect_target(self, name, target, configured, port_given):
+        """
+        Returns the snapshot of one target, from the poller if it is polled, or None if the iLO can't be scraped.
+        The target of another worker is scraped by it, and its exposition is returned instead.
+
+        :param configured: whether name is a target of the --config file
+        :param port_given: whether the port of target was given, another port than the polled one is another iLO
+        """
+        owner = self.server.ring.node(target.ilo_host) if self.server.ring is not None else None
+        if owner is not None and owner != self.server.worker_index:
+            if configured:
+                query = [('target', name)]
+            else:
+                query = [('ilo_host', target.ilo_host), ('ilo_port', target.ilo_port if port_given else None),
+                         ('ilo_user', target.ilo_user), ('ilo_password', target.ilo_password)]
+            query = [(key, value) for key, value in query if value is not None]
+            query.append(('collect[]', ','.join(self.collectors)))
+            try:
+                response, body = self.fetch(owner, self.server.endpoint + '?' + urlencode(query))
+            except (socket.error, HTTPException) as e:
+                print_err("scraping {} by worker {} failed: {}".format(target.ilo_host, owner, e))
+                return None
+            return body.decode('utf-8') if response.status == 200 else None
+        polled_port = target.ilo_port if port_given else None
+        if self.server.poller is not None and self.server.poller.polls(target.ilo_host, polled_port):
+            return self.server.poller.snapshot(target.ilo_host)
+        try:
+            return self.scrape(target.ilo_host, target.ilo_port, target.ilo_user, target.ilo_password)
+        except Exception as e:
+            print_err("scraping {} failed: {}".format(target.ilo_host, e))
+            return None
+
+    def _timed_collect_target(self, args):
+        start_time = time.time()
+        snapshot = self.collect_target(*args)
+        return args, snapshot, time.time() - start_time
+
+    def do_group(self, query_components, start_time):
+        """
+        Scrapes several iLOs in parallel into one response, from a targets= list or a group= name
+        """
+        port_given = bool(query_components.get('ilo_port', [''])[0])
+        ilo_port = int(query_components.get('ilo_port', [''])[0] or os.environ.get('ilo_port', 443))
+        ilo_user = query_components.get('ilo_user', [''])[0] or os.environ.get('ilo_user')
+        ilo_password = query_components.get('ilo_password', [''])[0] or os.environ.get('ilo_password')
+        group = query_components.get('group', [''])[0]
+        if group:
+            if group not in self.server.groups:
+                print_err("unknown group %s" % group)
+                self.send_response(404)
+                self.end_headers()
+                return
+            names = self.server.groups[group]
+        else:
+            names = [name for value in query_components.get('targets', []) for name in value.split(',')]
+        targets = []
+        for name in names:
+            name = name.strip()
+            if name and name not in [target[0] for target in targets]:
+                # names of the --config file come with their own connection parameters
+                target = self.server.registry.get(name) if self.server.registry is not None else None
+                targets.append((name, target or Target.parse(name, ilo_port, ilo_user, ilo_password),
+                                target is not None, target is not None or ':' in name or port_given))
+        if not targets:
+            print_err("missing parameter 'targets'")
+            self.return_error()
+            return
+        # python-hpilo would log in with its default credentials, polled iLOs have theirs configured
+        unconfigured = [name for name, target, configured, port_given in targets
+                        if not configured and not (target.ilo_user and target.ilo_password) and
+                        not self.server.polls(target.ilo_host, target.ilo_port if port_given else None)]
+        if unconfigured:
+            print_err("missing parameter 'ilo_user' or 'ilo_password' for {}".format(', '.join(unconfigured)))
+            self.return_error(400)
+            return
+
+        # every sample is labelled with the name of its target
+        self.metrics = GroupMetrics()
+        for (name, target, configured, port_given), snapshot, duration in self.server.workers.imap(self._timed_collect_target,
+                                                                                        targets):
+            metrics = ILOMetrics()
+            up = snapshot is not None
+            if isinstance(snapshot, (dict, HostSeries)):
+                metrics.watch_snapshot(snapshot, self.collectors)
+                if isinstance(snapshot, HostSeries):
+                    metrics.watch_poll(snapshot)
+            elif up:
+                # the exposition of the worker owning the target
+                up = self.metrics.add_exposition(name, snapshot)
+            metrics.watch_target(target.ilo_host, up, duration)
+            self.metrics.add(name, metrics)
+
+        # get the amount of time the request took
+        REQUEST_TIME.observe(time.time() - start_time)
+
+        self.publish_metrics()
+
+    def do_events(self, query_components):
+        """
+        Writes the events of the journal after since, a Unix time, oldest first and one JSON object per line
+        """
+        try:
+            since = float(query_components.get('since', [''])[0] or 0)
+            limit = int(query_components.get('limit', [''])[0] or 0) or None
+        except ValueError as e:
+            print_err(e)
+            self.return_error()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
         self.end_headers()
+        for event in read_events(self.server.journal_paths, since, limit):
+            self.wfile.write((json.dumps(event, sort_keys=True) + '\n').encode('utf-8'))
 
     def do_GET(self):
         """
@@ -297,47 +323,90 @@ class RequestHandler(BaseHTTPRequestHandler):
         # this will be used to return the total amount of time the request took
         start_time = time.time()
 
-        # Create a metric to track time spent and requests made.
-        request_time = Summary(self.P + 'request_processing_seconds', 'Time spent processing request',
-                               registry=self.registry)
-
         # get parameters from the URL
         url = urlparse(self.path)
         # following boolean will be passed to True if an error is detected during the argument parsing
         error_detected = False
         query_components = parse_qs(urlparse(self.path).query)
 
+        # collect[]=name, repeated or comma separated, narrows the server's default collectors
+        self.collectors = self.server.collectors
+        if 'collect[]' in query_components:
+            try:
+                self.collectors = collector.select_collectors(query_components['collect[]'])
+            except ValueError as e:
+                print_err(e)
+                self.return_error()
+                return
+
+        if url.path == self.server.endpoint + '/group':
+            self.do_group(query_components, start_time)
+            return
+
+        if url.path == '/events' and self.server.journal_paths:
+            self.do_events(query_components)
+            return
+
         ilo_host = None
         ilo_port = None
         ilo_user = None
         ilo_password = None
-        try:
-            ilo_host = query_components.get('ilo_host', [''])[0] or os.environ['ilo_host']
-            ilo_user = query_components.get('ilo_user', [''])[0] or os.environ['ilo_user']
-            ilo_password = query_components.get('ilo_password', [''])[0] or os.environ['ilo_password']
-        except KeyError as e:
-            print_err("missing parameter %s" % e)
-            self.return_error()
-            error_detected = True
-        try:
-            ilo_port = int(query_components.get('ilo_port', [''])[0] or os.environ['ilo_port'])
-        except KeyError as e:
-            ilo_port = 443
-
-        if url.path == self.server.endpoint and ilo_host and ilo_user and ilo_password and ilo_port:
-            ilo = None
-            ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
-            # Sadly, ancient iLO's aren't dead yet, so let's enable sslv3 by default
-            ssl_context.options &= ~ssl.OP_NO_SSLv3
-            ssl_context.check_hostname = False
-            ssl_context.set_ciphers(('ECDH+AESGCM:DH+AESGCM:ECDH+AES256:DH+AES256:ECDH+AES128:DH+AES:ECDH+HIGH:'
-                                     'DH+HIGH:ECDH+3DES:DH+3DES:RSA+AESGCM:RSA+AES:RSA+HIGH:RSA+3DES:!aNULL:'
-                                     '!eNULL:!MD5'))
+        polled = False
+        target_name = query_components.get('target', [''])[0]
+        if target_name:
+            # a target of the --config file, whose credentials never appear in the URL
+            target = self.server.registry.get(target_name) if self.server.registry is not None else None
+            if target is None:
+                print_err("unknown target %s" % target_name)
+                self.send_response(404)
+                self.end_headers()
+                return
+            ilo_host, ilo_port, ilo_user, ilo_password = (target.ilo_host, target.ilo_port,
+                                                          target.ilo_user, target.ilo_password)
+            if url.path == self.server.endpoint and self.forward(ilo_host):
+                return
+            polled = self.server.poller is not None and self.server.poller.polls(ilo_host, ilo_port)
+        else:
+            try:
+                ilo_host = query_components.get('ilo_host', [''])[0] or os.environ['ilo_host']
+                # the worker owning ilo_host serves it, from its poller or with the credentials it checks itself
+                if url.path == self.server.endpoint and self.forward(ilo_host):
+                    return
+                # polled targets are served from the cache, their credentials are configured on the poller,
+                # on another port than the polled one ilo_host is another iLO
+                query_port = query_components.get('ilo_port', [''])[0]
+                polled = (self.server.poller is not None and
+                          self.server.poller.polls(ilo_host, int(query_port) if query_port else None))
+                if not polled:
+                    ilo_user = query_components.get('ilo_user', [''])[0] or os.environ['ilo_user']
+                    ilo_password = query_components.get('ilo_password', [''])[0] or os.environ['ilo_password']
+            except KeyError as e:
+                print_err("missing parameter %s" % e)
+                self.return_error()
+                error_detected = True
             try:
-                ilo = hpilo.Ilo(hostname=ilo_host,
-                                login=ilo_user,
-                                password=ilo_password,
-                                port=ilo_port, timeout=10, ssl_context=ssl_context)
+                ilo_port = int(query_components.get('ilo_port', [''])[0] or os.environ['ilo_port'])
+            except KeyError as e:
+                ilo_port = 443
+
+        if url.path == self.server.endpoint and polled:
+            snapshot = self.server.poller.snapshot(ilo_host)
+            if snapshot is None:
+                print_err("no snapshot of {} yet".format(ilo_host))
+                self.return_error()
+                return
+
+            self.stream_metrics(snapshot, start_time, polled=True, ilo_host=ilo_host)
+
+        elif url.path == self.server.endpoint and ilo_host and ilo_user and ilo_password and ilo_port:
+            try:
+                snapshot = self.scrape(ilo_host, ilo_port, ilo_user, ilo_password)
+            except CircuitOpenError:
+                # answer right away, the iLO is known to be unreachable
+                self.metrics = ILOMetrics()
+                self.metrics.watch_target(ilo_host, False, time.time() - start_time)
+                self.publish_metrics()
+                return
             except hpilo.IloLoginFailed:
                 print("ILO login failed")
                 self.return_error()
@@ -351,91 +420,7 @@ class RequestHandler(BaseHTTPRequestHandler):
                 self.return_error()
                 return
 
-            # get product and server name
-            try:
-                self.product_name = ilo.get_product_name()
-            except:
-                self.product_name = "Unknown HP Server"
-
-            try:
-                self.server_name = ilo.get_server_name()
-                if self.server_name == "":
-                    self.server_name = ilo_host
-            except:
-                self.server_name = ilo_host
-
-            # get server serial number
-            try:
-                host_info = ilo.get_host_data()
-                self.server_serial_num = [d["Serial Number"] for d in host_info if "Serial Number" in d][1]
-            except:
-                self.server_serial_num = "Unknown Serial Number"
-
-            # get health, mod by n27051538
-            self.embedded_health = ilo.get_embedded_health()
-            self.watch_health_at_glance()
-            self.watch_battery()
-            self.watch_disks()
-            self.watch_temperature()
-            self.watch_processor()
-            self.watch_memory()
-            self.watch_memory_summary()
-            self.watch_fan()
-            self.watch_ps()
-
-            try:
-                running = ilo.get_host_power_status()
-                self.gauges['running'].labels(product_name=self.product_name, server_name=self.server_name, server_serial_num=self.server_serial_num).set(
-                    translate(running))
-            except:
-                pass
-
-            # for iLO3 patch network
-            if ilo.get_fw_version()["management_processor"] == 'iLO3':
-                print_err('Unknown iLO nic status')
-            else:
-                # get nic information
-                for nic_name, nic in self.embedded_health['nic_information'].items():
-                    try:
-                        value = ['OK', 'Disabled', 'Unknown', 'Link Down'].index(nic['status'])
-                    except ValueError:
-                        value = 4
-                        print_err('unrecognised nic status: {}'.format(nic['status']))
-
-#                    self.gauges['nic_status'].labels(product_name=self.product_name, server_name=self.server_name, server_serial_num=self.server_serial_num, nic_name=nic_name, ip_address=nic['ip_address']).set(value)
-                    self.gauges['nic_status'].labels(product_name=self.product_name, server_name=self.server_name, server_serial_num=self.server_serial_num, nic_name=nic_name, ip_address=nic['ip_address']).set(value)
-
-            # get firmware version
-            try:
-                fw_version = ilo.get_fw_version()["firmware_version"]
-                self.gauges['firmware_version'].labels(product_name=self.product_name,
-                                                       server_name=self.server_name, server_serial_num=self.server_serial_num).set(fw_version)
-            except:
-                pass
-
-            try:
-                oa_info = ilo.get_oa_info()
-                self.gauges['oa_info'].labels(product_name=self.product_name,
-                                              server_name=self.server_name,
-                                              server_serial_num=self.server_serial_num,
-                                              oa_ip=oa_info.get('ipaddress',''),
-                                              encl=oa_info.get('encl',''),
-                                              location_bay=oa_info.get('location',''),
-                                              ).set(0)
-            except:
-                pass
-
-            # get the amount of time the request took
-            request_time.observe(time.time() - start_time)
-
-            # generate and publish metrics
-            metrics = generate_latest(self.registry)
-            process_metrics = generate_latest(self.process_registry)
-            self.send_response(200)
-            self.send_header('Content-Type', 'text/plain')
-            self.end_headers()
-            self.wfile.write(metrics)
-            self.wfile.write(process_metrics)
+            self.stream_metrics(snapshot, start_time, ilo_host=ilo_host)
 
         elif url.path == '/':
             self.send_response(200)
@@ -449,9 +434,8 @@ class RequestHandler(BaseHTTPRequestHandler):
             </body>
             </html>""")
 
-        else:
-            if not error_detected:
-                self.send_response(404)
+        elif not error_detected:
+            self.send_response(404)
             self.end_headers()
 
 
@@ -460,24 +444,255 @@ class ILOExporterServer(object):
     Basic server implementation that exposes metrics to Prometheus
     """
 
-    def __init__(self, address='0.0.0.0', port=8080, endpoint="/metrics"):
+    def __init__(self, address='0.0.0.0', port=8080, endpoint="/metrics", batch=False, poll_interval=0, targets=None,
+                 pool_size=256, pool_idle_timeout=300, groups_file=None, group_workers=16, inventory_ttl=0,
+                 inventory_size=1024, collectors=None, coalesce_ttl=0, breaker_threshold=3, breaker_backoff=15,
+                 breaker_max_backoff=600, config=None, config_check_interval=5, backend='ribcl', workers=1,
+                 render_cache_size=0, push_url=None, push_format='remote-write', push_job='hpilo', push_batch_size=5000,
+                 push_flush_interval=10, push_queue_size=100000, journal=None, journal_size=65536,
+                 poll_concurrency=64, poll_subnet_concurrency=8, poll_degraded_interval=None):
         self._address = address
         self._port = port
         self.endpoint = endpoint
+        self.batch = batch
+        self.collectors = collectors or list(collector.DEFAULT_COLLECTORS)
+        self.flights = SingleFlight(ttl=coalesce_ttl)
+        self.breakers = CircuitBreakers(threshold=breaker_threshold, backoff=breaker_backoff,
+                                        max_backoff=breaker_max_backoff)
+        self.pool = IloPool(max_size=pool_size, idle_timeout=pool_idle_timeout, backend=backend)
+        self.inventory = None
+        if inventory_ttl:
+            self.inventory = InventoryCache(ttl=inventory_ttl, max_size=inventory_size)
+        self.renders = RenderCache(max_size=render_cache_size) if render_cache_size else None
+        self.groups = self.load_groups(groups_file) if groups_file else {}
+        self.registry = None
+        if config:
+            self.registry = TargetRegistry(config, check_interval=config_check_interval)
+            self.registry.on_change(self.forget_target)
+        self.group_workers = group_workers
+        self._group_pool = None
+        self.worker_count = workers
+        # metrics about the exporter itself, of all the workers with workers > 1
+        self.process_registry = REGISTRY
+        # the hash ring and index of this worker, with workers > 1
+        self.ring = None
+        self.worker_index = 0
+        self.poll_targets = self.parse_targets(targets) if targets else []
+        self.poller = None
+        if poll_interval and (targets or self.registry is not None):
+            self.poller = Poller(self.polled_targets(), poll_interval, self.pool, batch=batch,
+                                 inventory=self.inventory, collectors=self.collectors, concurrency=poll_concurrency,
+                                 subnet_concurrency=poll_subnet_concurrency,
+                                 degraded_interval=poll_degraded_interval)
+            if self.registry is not None:
+                self.registry.on_reload(self.sync_polled)
+            if self.renders is not None:
+                self.poller.on_evict(self.renders.evict)
+        self.pusher = None
+        if push_url:
+            if self.poller is None:
+                raise ValueError("pushing needs polled targets")
+            sink = Pushgateway(push_url, push_job) if push_format == 'pushgateway' else RemoteWrite(push_url, push_job)
+            self.pusher = Pusher(sink, batch_size=push_batch_size, flush_interval=push_flush_interval,
+                                 queue_size=push_queue_size)
+            self.poller.on_poll(self.pusher.enqueue)
+            self.poller.on_evict(self.pusher.forget)
+        self.journal_path = journal
+        self.journal_size = journal_size
+        self.journal = None
+        if journal:
+            if self.poller is None:
+                raise ValueError("the event journal needs polled targets")
+            # with several workers, each one opens a journal of its own
+            if workers == 1:
+                self.open_journal(journal)
+
+    @staticmethod
+    def parse_targets(targets):
+        """
+        Builds poll targets from a comma separated "host[:port]" list, credentials come from the environment.
+        Polled iLOs are told apart by host, a host listed twice is refused.
+        """
+        ilo_port = int(os.environ.get('ilo_port', 443))
+        ilo_user = os.environ.get('ilo_user')
+        ilo_password = os.environ.get('ilo_password')
+        parsed = {}
+        for target in targets.split(','):
+            if target.strip():
+                target = Target.parse(target.strip(), ilo_port, ilo_user, ilo_password)
+                if target.ilo_host in parsed:
+                    raise ValueError("{} is listed twice in the polled targets".format(target.ilo_host))
+                parsed[target.ilo_host] = target
+        return list(parsed.values())
+
+    def polled_targets(self, all_workers=False, quiet=False):
+        """
+        Returns the targets to poll: those of --targets, then those of the --config file on other hosts,
+        of this worker only with workers > 1 unless all_workers
+        """
+        targets = {}
+        for target in self.poll_targets + (self.registry.targets() if self.registry is not None else []):
+            if target.ilo_host in targets:
+                if targets[target.ilo_host].connection() != target.connection() and not quiet:
+                    print_err("{} is already polled on port {}, scraping {}:{} live".format(
+                        target.ilo_host, targets[target.ilo_host].ilo_port, target.ilo_host, target.ilo_port))
+                continue
+            if all_workers or self.ring is None or self.ring.node(target.ilo_host) == self.worker_index:
+                targets[target.ilo_host] = target
+        return list(targets.values())
+
+    def polls(self, ilo_host, ilo_port=None):
+        """
+        Whether ilo_host is polled by any worker, on ilo_port if given
+        """
+        if self.poller is None:
+            return False
+        if self.ring is None:
+            return self.poller.polls(ilo_host, ilo_port)
+        return any(target.ilo_host == ilo_host and (ilo_port is None or target.ilo_port == ilo_port)
+                   for target in self.polled_targets(all_workers=True, quiet=True))
+
+    def sync_polled(self):
+        """
+        Polls the targets of the --config file as it is now: evicts the targets removed or changed, adds the new ones
+        """
+        targets = dict((target.ilo_host, target) for target in self.polled_targets())
+        for ilo_host, target in list(self.poller.targets.items()):
+            if ilo_host not in targets or targets[ilo_host].connection() != target.connection():
+                self.poller.evict(ilo_host)
+        for ilo_host, target in targets.items():
+            if ilo_host not in self.poller.targets:
+                self.poller.add(target)
+
+    @staticmethod
+    def load_groups(groups_file):
+        """
+        Reads named target groups, a JSON object of group name to a list of "host[:port]"
+        """
+        with open(groups_file) as f:
+            return json.load(f)
+
+    def forget_target(self, target):
+        """
+        Drops the pooled session, cached inventory and rendered metrics of a target whose --config entry changed
+        """
+        self.pool.invalidate(target.ilo_host, target.ilo_port, target.ilo_user)
+        if self.inventory is not None:
+            self.inventory.evict(target.ilo_host, target.ilo_port)
+        if self.renders is not None:
+            self.renders.evict(target.ilo_host)
+
+    def open_journal(self, path):
+        self.journal = EventJournal(path, self.journal_size)
+        self.poller.on_change(self.journal.record)
+
+    def journal_paths(self):
+        """
+        Returns the paths of the journals of the exporter, one per worker
+        """
+        if not self.journal_path:
+            return []
+        if self.worker_count == 1:
+            return [self.journal_path]
+        return ['{}.{}'.format(self.journal_path, index) for index in range(self.worker_count)]
 
     def print_info(self):
         print_err("Starting exporter on: http://{}:{}{}".format(self._address, self._port, self.endpoint))
         print_err("Press Ctrl+C to quit")
 
+    def configure(self, server, ring=None, worker_index=0, peers=()):
+        """
+        Hands the exporter's state to the request handlers of server
+        """
+        if self._group_pool is None:
+            self._group_pool = ThreadPool(self.group_workers)
+        server.endpoint = self.endpoint
+        server.batch = self.batch
+        server.collectors = self.collectors
+        server.flights = self.flights
+        server.breakers = self.breakers
+        server.pool = self.pool
+        server.inventory = self.inventory
+        server.renders = self.renders
+        server.journal_paths = self.journal_paths()
+        server.groups = self.groups
+        server.registry = self.registry
+        server.workers = self._group_pool
+        server.poller = self.poller
+        server.polls = self.polls
+        server.process_registry = self.process_registry
+        server.ring = ring
+        server.worker_index = worker_index
+        server.peers = peers
+        return server
+
     def run(self):
         self.print_info()
+        if self.worker_count > 1:
+            self.run_workers()
+        else:
+            self.serve(self.configure(ThreadingHTTPServer((self._address, self._port), RequestHandler)))
 
-        server = ThreadingHTTPServer((self._address, self._port), RequestHandler)
-        server.endpoint = self.endpoint
+    def run_workers(self):
+        """
+        Forks worker_count processes serving the port together, each owning the iLOs the hash ring assigns it.
+
+        A worker receiving the scrape of an iLO it doesn't own passes it on to the owner through the owner's
+        private port on 127.0.0.1. prometheus_client must run in multiprocess mode, see
+        workers.prepare_multiprocess_dir.
+        """
+        # bound before forking, so a worker forked again after a crash listens where the others expect it
+        peers = [ThreadingHTTPServer(('127.0.0.1', 0), RequestHandler) for index in range(self.worker_count)]
+        ports = [peer.server_address[1] for peer in peers]
+        ring = HashRing(range(self.worker_count))
+
+        def work(index):
+            for other, peer in enumerate(peers):
+                if other != index:
+                    peer.server_close()
+            self.process_registry = multiprocess_registry()
+            self.ring, self.worker_index = ring, index
+            if self.poller is not None:
+                self.poller.targets = dict((target.ilo_host, target) for target in self.polled_targets())
+                if self.journal_path:
+                    self.open_journal(self.journal_paths()[index])
+            private = self.configure(peers[index], ring, index, ports)
+            thread = threading.Thread(target=private.serve_forever, name='worker-private')
+            thread.daemon = True
+            thread.start()
+            self.serve(self.configure(reuse_port(ThreadingHTTPServer)((self._address, self._port), RequestHandler),
+                                      ring, index, ports))
+
+        print_err("Starting {} workers".format(self.worker_count))
+        Supervisor(self.worker_count, work).run()
+        for peer in peers:
+            peer.server_close()
+
+    def serve(self, server):
+        """
+        Serves requests until Ctrl+C, along with the poller and the config reloads
+        """
+        if self.poller is not None:
+            print_err("Polling {} targets every {}s".format(len(self.poller.targets), self.poller.interval))
+            self.poller.start()
+        if self.pusher is not None:
+            print_err("Pushing to {}".format(self.pusher.sink.url))
+            self.pusher.start()
+        if self.registry is not None:
+            print_err("Serving {} targets from {}".format(len(self.registry), self.registry.path))
+            self.registry.start()
+            if hasattr(signal, 'SIGHUP'):
+                signal.signal(signal.SIGHUP, self.registry.request_reload)
 
         try:
             while True:
                 server.handle_request()
         except KeyboardInterrupt:
             print_err("Killing exporter")
+            if self.poller is not None:
+                self.poller.stop()
+            if self.pusher is not None:
+                self.pusher.stop()
+            if self.registry is not None:
+                self.registry.stop()
             server.server_close()
@@ -0,0 +1,126 @@
+"""
+Process-wide metrics about the exporter itself, registered in prometheus_client's default REGISTRY
+"""
+import socket
+import threading
+from contextlib import contextmanager
+from timeit import default_timer
+
+import hpilo
+from prometheus_client import Counter, Gauge, Histogram, Summary
+
+
+class FeatureMetric(object):
+    """
+    Metric of an optional feature, created and registered by enable() when the feature is set up, so that
+    the exporter only reports the metrics of the features in use. Until then it has no attributes.
+    """
+    _lock = threading.Lock()
+
+    def __init__(self, metric_class, *args, **kwargs):
+        self._metric_class = metric_class
+        self._args = args
+        self._kwargs = kwargs
+        self._metric = None
+
+    def enable(self):
+        with self._lock:
+            if self._metric is None:
+                self._metric = self._metric_class(*self._args, **self._kwargs)
+
+    def __getattr__(self, name):
+        if self._metric is None:
+            raise AttributeError("{} is not enabled".format(self._args[0]))
+        return getattr(self._metric, name)
+
+
+def enable(*metrics):
+    for metric in metrics:
+        metric.enable()
+
+
+REQUEST_TIME = Summary('hpilo_request_processing_seconds', 'Time spent processing request')
+
+# iLOs answer within tens of milliseconds to a minute, depending on generation and command. The buckets are
+# per command only, a pair of counters per iLO keeps the series linear in the number of iLOs
+ILO_CALL_DURATION = Histogram('hpilo_ilo_call_duration_seconds', 'Duration of one round trip to an iLO',
+                              ['command'],
+                              buckets=(.05, .1, .25, .5, 1, 2.5, 5, 10, 20, 30, 60, float('inf')))
+
+ILO_CALL_SECONDS = Counter('hpilo_ilo_call_seconds', 'Time spent in round trips to the iLO', ['ilo_host'])
+
+ILO_CALLS = Counter('hpilo_ilo_calls', 'Round trips to the iLO', ['ilo_host'])
+
+ILO_ERRORS = Counter('hpilo_ilo_errors', 'iLO round trips that failed, by kind of error', ['ilo_host', 'error'])
+
+COALESCED_SCRAPES = Counter('hpilo_coalesced_scrapes', 'Scrapes answered with the data of a concurrent or recent '
+                                                      'scrape of the same iLO')
+
+# with several workers, an iLO's breaker lives in the worker owning it: the others report it closed
+BREAKER_STATE = FeatureMetric(Gauge, 'hpilo_breaker_state', 'Circuit breaker of the iLO: 0 closed, 1 open, 2 half-open',
+                              ['ilo_host'], multiprocess_mode='livemax')
+
+SCRAPES_IN_PROGRESS = Gauge('hpilo_scrapes_in_progress', 'iLO scrapes in progress', multiprocess_mode='livesum')
+
+RENDER_CACHE_HITS = FeatureMetric(Counter, 'hpilo_render_cache_hits', 'Metric families written from the render cache '
+                                                                      'instead of rendered again')
+
+PUSHED_SAMPLES = FeatureMetric(Counter, 'hpilo_push_samples', 'Samples of polled iLOs pushed')
+
+PUSH_DROPPED = FeatureMetric(Counter, 'hpilo_push_dropped_samples', 'Samples of polled iLOs dropped instead of pushed, '
+                                                                    'because the queue was full or the push kept failing',
+                             ['reason'])
+
+PUSH_RETRIES = FeatureMetric(Counter, 'hpilo_push_retries', 'Pushes retried after a failure')
+
+PUSH_QUEUE = FeatureMetric(Gauge, 'hpilo_push_queue_samples', 'Samples of polled iLOs waiting to be pushed',
+                           multiprocess_mode='livesum')
+
+STATUS_TRANSITIONS = FeatureMetric(Counter, 'hpilo_status_transitions', 'Status changes of iLO components seen between '
+                                                                        'two polls', ['ilo_host', 'metric'])
+
+POLL_QUEUE = FeatureMetric(Gauge, 'hpilo_poll_queue_targets', 'Polled targets due and waiting for a free slot',
+                           multiprocess_mode='livesum')
+
+POLL_LAG = FeatureMetric(Histogram, 'hpilo_poll_lag_seconds', 'Time between when a target was due to be polled and '
+                                                              'when its poll started',
+                         buckets=(.01, .05, .1, .5, 1, 5, 10, 30, 60, 300, float('inf')))
+
+WATCH_DURATION = Histogram('hpilo_watch_duration_seconds', 'Time spent turning one section of a snapshot into metrics',
+                           ['section'])
+
+
+def error_kind(error):
+    """
+    Returns the ILO_ERRORS kind of an exception, or None if it isn't counted
+    """
+    if isinstance(error, hpilo.IloLoginFailed):
+        return 'login'
+    # python-hpilo only wraps connection timeouts, a read timeout is a bare socket.timeout
+    if isinstance(error, socket.timeout) or (isinstance(error, hpilo.IloCommunicationError)
+                                             and str(error).startswith('Timeout')):
+        return 'timeout'
+    if isinstance(error, (hpilo.IloCommunicationError, socket.error)):
+        return 'communication'
+    return None
+
+
+@contextmanager
+def time_call(command, ilo_host):
+    """
+    Times one round trip to an iLO, into ILO_CALL_DURATION and the ILO_CALL_SECONDS and ILO_CALLS of the iLO
+    """
+    start = default_timer()
+    try:
+        yield
+    finally:
+        duration = max(default_timer() - start, 0)
+        ILO_CALL_DURATION.labels(command=command).observe(duration)
+        ILO_CALL_SECONDS.labels(ilo_host=ilo_host).inc(duration)
+        ILO_CALLS.labels(ilo_host=ilo_host).inc()
+
+
+def count_error(ilo_host, error):
+    kind = error_kind(error)
+    if kind is not None:
+        ILO_ERRORS.labels(ilo_host=ilo_host, error=kind).inc()
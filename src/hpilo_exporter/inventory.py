@@ -0,0 +1,77 @@
+"""
+Cache of the slow-changing iLO queries: product and server name, host data, firmware version and OA info
+"""
+from collections import OrderedDict
+import threading
+import time
+
+from hpilo_exporter import collector
+
+
+class _Entry(object):
+    __slots__ = ('results', 'fetched')
+
+    def __init__(self, results, fetched):
+        self.results = results
+        self.fetched = fetched
+
+
+class InventoryCache(object):
+    """
+    Results of collector.INVENTORY_QUERIES keyed by (ilo_host, ilo_port).
+
+    An expired entry is refreshed by the next scrape of the iLO, along with its live queries and over
+    its pooled session, so the iLO never sees a second connection for it. The scrapes running meanwhile
+    are still served the expired entry. At most max_size entries are kept, least recently used first out.
+    """
+
+    def __init__(self, ttl=3600, max_size=1024):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, ilo):
+        """
+        Returns the cached inventory of ilo, or None if there is none yet or if the caller is to fetch it
+        again because it expired.
+        """
+        key = (ilo.hostname, ilo.port)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.pop(key)
+            self._entries[key] = entry
+            now = time.time()
+            if now - entry.fetched >= self.ttl:
+                # the others keep the expired entry, if this refresh fails it is tried again a ttl later
+                entry.fetched = now
+                return None
+        return entry.results
+
+    def store(self, ilo_host, ilo_port, results):
+        """
+        Caches the inventory part of results. A failed query keeps its previous result, if any,
+        so a transient error doesn't blank the labels for a whole ttl.
+        """
+        key = (ilo_host, ilo_port)
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            inventory = {}
+            for name, method in collector.INVENTORY_QUERIES:
+                value = results.get(name)
+                if isinstance(value, Exception) and previous is not None \
+                        and not isinstance(previous.results.get(name), Exception):
+                    value = previous.results.get(name)
+                inventory[name] = value
+            self._entries[key] = _Entry(inventory, time.time())
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def evict(self, ilo_host, ilo_port):
+        with self._lock:
+            self._entries.pop((ilo_host, ilo_port), None)
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,176 @@
+"""
+Journal of the status changes of polled iLOs, in a memory-mapped ring buffer file of fixed-width records
+"""
+import heapq
+import mmap
+import os
+import struct
+import threading
+
+from hpilo_exporter.instrumentation import enable, STATUS_TRANSITIONS
+from hpilo_exporter.metrics import GAUGES, HEALTH_GAUGES
+from hpilo_exporter.util import print_err
+
+# gauges whose values are statuses, from translate() or the NIC statuses
+STATUS_GAUGES = HEALTH_GAUGES + ('battery_detail', 'storage_cache_health', 'storage_controller_health',
+                                 'storage_enclosure_health', 'storage_ld_health', 'storage_pd_health',
+                                 'processor_detail', 'memory_detail', 'fan', 'power_supply', 'nic_status', 'running')
+
+# labels every gauge of a server has, they don't tell its components apart
+SERVER_LABELS = ('product_name', 'server_name', 'server_serial_num')
+
+GAUGE_INDEX = dict((key, index) for index, (key, name, documentation, labelnames) in enumerate(GAUGES))
+
+MAGIC = b'HPILOEV1'
+# magic, record size, capacity, sequence number of the next record
+HEADER = struct.Struct('<8sIIQ')
+HEADER_SIZE = 256
+# sequence number, time, previous and new status, index of the gauge in GAUGES, iLO host, component labels
+RECORD = struct.Struct('<QdbbB5x64s168s')
+# sequence number of a record being written
+WRITING = 2 ** 64 - 1
+# previous status of a component that appeared, new status of one that disappeared
+NONE = -128
+
+
+def _text(value, size):
+    # cut on a character boundary
+    return value.encode('utf-8')[:size].decode('utf-8', 'ignore').encode('utf-8')
+
+
+def component(labelnames, label_values):
+    """
+    Describes the component of one series by its labels, without those of the server
+    """
+    return ','.join('{}="{}"'.format(name, value) for name, value in zip(labelnames, label_values)
+                    if name not in SERVER_LABELS)
+
+
+class EventJournal(object):
+    """
+    Ring buffer of the last capacity status changes, in a file mapped in memory. An existing file of
+    the same capacity is appended to, the oldest records are overwritten once it is full.
+    """
+
+    def __init__(self, path, capacity=65536):
+        self.path = path
+        self.capacity = capacity
+        enable(STATUS_TRANSITIONS)
+        self._lock = threading.Lock()
+        size = HEADER_SIZE + capacity * RECORD.size
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size != size:
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, size)
+            self._map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        magic, record_size, file_capacity, self._next = HEADER.unpack_from(self._map, 0)
+        if (magic, record_size, file_capacity) != (MAGIC, RECORD.size, capacity):
+            if magic != b'\0' * len(MAGIC):
+                print_err("{} is not a journal of {} events, starting it over".format(path, capacity))
+            self._map[:] = b'\0' * size
+            self._next = 0
+            HEADER.pack_into(self._map, 0, MAGIC, RECORD.size, capacity, 0)
+
+    def append(self, timestamp, ilo_host, key, old, new, description):
+        """
+        Appends one status change, old or new is None for a component that appeared or disappeared
+        """
+        old = NONE if old is None else old
+        new = NONE if new is None else new
+        with self._lock:
+            offset = HEADER_SIZE + self._next % self.capacity * RECORD.size
+            # readers skip a record whose sequence number isn't the expected one, so it is written last
+            RECORD.pack_into(self._map, offset, WRITING, timestamp, old, new, GAUGE_INDEX[key],
+                             _text(ilo_host, 64), _text(description, 168))
+            struct.pack_into('<Q', self._map, offset, self._next)
+            self._next += 1
+            HEADER.pack_into(self._map, 0, MAGIC, RECORD.size, self.capacity, self._next)
+
+    def record(self, ilo_host, previous, series):
+        """
+        Appends the status changes between two store.HostSeries of ilo_host, a listener of Poller.on_change.
+        The components only in one of them appeared or disappeared.
+        """
+        if previous is None:
+            return
+        before = dict((columns.key, columns) for columns in previous.families if columns.key in STATUS_GAUGES)
+        after = dict((columns.key, columns) for columns in series.families if columns.key in STATUS_GAUGES)
+        for key in sorted(set(before) | set(after), key=GAUGE_INDEX.get):
+            old, new = before.get(key), after.get(key)
+            if old is not None and new is not None and old.label_values == new.label_values \
+                    and old.values == new.values:
+                continue
+            old_values = dict(zip(old.label_values, old.values)) if old is not None else {}
+            new_values = dict(zip(new.label_values, new.values)) if new is not None else {}
+            # in the order of the new series, then the components that disappeared
+            components = list(new.label_values) if new is not None else []
+            components += [label_values for label_values in (old.label_values if old is not None else ())
+                           if label_values not in new_values]
+            for label_values in components:
+                old_value, new_value = old_values.get(label_values), new_values.get(label_values)
+                if old_value != new_value:
+                    self.transition(series.timestamp, ilo_host, key, old_value, new_value, label_values)
+
+    def transition(self, timestamp, ilo_host, key, old, new, label_values):
+        self.append(timestamp, ilo_host, key, None if old is None else int(old), None if new is None else int(new),
+                    component(GAUGES[GAUGE_INDEX[key]][3], label_values))
+        STATUS_TRANSITIONS.labels(ilo_host=ilo_host, metric=GAUGES[GAUGE_INDEX[key]][1]).inc()
+
+
+def _events(path, since):
+    """
+    Yields the events of the journal at path after the time since, oldest first, reading one record at a time
+    """
+    try:
+        with open(path, 'rb') as f:
+            journal = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (IOError, OSError, ValueError):
+        # not created yet
+        return
+    try:
+        magic, record_size, capacity, end = HEADER.unpack_from(journal, 0)
+        if magic != MAGIC or record_size != RECORD.size:
+            return
+
+        def read(seq):
+            record = RECORD.unpack_from(journal, HEADER_SIZE + seq % capacity * RECORD.size)
+            return record if record[0] == seq else None
+
+        # the records are in time order, the first one after since is searched
+        low, high = max(0, end - capacity), end
+        while low < high:
+            middle = (low + high) // 2
+            record = read(middle)
+            if record is not None and record[1] <= since:
+                low = middle + 1
+            else:
+                high = middle
+        for seq in range(low, end):
+            record = read(seq)
+            if record is not None and record[1] > since:
+                seq, timestamp, old, new, index, ilo_host, description = record
+                yield {
+                    'time': timestamp,
+                    'ilo_host': ilo_host.rstrip(b'\0').decode('utf-8'),
+                    'metric': GAUGES[index][1],
+                    'component': description.rstrip(b'\0').decode('utf-8'),
+                    'from': None if old == NONE else old,
+                    'to': None if new == NONE else new,
+                }
+    finally:
+        journal.close()
+
+
+def read_events(paths, since=0, limit=None):
+    """
+    Yields the events of the journals at paths after the time since, oldest first, at most limit of them
+    """
+    events = heapq.merge(*[((event['time'], index, order, event) for order, event in enumerate(_events(path, since)))
+                           for index, path in enumerate(paths)])
+    for count, (timestamp, index, order, event) in enumerate(events):
+        if limit is not None and count >= limit:
+            return
+        yield event
@@ -3,21 +3,153 @@ Entrypoint for the application
 """
 
 import argparse
+import socket
 
-from hpilo_exporter.exporter import ILOExporterServer
+from hpilo_exporter.workers import prepare_multiprocess_dir
 
 
 def main():
+    # prometheus_client picks its multiprocess mode when imported, so the workers are known before importing it
+    preparser = argparse.ArgumentParser(add_help=False)
+    preparser.add_argument('--workers', type=int, dest='workers', default=1)
+    if preparser.parse_known_args()[0].workers > 1 and hasattr(socket, 'SO_REUSEPORT'):
+        prepare_multiprocess_dir()
+
+    from hpilo_exporter.collector import COLLECTORS, DEFAULT_COLLECTORS, select_collectors
+    from hpilo_exporter.exporter import ILOExporterServer
+
     parser = argparse.ArgumentParser(description='Exports ilo heath_at_a_glance state to Prometheus')
 
     parser.add_argument('--address', type=str, dest='address', default='0.0.0.0', help='address to serve on')
     parser.add_argument('--port', type=int, dest='port', default='9416', help='port to bind')
     parser.add_argument('--endpoint', type=str, dest='endpoint', default='/metrics',
                         help='endpoint where metrics will be published')
+    parser.add_argument('--batch', action='store_true', dest='batch',
+                        help='send all iLO queries of a scrape in one RIBCL request')
+    parser.add_argument('--poll-interval', type=float, dest='poll_interval', default=0,
+                        help='poll --targets and the --config targets in the background every N seconds and serve '
+                             'cached data')
+    parser.add_argument('--targets', type=str, dest='targets', default=None,
+                        help='comma separated host[:port] list of iLOs to poll')
+    parser.add_argument('--poll-concurrency', type=int, dest='poll_concurrency', default=64,
+                        help='number of --targets polled at once')
+    parser.add_argument('--poll-subnet-concurrency', type=int, dest='poll_subnet_concurrency', default=8,
+                        help='number of --targets of one /24 polled at once, 0 for no limit')
+    parser.add_argument('--poll-degraded-interval', type=float, dest='poll_degraded_interval', default=None,
+                        help='poll --targets reporting a health problem every N seconds, a quarter of '
+                             '--poll-interval by default')
+    parser.add_argument('--pool-size', type=int, dest='pool_size', default=256,
+                        help='number of idle iLO sessions kept for reuse')
+    parser.add_argument('--pool-idle-timeout', type=float, dest='pool_idle_timeout', default=300,
+                        help='seconds an unused iLO session is kept')
+    parser.add_argument('--groups-file', type=str, dest='groups_file', default=None,
+                        help='JSON file of named target groups for /metrics/group?group=name')
+    parser.add_argument('--group-workers', type=int, dest='group_workers', default=16,
+                        help='number of iLOs a group scrape queries in parallel')
+    parser.add_argument('--inventory-ttl', type=float, dest='inventory_ttl', default=0,
+                        help='seconds the product, serial, firmware and OA info of an iLO are cached, 0 disables')
+    parser.add_argument('--inventory-size', type=int, dest='inventory_size', default=1024,
+                        help='number of iLOs whose inventory is cached')
+    parser.add_argument('--collectors', type=str, dest='collectors', default=','.join(DEFAULT_COLLECTORS),
+                        help='comma separated collectors enabled unless a scrape asks for collect[]=, out of '
+                             + ', '.join(sorted(COLLECTORS)))
+    parser.add_argument('--coalesce-ttl', type=float, dest='coalesce_ttl', default=0,
+                        help='seconds the data of a scrape also answers later scrapes of the same iLO')
+    parser.add_argument('--breaker-threshold', type=int, dest='breaker_threshold', default=3,
+                        help='consecutive timeouts or communication errors after which an iLO is not scraped '
+                             'for a while, 0 disables')
+    parser.add_argument('--breaker-backoff', type=float, dest='breaker_backoff', default=15,
+                        help='seconds before an iLO whose breaker opened is probed again, doubled on each failed probe')
+    parser.add_argument('--breaker-max-backoff', type=float, dest='breaker_max_backoff', default=600,
+                        help='longest wait between two probes of an unreachable iLO')
+    parser.add_argument('--config', type=str, dest='config', default=None,
+                        help='YAML or JSON file of named targets and credential profiles for ?target=name, '
+                             'reloaded on SIGHUP or when it changes')
+    parser.add_argument('--config-check-interval', type=float, dest='config_check_interval', default=5,
+                        help='seconds between two checks of whether --config changed')
+    parser.add_argument('--backend', type=str, dest='backend', default='ribcl', choices=['ribcl', 'redfish', 'auto'],
+                        help='API the iLOs are queried with, auto picks Redfish from iLO4 2.x on')
+    parser.add_argument('--render-cache-size', type=int, dest='render_cache_size', default=0,
+                        help='number of iLOs whose rendered metrics are kept, to only render again what changed '
+                             'and answer If-None-Match, 0 disables')
+    parser.add_argument('--push-url', type=str, dest='push_url', default=None,
+                        help='remote write or Pushgateway URL the series of the polled targets are pushed to')
+    parser.add_argument('--push-format', type=str, dest='push_format', default='remote-write',
+                        choices=['remote-write', 'pushgateway'], help='protocol of --push-url')
+    parser.add_argument('--push-job', type=str, dest='push_job', default='hpilo',
+                        help='job label of the pushed series')
+    parser.add_argument('--push-batch-size', type=int, dest='push_batch_size', default=5000,
+                        help='samples sent in one push at most')
+    parser.add_argument('--push-flush-interval', type=float, dest='push_flush_interval', default=10,
+                        help='seconds queued samples wait for a full batch before they are pushed anyway')
+    parser.add_argument('--push-queue-size', type=int, dest='push_queue_size', default=100000,
+                        help='samples waiting to be pushed at most, the oldest polls are dropped first')
+    parser.add_argument('--journal', type=str, dest='journal', default=None,
+                        help='file the status changes of the polled targets are recorded in, served on /events')
+    parser.add_argument('--journal-size', type=int, dest='journal_size', default=65536,
+                        help='number of status changes the --journal keeps, 256 bytes each')
+    parser.add_argument('--workers', type=int, dest='workers', default=1,
+                        help='number of processes serving the port together, each scraping its share of the iLOs '
+                             '(Linux only)')
+    parser.add_argument('--asyncio', action='store_true', dest='asyncio',
+                        help='serve with asyncio, scrapes are always batched (Python 3 only)')
+    parser.add_argument('--max-concurrency', type=int, dest='max_concurrency', default=100,
+                        help='with --asyncio, the number of iLOs queried at once')
 
     args = parser.parse_args()
+    try:
+        collectors = select_collectors([args.collectors])
+    except ValueError as e:
+        parser.error(str(e))
+    if args.workers < 1:
+        parser.error('--workers must be at least 1')
+    if args.workers > 1 and not hasattr(socket, 'SO_REUSEPORT'):
+        parser.error('--workers needs SO_REUSEPORT, which this platform lacks')
+
+    if args.poll_concurrency < 1:
+        parser.error('--poll-concurrency must be at least 1')
+    polling = args.poll_interval and (args.targets or args.config)
+    if args.push_url and not polling:
+        parser.error('--push-url pushes the polled targets, it needs --poll-interval and --targets or --config')
+    if args.journal and not polling:
+        parser.error('--journal records the polled targets, it needs --poll-interval and --targets or --config')
 
-    exporter = ILOExporterServer(**vars(args))
+    if args.asyncio:
+        if args.workers > 1:
+            parser.error('--asyncio does not support --workers')
+        if args.poll_interval:
+            parser.error('--asyncio does not support --poll-interval')
+        if args.backend != 'ribcl':
+            parser.error('--asyncio only supports --backend ribcl')
+        from hpilo_exporter.aioexporter import AsyncILOExporterServer
+        exporter = AsyncILOExporterServer(address=args.address, port=args.port, endpoint=args.endpoint,
+                                          max_concurrency=args.max_concurrency, collectors=collectors,
+                                          coalesce_ttl=args.coalesce_ttl, breaker_threshold=args.breaker_threshold,
+                                          breaker_backoff=args.breaker_backoff,
+                                          breaker_max_backoff=args.breaker_max_backoff, config=args.config,
+                                          config_check_interval=args.config_check_interval,
+                                          pool_size=args.pool_size, pool_idle_timeout=args.pool_idle_timeout)
+    else:
+        try:
+            exporter = ILOExporterServer(address=args.address, port=args.port, endpoint=args.endpoint,
+                                         batch=args.batch, poll_interval=args.poll_interval, targets=args.targets,
+                                         pool_size=args.pool_size, pool_idle_timeout=args.pool_idle_timeout,
+                                         groups_file=args.groups_file, group_workers=args.group_workers,
+                                         inventory_ttl=args.inventory_ttl, inventory_size=args.inventory_size,
+                                         collectors=collectors, coalesce_ttl=args.coalesce_ttl,
+                                         breaker_threshold=args.breaker_threshold, breaker_backoff=args.breaker_backoff,
+                                         breaker_max_backoff=args.breaker_max_backoff, config=args.config,
+                                         config_check_interval=args.config_check_interval, backend=args.backend,
+                                         workers=args.workers, render_cache_size=args.render_cache_size,
+                                         push_url=args.push_url, push_format=args.push_format, push_job=args.push_job,
+                                         push_batch_size=args.push_batch_size,
+                                         push_flush_interval=args.push_flush_interval,
+                                         push_queue_size=args.push_queue_size, journal=args.journal,
+                                         journal_size=args.journal_size, poll_concurrency=args.poll_concurrency,
+                                         poll_subnet_concurrency=args.poll_subnet_concurrency,
+                                         poll_degraded_interval=args.poll_degraded_interval)
+        except ValueError as e:
+            parser.error(str(e))
     exporter.run()
 
 
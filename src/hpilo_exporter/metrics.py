@@ -0,0 +1,671 @@
+"""
+Prometheus metric families for the data collected from an iLO
+"""
+from collections import OrderedDict
+from operator import itemgetter
+import threading
+import time
+from prometheus_client import generate_latest
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.parser import text_string_to_metric_families
+
+from hpilo_exporter.collector import DEFAULT_COLLECTORS
+from hpilo_exporter.instrumentation import enable, RENDER_CACHE_HITS, WATCH_DURATION
+from hpilo_exporter.util import print_err
+
+# P is all metrics prefix
+P = 'hpilo_'
+
+# (key, metric name, help, label names) of every gauge, in exposition order
+GAUGES = (
+    ('vrm', P + 'vrm_status', 'HP iLO vrm status',
+     ["product_name", "server_name", "server_serial_num"]),
+    ('drive', P + 'drive_status', 'HP iLO drive status',
+     ["product_name", "server_name", "server_serial_num"]),
+    ('battery', P + 'battery_status', 'HP iLO battery status',
+     ["product_name", "server_name", "server_serial_num"]),
+    ('battery_detail', P + 'battery_detail', 'HP iLO battery detailed status',
+     ["label", "present", "model", "spare", "serial_number", "capacity", "firmware_version", "product_name", "server_name", "server_serial_num"]),
+    ('storage', P + 'storage_status', 'HP iLO storage status',
+     ["product_name", "server_name", "server_serial_num"]),
+    ('fans', P + 'fans_status', 'HP iLO all fans status',
+     ["product_name", "server_name", "server_serial_num"]),
+    ('bios_hardware', P + 'bios_hardware_status', 'HP iLO bios_hardware status',
+     ["product_name", "server_name", "server_serial_num"]),
+    ('memory', P + 'memory_status', 'HP iLO memory status',
+     ["product_name", "server_name", "server_serial_num"]),
+    ('memory_detail', P + 'memory_detail_status', 'HP iLO memory detailed status',
+     ["product_name", "server_name", "server_serial_num", "cpu_id", "socket_id", "frequency", "hp_smart_memory", "minimum_voltage", "part_number", "ranks", "size", "technology", "mem_type"]),
+    ('memory_detail_summary', P + 'memory_detail_summary', 'HP iLO memory Summary',
+     ["product_name", "server_name", "server_serial_num", "cpu_id", "operating_frequency", "operating_voltage"]),
+    ('power_supplies', P + 'power_supplies_status', 'HP iLO power_supplies status',
+     ["product_name", "server_name", "server_serial_num"]),
+    ('power_supplies_readings', P + 'power_supplies_readings', 'HP iLO power_supplies readings',
+     ["product_name", "server_name", "server_serial_num"]),
+    ('processor', P + 'processor_status', 'HP iLO processor status',
+     ["product_name", "server_name", "server_serial_num"]),
+    ('processor_detail', P + 'processor_detail_status', 'HP iLO processor detailed status',
+     ["product_name", "server_name", "server_serial_num", "cpu_id", "name", "speed"]),
+    ('network', P + 'network_status', 'HP iLO network status',
+     ["product_name", "server_name", "server_serial_num"]),
+    ('temperature', P + 'temperature_status', 'HP iLO temperature status',
+     ["product_name", "server_name", "server_serial_num"]),
+    ('firmware_version', P + 'firmware_version', 'HP iLO firmware version',
+     ["product_name", "server_name", "server_serial_num"]),
+    ('nic_status', P + 'nic_status', 'HP iLO NIC status',
+     ["product_name", "server_name", "nic_name", "ip_address", "server_serial_num"]),
+    ('storage_cache_health', P + 'storage_cache_health_status', 'Cache Module status',
+     ["product_name", "server_name", "controller", "server_serial_num"]),
+    ('storage_controller_health', P + 'storage_controller_health_status', 'Controller status',
+     ["product_name", "server_name", "controller", "server_serial_num"]),
+    ('storage_enclosure_health', P + 'storage_enclosure_health_status', 'Enclosure status',
+     ["product_name", "server_name", "controller", "enc", "server_serial_num"]),
+    ('storage_ld_health', P + 'storage_ld_health_status', 'LD status',
+     ["product_name", "server_name", "controller", "logical_drive", "server_serial_num"]),
+    ('storage_pd_health', P + 'storage_pd_health_status', 'PD status',
+     ["product_name", "server_name", "controller", "logical_drive", "physical_drive", "server_serial_num"]),
+    ('temperature_value', P + 'temperature_value', 'Temperature value',
+     ["product_name", "server_name", "sensor", "server_serial_num"]),
+    ('fan', P + 'fan_status', 'HP iLO one fan status',
+     ["product_name", "server_name", "fan", "server_serial_num"]),
+    ('fan_speed', P + 'fan_speed', 'HP iLO one fan value',
+     ["product_name", "server_name", "fan", "server_serial_num"]),
+    ('power_supply', P + 'power_supply_status', 'HP iLO one power supply power',
+     ["product_name", "server_name", "ps", "server_serial_num"]),
+    ('running', P + 'running_status', 'HP iLO running status',
+     ["product_name", "server_name", "server_serial_num"]),
+    ('oa_info', P + 'onboard_administrator_info', 'HP iLO OnBoard Administrator Info',
+     ["product_name", "server_name", "oa_ip", "encl", "location_bay", "server_serial_num"]),
+)
+
+# key -> label names of every gauge
+GAUGE_LABELS = dict((key, labelnames) for key, name, documentation, labelnames in GAUGES)
+
+# (metric name, help, label names) of gauges only some responses have, created on first use
+OPTIONAL_GAUGES = {
+    'last_poll': (P + 'last_poll_timestamp_seconds', 'Time the served snapshot was collected',
+                  ["product_name", "server_name", "server_serial_num"]),
+    'snapshot_age': (P + 'snapshot_age_seconds', 'Age of the served snapshot',
+                     ["product_name", "server_name", "server_serial_num"]),
+    'power_reading': (P + 'power_reading_watts', 'HP iLO power reading',
+                      ["product_name", "server_name", "server_serial_num", "reading"]),
+    'up': (P + 'up', 'Whether the iLO could be scraped', ["ilo_host"]),
+    'scrape_duration': (P + 'scrape_duration_seconds', 'Time the scrape of the iLO took', ["ilo_host"]),
+}
+
+# metric name -> key of every gauge
+GAUGE_KEYS = dict([(name, key) for key, name, documentation, labelnames in GAUGES] +
+                  [(name, key) for key, (name, documentation, labelnames) in OPTIONAL_GAUGES.items()])
+
+# keys of the gauges of the health at a glance, one per entry
+HEALTH_GAUGES = ('vrm', 'drive', 'battery', 'storage', 'fans', 'bios_hardware', 'memory', 'power_supplies', 'processor',
+                 'network', 'temperature')
+
+# (collector, watch_* method, keys of the gauges it sets) in the order a snapshot is walked,
+# no gauge is set by two sections
+SECTIONS = (
+    ('health', 'watch_health_at_glance', HEALTH_GAUGES),
+    ('battery', 'watch_battery', ('battery_detail',)),
+    ('storage', 'watch_disks', ('storage_cache_health', 'storage_controller_health', 'storage_enclosure_health',
+                                'storage_ld_health', 'storage_pd_health')),
+    ('temperature', 'watch_temperature', ('temperature_value',)),
+    ('processor', 'watch_processor', ('processor_detail',)),
+    ('memory', 'watch_memory', ('memory_detail',)),
+    ('memory', 'watch_memory_summary', ('memory_detail_summary',)),
+    ('fan', 'watch_fan', ('fan', 'fan_speed')),
+    ('power_supply', 'watch_ps', ('power_supply', 'power_supplies_readings')),
+    ('running', 'watch_running', ('running',)),
+    ('nic', 'watch_nic', ('nic_status',)),
+    ('firmware', 'watch_firmware', ('firmware_version',)),
+    ('oa', 'watch_oa', ('oa_info',)),
+    ('power', 'watch_power', ('power_reading',)),
+)
+
+
+# upper-cased status -> translate() value, "Permanent Failure" is only matched with that case
+STATUS_CODES = {'OK': 0, 'GOOD, IN USE': 0, 'ON': 0, 'DEGRADED': 1, 'OFF': 2, 'ABSENT': -1}
+
+# NIC status -> hpilo_nic_status value, 4 for any other status
+NIC_STATUSES = {'OK': 0, 'Disabled': 1, 'Unknown': 2, 'Link Down': 3}
+
+# status string -> translate() value, the few statuses iLOs report are looked up once
+_translated = {}
+
+
+def translate(st):
+    try:
+        return _translated[st]
+    except KeyError:
+        pass
+    value = STATUS_CODES.get(st.upper(), 2 if st == 'Permanent Failure' else 3)
+    if len(_translated) < 1024:
+        _translated[st] = value
+    return value
+
+
+def nic_status(status):
+    try:
+        return NIC_STATUSES[status]
+    except KeyError:
+        print_err('unrecognised nic status: {}'.format(status))
+        return 4
+
+
+class Row(object):
+    """
+    One gauge set from every item of a Table: its key in GAUGES, the value of an item, and optionally
+    whether the item has one
+    """
+    __slots__ = ('key', 'value', 'when', 'label_values')
+
+    def __init__(self, key, value, when=None):
+        self.key = key
+        self.value = value
+        self.when = when
+        labelnames = GAUGE_LABELS[key]
+        # the labels of an item, by name, to the label values tuple of the gauge
+        self.label_values = itemgetter(*labelnames) if len(labelnames) > 1 else lambda labels: (labels[labelnames[0]],)
+
+
+class Table(object):
+    """
+    Items of one part of a snapshot, as (key, item) pairs returned by source(parent): the labels each item
+    adds to those of its parent, as (name, function of key and item), the rows of gauges set from each
+    item, and the tables of its own items
+    """
+    __slots__ = ('source', 'labels', 'rows', 'children', 'keep')
+
+    def __init__(self, source, labels=(), rows=(), children=(), keep=None):
+        self.source = source
+        self.labels = labels
+        self.rows = rows
+        self.children = children
+        self.keep = keep
+
+
+def walk(table, parent, labels, gauges):
+    """
+    Sets the samples of the rows of table and of its children in gauges, a dict of key to GaugeFamily,
+    for the items of parent; labels are the label values, strings, of parent
+    """
+    for key, item in table.source(parent):
+        if table.keep is not None and not table.keep(key, item):
+            continue
+        item_labels = labels
+        if table.labels:
+            item_labels = dict(labels)
+            for name, label in table.labels:
+                item_labels[name] = str(label(key, item))
+        for row in table.rows:
+            if row.when is None or row.when(key, item):
+                gauges[row.key].samples[row.label_values(item_labels)] = float(row.value(key, item))
+        for child in table.children:
+            walk(child, item, item_labels, gauges)
+
+
+def _lookup(snapshot, path):
+    section = snapshot['embedded_health']
+    for name in path:
+        section = (section or {}).get(name)
+    return section
+
+
+def _embedded(*path):
+    """
+    Source of the items of the dict at path in the embedded health of a snapshot
+    """
+    return lambda snapshot: (_lookup(snapshot, path) or {}).items()
+
+
+def _whole(*path):
+    """
+    Source of the dict at path in the embedded health of a snapshot, as a single item
+    """
+    def items(snapshot):
+        section = _lookup(snapshot, path)
+        return ((None, section),) if section is not None else ()
+    return items
+
+
+def _listed(name):
+    """
+    Source of the items of the list name of the parent item, keyed by their index
+    """
+    return lambda parent: enumerate(parent.get(name) or [])
+
+
+def _items(parent):
+    return parent.items()
+
+
+def _battery(snapshot):
+    power_supplies = _lookup(snapshot, ('power_supplies',)) or {}
+    return (('Battery 1', power_supplies['Battery 1']),) if 'Battery 1' in power_supplies else ()
+
+
+def _nics(snapshot):
+    fw_version = snapshot['fw_version']
+    # for iLO3 patch network
+    if fw_version is not None and fw_version["management_processor"] == 'iLO3':
+        print_err('Unknown iLO nic status')
+        return ()
+    return (_lookup(snapshot, ('nic_information',)) or {}).items()
+
+
+def _key(key, item):
+    return key
+
+
+def _get(name, default='N/A'):
+    return lambda key, item: item.get(name, default)
+
+
+def _field(name):
+    return lambda key, item: item[name]
+
+
+def _status(name, default):
+    return lambda key, item: translate(item.get(name, default))
+
+
+def _reading(name):
+    """
+    Value of a (reading, unit) field, and whether the item has one
+    """
+    return (lambda key, item: int(item.get(name, 'N/A')[0]),
+            lambda key, item: type(item.get(name, 'N/A')[0]) is int)
+
+
+def _health(key):
+    return Row(key, lambda _, health: translate(health[key]['status'].upper()),
+               when=lambda _, health: 'status' in (health.get(key) or {}))
+
+
+def _ld_name(index, ld):
+    return 'LD_' + str(index) + ', ' + ld.get('capacity', '') + ', ' + ld.get('fault_tolerance', '')
+
+
+def _pd_name(index, pd):
+    return pd.get('model', '') + ', ' + pd.get('capacity', '') + ', ' + pd.get('location', 'N' + str(index))
+
+
+def _memory_size(cpu_idx, cpu):
+    return 0 if cpu['total_memory_size'] == 'N/A' else int(cpu['total_memory_size'].split()[0])
+
+
+# watch_* section -> tables of the embedded health it walks
+TABLES = {
+    'watch_health_at_glance': (
+        Table(_whole('health_at_a_glance'), rows=tuple(_health(key) for key in HEALTH_GAUGES)),
+    ),
+    'watch_battery': (
+        Table(_battery, labels=tuple((name, _field(name)) for name in ('label', 'present', 'model', 'spare',
+                                                                       'serial_number', 'capacity',
+                                                                       'firmware_version')),
+              rows=(Row('battery_detail', lambda key, battery: translate(battery['status'])),)),
+    ),
+    'watch_disks': (
+        Table(_embedded('storage'), labels=(('controller', lambda key, item: key + ', ' + item.get('model', '')),),
+              rows=(Row('storage_cache_health', _status('cache_module_status', 'absent')),
+                    Row('storage_controller_health', _status('controller_status', 'unknown'))),
+              children=(
+                  Table(_listed('drive_enclosures'), labels=(('enc', _key),),
+                        rows=(Row('storage_enclosure_health', _status('status', 'unknown')),)),
+                  Table(_listed('logical_drives'), labels=(('logical_drive', _ld_name),),
+                        rows=(Row('storage_ld_health', _status('status', 'unknown')),),
+                        children=(
+                            Table(_listed('physical_drives'), labels=(('physical_drive', _pd_name),),
+                                  rows=(Row('storage_pd_health', _status('status', 'unknown')),)),
+                        )),
+              )),
+    ),
+    'watch_temperature': (
+        Table(_embedded('temperature'), labels=(('sensor', _key),),
+              rows=(Row('temperature_value', *_reading('currentreading')),)),
+    ),
+    'watch_processor': (
+        Table(_embedded('processors'),
+              labels=(('cpu_id', lambda key, item: key.split()[1]),
+                      ('name', lambda key, item: item.get('name', 'N/A').strip()),
+                      ('speed', _get('speed'))),
+              rows=(Row('processor_detail', _status('status', 'N/A')),)),
+    ),
+    'watch_memory': (
+        Table(_embedded('memory', 'memory_details'), labels=(('cpu_id', _key),), children=(
+            Table(_items, keep=lambda key, item: item.get('status', 'N/A') != "Not Present",
+                  labels=(('socket_id', _get('socket')), ('frequency', _get('frequency')),
+                          ('hp_smart_memory', _get('hp_smart_memory')), ('minimum_voltage', _get('minimum_voltage')),
+                          ('part_number', lambda key, item: item.get('part', {}).get('number', 'N/A')),
+                          ('ranks', _get('ranks')), ('size', _get('size')), ('technology', _get('technology')),
+                          ('mem_type', _get('type'))),
+                  rows=(Row('memory_detail', _status('status', 'N/A')),)),
+        )),
+    ),
+    'watch_memory_summary': (
+        Table(_embedded('memory', 'memory_details_summary'),
+              labels=(('cpu_id', lambda key, item: key.split("_")[1]),
+                      ('operating_frequency', _field('operating_frequency')),
+                      ('operating_voltage', _field('operating_voltage'))),
+              rows=(Row('memory_detail_summary', _memory_size),)),
+    ),
+    'watch_fan': (
+        Table(_embedded('fans'), labels=(('fan', _key),),
+              rows=(Row('fan_speed', *_reading('speed')), Row('fan', _status('status', 'N/A')))),
+    ),
+    'watch_ps': (
+        Table(_embedded('power_supplies'), labels=(('ps', _key),),
+              rows=(Row('power_supply', _status('status', 'ABSENT')),)),
+        Table(_whole('power_supply_summary'),
+              rows=(Row('power_supplies_readings', lambda key, summary: int(summary['present_power_reading'].split()[0]),
+                        when=lambda key, summary: 'present_power_reading' in summary),)),
+    ),
+    'watch_nic': (
+        Table(_nics, labels=(('nic_name', _key), ('ip_address', _field('ip_address'))),
+              rows=(Row('nic_status', lambda key, nic: nic_status(nic['status'])),)),
+    ),
+}
+
+
+class GaugeFamily(object):
+    """
+    Samples of one gauge, with the labels(...).set(...) interface of prometheus_client.Gauge
+    """
+    __slots__ = ('name', 'documentation', 'labelnames', 'samples')
+
+    def __init__(self, name, documentation, labelnames):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        # label values tuple -> value, setting the same labels twice overwrites like Gauge does
+        self.samples = {}
+
+    def labels(self, **labels):
+        return _Sample(self.samples, tuple(str(labels[name]) for name in self.labelnames))
+
+    def metric_family(self):
+        family = GaugeMetricFamily(self.name, self.documentation, labels=self.labelnames)
+        for label_values, value in self.samples.items():
+            family.add_metric(label_values, value)
+        return family
+
+
+class _Families(object):
+    """
+    Collector of already built metric families, for rendering a subset of them with generate_latest
+    """
+
+    def __init__(self, families):
+        self.families = families
+
+    def collect(self):
+        return self.families
+
+
+class RenderCache(object):
+    """
+    Exposition of each gauge of the last scrape of an iLO, with the samples it was rendered from, so that
+    ILOMetrics.stream only renders the gauges whose samples changed. At most max_size iLOs are kept,
+    least recently scraped first out.
+    """
+
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self._hosts = OrderedDict()
+        self._lock = threading.Lock()
+        enable(RENDER_CACHE_HITS)
+
+    def families(self, ilo_host):
+        """
+        Returns the dict of gauge key to (samples, exposition) of ilo_host, for ILOMetrics.stream to update
+        """
+        with self._lock:
+            rendered = self._hosts.pop(ilo_host, None)
+            if rendered is None:
+                rendered = {}
+            self._hosts[ilo_host] = rendered
+            while len(self._hosts) > self.max_size:
+                self._hosts.popitem(last=False)
+            return rendered
+
+    def evict(self, ilo_host):
+        with self._lock:
+            self._hosts.pop(ilo_host, None)
+
+    def __len__(self):
+        return len(self._hosts)
+
+
+class _Sample(object):
+    __slots__ = ('samples', 'label_values')
+
+    def __init__(self, samples, label_values):
+        self.samples = samples
+        self.label_values = label_values
+
+    def set(self, value):
+        self.samples[self.label_values] = float(value)
+
+
+class ILOMetrics(object):
+    """
+    Collector yielding the gauges of one scrape, set from a snapshot returned by collector.collect
+    """
+    P = P
+
+    def __init__(self):
+        self.gauges = dict((key, GaugeFamily(name, documentation, labelnames))
+                           for key, name, documentation, labelnames in GAUGES)
+        self.optional = []
+        # keys of the gauges collect() leaves out, already written by stream() or of unselected collectors
+        self.skipped = set()
+
+    def optional_gauge(self, key):
+        if key not in self.gauges:
+            self.gauges[key] = GaugeFamily(*OPTIONAL_GAUGES[key])
+            self.optional.append(key)
+        return self.gauges[key]
+
+    def collect(self):
+        for key, name, documentation, labelnames in GAUGES:
+            if key not in self.skipped:
+                yield self.gauges[key].metric_family()
+        for key in self.optional:
+            if key not in self.skipped:
+                yield self.gauges[key].metric_family()
+
+    def watch_running(self):
+        running = self.snapshot['host_power_status']
+        try:
+            self.gauges['running'].labels(product_name=self.product_name, server_name=self.server_name, server_serial_num=self.server_serial_num).set(
+                translate(running))
+        except:
+            pass
+
+    def watch_firmware(self):
+        fw_version = self.snapshot['fw_version']
+        try:
+            self.gauges['firmware_version'].labels(product_name=self.product_name,
+                                                   server_name=self.server_name, server_serial_num=self.server_serial_num).set(fw_version["firmware_version"])
+        except:
+            pass
+
+    def watch_oa(self):
+        oa_info = self.snapshot['oa_info']
+        try:
+            self.gauges['oa_info'].labels(product_name=self.product_name,
+                                          server_name=self.server_name,
+                                          server_serial_num=self.server_serial_num,
+                                          oa_ip=oa_info.get('ipaddress', ''),
+                                          encl=oa_info.get('encl', ''),
+                                          location_bay=oa_info.get('location', ''),
+                                          ).set(0)
+        except:
+            pass
+
+    def watch_power(self):
+        power_readings = self.snapshot.get('power_readings')
+        if power_readings is not None:
+            for key, value in power_readings.items():
+                if key.endswith('_power_reading') and isinstance(value, tuple):
+                    self.optional_gauge('power_reading').labels(product_name=self.product_name,
+                                                                server_name=self.server_name,
+                                                                server_serial_num=self.server_serial_num,
+                                                                reading=key[:-len('_power_reading')]).set(value[0])
+
+    def watch_snapshot(self, snapshot, collectors=None):
+        """
+        Sets the gauges from a snapshot returned by collector.collect, or from the store.HostSeries of a polled iLO
+
+        :param collectors: names of the sections to walk, collector.DEFAULT_COLLECTORS if None
+        """
+        self._load_snapshot(snapshot)
+        for method, keys in self._sections(collectors):
+            self._watch(method, keys)
+
+    def stream(self, snapshot, write, collectors=None, rendered=None):
+        """
+        Sets the gauges from a snapshot like watch_snapshot, passing the exposition of each section to write
+        as soon as the section is done and dropping its samples.
+
+        generate() afterwards only renders what was not streamed, the optional gauges.
+
+        :param rendered: RenderCache.families of the iLO, a gauge whose samples are the same as when it was
+                         cached is written from there instead of rendered again
+        """
+        self._load_snapshot(snapshot)
+        for method, keys in self._sections(collectors):
+            self._watch(method, keys)
+            present = [key for key in keys if key in self.gauges]
+            if rendered is None:
+                write(generate_latest(_Families([self.gauges[key].metric_family() for key in present])))
+            else:
+                for key in present:
+                    write(self._render(key, rendered))
+            for key in present:
+                # not cleared, the render cache may hold on to them
+                self.gauges[key].samples = {}
+            self.skipped.update(keys)
+
+    def _render(self, key, rendered):
+        samples = self.gauges[key].samples
+        cached = rendered.get(key)
+        if cached is not None and cached[0] == samples:
+            RENDER_CACHE_HITS.inc()
+            return cached[1]
+        exposition = generate_latest(_Families([self.gauges[key].metric_family()]))
+        rendered[key] = (samples, exposition)
+        return exposition
+
+    def _sections(self, collectors):
+        """
+        Yields the (watch_* method, gauge keys) of the selected collectors, the gauges of the others are skipped
+        """
+        if collectors is None:
+            collectors = DEFAULT_COLLECTORS
+        for name, method, keys in SECTIONS:
+            if name in collectors:
+                yield method, keys
+            else:
+                self.skipped.update(keys)
+
+    def _watch(self, method, keys):
+        if self.series is not None:
+            self.series.restore(self, keys)
+            return
+        with WATCH_DURATION.labels(section=method).time():
+            if method in TABLES:
+                for table in TABLES[method]:
+                    walk(table, self.snapshot, self.server_labels, self.gauges)
+            else:
+                getattr(self, method)()
+
+    def _load_snapshot(self, snapshot):
+        # a polled iLO's series were set from its snapshot when it was stored
+        self.series = None if isinstance(snapshot, dict) else snapshot
+        if self.series is not None:
+            self.product_name = snapshot.product_name
+            self.server_name = snapshot.server_name
+            self.server_serial_num = snapshot.server_serial_num
+            return
+        self.snapshot = snapshot
+        self.product_name = snapshot['product_name']
+        self.server_name = snapshot['server_name']
+        self.server_serial_num = snapshot['server_serial_num']
+        self.server_labels = {'product_name': str(self.product_name), 'server_name': str(self.server_name),
+                              'server_serial_num': str(self.server_serial_num)}
+
+    def watch_poll(self, series):
+        """
+        Exposes when the served series, a store.HostSeries, were collected
+        """
+        self.optional_gauge('last_poll').labels(product_name=self.product_name, server_name=self.server_name,
+                                                server_serial_num=self.server_serial_num).set(series.timestamp)
+        self.optional_gauge('snapshot_age').labels(product_name=self.product_name, server_name=self.server_name,
+                                                   server_serial_num=self.server_serial_num).set(time.time() - series.timestamp)
+
+    def watch_target(self, ilo_host, up, duration):
+        """
+        Exposes whether one target of a group scrape, or a target refused by its circuit breaker, succeeded
+        and how long it took
+        """
+        self.optional_gauge('up').labels(ilo_host=ilo_host).set(1 if up else 0)
+        self.optional_gauge('scrape_duration').labels(ilo_host=ilo_host).set(duration)
+
+    def generate(self):
+        return generate_latest(self)
+
+
+class GroupMetrics(object):
+    """
+    Collector of the gauges of the targets of a group scrape, every sample labelled with the name of its target
+    so that two iLOs with the same components, or two targets on the same host, don't collide
+    """
+
+    def __init__(self):
+        self.families = OrderedDict((key, GaugeFamily(name, documentation, ['target'] + labelnames))
+                                    for key, name, documentation, labelnames in GAUGES)
+
+    def _family(self, key):
+        if key not in self.families:
+            name, documentation, labelnames = OPTIONAL_GAUGES[key]
+            self.families[key] = GaugeFamily(name, documentation, ['target'] + labelnames)
+        return self.families[key]
+
+    def add(self, target, metrics):
+        """
+        Adds the gauges of target, an ILOMetrics
+        """
+        for key, gauge in metrics.gauges.items():
+            if gauge.samples:
+                samples = self._family(key).samples
+                for label_values, value in gauge.samples.items():
+                    samples[(target,) + label_values] = value
+
+    def add_exposition(self, target, text):
+        """
+        Adds the gauges of target from the exposition of its scrape, leaving out its hpilo_up and
+        hpilo_scrape_duration_seconds and the exporter's own metrics
+
+        :return: False if the scrape reported the iLO down
+        """
+        up = True
+        for family in text_string_to_metric_families(text):
+            key = GAUGE_KEYS.get(family.name)
+            if key is None:
+                continue
+            if key == 'up':
+                up = up and all(sample.value for sample in family.samples)
+            if key in ('up', 'scrape_duration'):
+                continue
+            gauge = self._family(key)
+            for sample in family.samples:
+                label_values = tuple(sample.labels.get(name, '') for name in gauge.labelnames[1:])
+                gauge.samples[(target,) + label_values] = sample.value
+        return up
+
+    def collect(self):
+        for family in self.families.values():
+            yield family.metric_family()
+
+    def generate(self):
+        return generate_latest(self)
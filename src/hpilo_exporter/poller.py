@@ -0,0 +1,261 @@
+"""
+Polls configured iLOs in the background and keeps the last snapshot of each
+"""
+import hashlib
+import heapq
+import itertools
+from multiprocessing.pool import ThreadPool
+import socket
+import threading
+import time
+
+from hpilo_exporter import collector
+from hpilo_exporter.instrumentation import enable, POLL_LAG, POLL_QUEUE
+from hpilo_exporter.store import SnapshotStore
+from hpilo_exporter.util import print_err
+
+
+class Target(object):
+    """
+    One iLO to poll and its connection parameters
+    """
+
+    def __init__(self, ilo_host, ilo_port, ilo_user, ilo_password):
+        self.ilo_host = ilo_host
+        self.ilo_port = ilo_port
+        self.ilo_user = ilo_user
+        self.ilo_password = ilo_password
+
+    @classmethod
+    def parse(cls, target, ilo_port, ilo_user, ilo_password):
+        """
+        Builds a target from a "host" or "host:port" string
+        """
+        if ':' in target:
+            target, port = target.rsplit(':', 1)
+            ilo_port = int(port)
+        return cls(target, ilo_port, ilo_user, ilo_password)
+
+    def connection(self):
+        return self.ilo_host, self.ilo_port, self.ilo_user, self.ilo_password
+
+
+def offset(ilo_host):
+    """
+    Returns the fraction of the poll interval after which ilo_host is first polled, the same in
+    every process and run so that the polls of many iLOs are spread evenly
+    """
+    return int(hashlib.md5(ilo_host.encode('utf-8')).hexdigest()[:8], 16) / float(2 ** 32)
+
+
+def subnet(ilo_host):
+    """
+    Returns the /24 network of ilo_host, or ilo_host itself if it doesn't resolve to an IPv4 address
+    """
+    try:
+        return socket.gethostbyname(ilo_host).rsplit('.', 1)[0]
+    except (socket.error, UnicodeError):
+        return ilo_host
+
+
+class Poller(object):
+    """
+    Polls targets in the background and stores the series of the last snapshot collected from each.
+
+    Each target is first polled at its own offset() into the interval, then every interval seconds, or
+    every degraded_interval seconds while its health at a glance reports a problem. At most concurrency
+    targets are polled at once and at most subnet_concurrency per /24, 0 for no limit. Due targets
+    waiting for a slot go in order of health, then of due time.
+    """
+
+    def __init__(self, targets, interval, pool, batch=False, inventory=None, collectors=None, concurrency=64,
+                 subnet_concurrency=8, degraded_interval=None):
+        self.targets = dict((target.ilo_host, target) for target in targets)
+        self.interval = interval
+        self.pool = pool
+        self.batch = batch
+        self.inventory = inventory
+        self.collectors = collectors
+        self.concurrency = concurrency
+        self.subnet_concurrency = subnet_concurrency
+        self.degraded_interval = degraded_interval or interval / 4.0
+        self.store = SnapshotStore()
+        self._listeners = []
+        self._change_listeners = []
+        self._evict_listeners = []
+        self._stop = threading.Event()
+        # (due time, order, target) of the targets not being polled
+        self._schedule = []
+        # (priority, due time, order, target) of the targets due and waiting for a slot
+        self._due = []
+        self._order = itertools.count()
+        # network of each target, resolved when it is first due
+        self._subnets = {}
+        self._resolving = set()
+        self._running = {}
+        self._condition = threading.Condition()
+        self._workers = None
+        self._thread = None
+        enable(POLL_LAG, POLL_QUEUE)
+
+    def poll(self, target):
+        """
+        Collects one snapshot from target and stores its series with its collection time
+        """
+        try:
+            with self.pool.session(target.ilo_host, target.ilo_port, target.ilo_user, target.ilo_password) as ilo:
+                snapshot = collector.collect(ilo, target.ilo_host, batched=self.batch,
+                                             inventory=self.inventory, collectors=self.collectors)
+        except Exception as e:
+            print_err("polling {} failed: {}".format(target.ilo_host, e))
+            return
+        if self.targets.get(target.ilo_host) is target:
+            previous = self.store.get(target.ilo_host)
+            series = self.store.put(target.ilo_host, snapshot, time.time(), self.collectors)
+            for listener in self._listeners:
+                listener(target.ilo_host, series)
+            for listener in self._change_listeners:
+                listener(target.ilo_host, previous, series)
+
+    def on_poll(self, listener):
+        """
+        Has listener called with the host and store.HostSeries of every successful poll
+        """
+        self._listeners.append(listener)
+
+    def on_change(self, listener):
+        """
+        Has listener called with the host, the store.HostSeries of the previous poll, None after the first one,
+        and that of every successful poll
+        """
+        self._change_listeners.append(listener)
+
+    def on_evict(self, listener):
+        """
+        Has listener called with the host of every target evicted
+        """
+        self._evict_listeners.append(listener)
+
+    def _priority(self, ilo_host):
+        series = self.store.get(ilo_host)
+        return 0 if series is not None and not series.healthy() else 1
+
+    def _dispatch(self):
+        """
+        Moves the due targets to the due queue and starts polling those with a free slot
+        """
+        now = time.time()
+        while self._schedule and self._schedule[0][0] <= now:
+            due, order, target = heapq.heappop(self._schedule)
+            # an evicted target is dropped
+            if self.targets.get(target.ilo_host) is target:
+                heapq.heappush(self._due, (self._priority(target.ilo_host), due, order, target))
+        waiting = []
+        while self._due and sum(self._running.values()) < self.concurrency:
+            entry = heapq.heappop(self._due)
+            ilo_host = entry[3].ilo_host
+            if self.targets.get(ilo_host) is not entry[3]:
+                continue
+            network = self._subnets.get(ilo_host)
+            if network is None:
+                # a slow or failing DNS lookup only holds back its own target
+                if ilo_host not in self._resolving:
+                    self._resolving.add(ilo_host)
+                    self._workers.apply_async(self._resolve, (ilo_host,))
+                waiting.append(entry)
+                continue
+            if self.subnet_concurrency and self._running.get(network, 0) >= self.subnet_concurrency:
+                waiting.append(entry)
+                continue
+            self._running[network] = self._running.get(network, 0) + 1
+            POLL_LAG.observe(now - entry[1])
+            self._workers.apply_async(self._poll_scheduled, (entry[3], entry[1], network))
+        for entry in waiting:
+            heapq.heappush(self._due, entry)
+        POLL_QUEUE.set(len(self._due))
+
+    def _resolve(self, ilo_host):
+        network = subnet(ilo_host)
+        with self._condition:
+            self._resolving.discard(ilo_host)
+            if ilo_host in self.targets:
+                self._subnets[ilo_host] = network
+            self._condition.notify()
+
+    def _poll_scheduled(self, target, due, network):
+        try:
+            self.poll(target)
+        finally:
+            with self._condition:
+                self._running[network] -= 1
+                if self.targets.get(target.ilo_host) is target:
+                    interval = self.interval if self._priority(target.ilo_host) else self.degraded_interval
+                    heapq.heappush(self._schedule, (max(due + interval, time.time()), next(self._order), target))
+                self._condition.notify()
+
+    def _run(self):
+        with self._condition:
+            while not self._stop.is_set():
+                self._dispatch()
+                timeout = self._schedule[0][0] - time.time() if self._schedule else None
+                self._condition.wait(timeout)
+
+    def start(self):
+        now = time.time()
+        for ilo_host, target in self.targets.items():
+            heapq.heappush(self._schedule, (now + offset(ilo_host) * self.interval, next(self._order), target))
+        self._workers = ThreadPool(self.concurrency)
+        self._thread = threading.Thread(target=self._run, name='poller')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops scheduling polls and waits for the running ones
+        """
+        self._stop.set()
+        with self._condition:
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._workers.close()
+            self._workers.join()
+
+    def polls(self, ilo_host, ilo_port=None):
+        """
+        Whether ilo_host is polled, on ilo_port if given: another iLO behind the same host isn't
+        """
+        target = self.targets.get(ilo_host)
+        return target is not None and (ilo_port is None or target.ilo_port == ilo_port)
+
+    def add(self, target):
+        """
+        Starts polling target, whose host isn't polled yet
+        """
+        with self._condition:
+            self.targets[target.ilo_host] = target
+            if self._thread is not None:
+                heapq.heappush(self._schedule, (time.time() + offset(target.ilo_host) * self.interval,
+                                                next(self._order), target))
+                self._condition.notify()
+
+    def evict(self, ilo_host):
+        """
+        Stops polling ilo_host, drops its series and calls the listeners of on_evict
+        """
+        with self._condition:
+            target = self.targets.pop(ilo_host, None)
+            self._subnets.pop(ilo_host, None)
+            self._due = [entry for entry in self._due if entry[3].ilo_host != ilo_host]
+            heapq.heapify(self._due)
+            self._condition.notify()
+        self.store.evict(ilo_host)
+        if target is not None:
+            for listener in self._evict_listeners:
+                listener(ilo_host)
+
+    def snapshot(self, ilo_host):
+        """
+        Returns the store.HostSeries of the last snapshot collected from ilo_host, or None if no poll succeeded yet
+        """
+        return self.store.get(ilo_host)
@@ -0,0 +1,197 @@
+"""
+Pool of hpilo.Ilo objects, or Redfish clients, reused across scrapes of the same iLO
+"""
+from collections import OrderedDict
+from contextlib import contextmanager
+import threading
+import time
+
+import hpilo
+
+from hpilo_exporter import collector, redfish
+from hpilo_exporter.instrumentation import count_error, time_call
+
+# errors after which a pooled Ilo is not trusted anymore: wrong credentials, a reset BMC...
+INVALIDATING_ERRORS = (hpilo.IloLoginFailed, hpilo.IloCommunicationError)
+
+
+class ResumingContext(object):
+    """
+    Stand-in for the ssl_context of one Ilo that resumes the TLS session of its previous connection
+    """
+
+    def __init__(self, context):
+        self.context = context
+        self.session = None
+
+    def wrap_socket(self, sock, server_hostname=None):
+        if self.session is not None:
+            sock = self.context.wrap_socket(sock, server_hostname=server_hostname, session=self.session)
+        else:
+            sock = self.context.wrap_socket(sock, server_hostname=server_hostname)
+        return _SessionSavingSocket(sock, self)
+
+
+class _SessionSavingSocket(object):
+    """
+    Saves the TLS session before python-hpilo shuts the connection down, which discards it.
+    By then the TLS 1.3 session tickets have been received too.
+    """
+
+    def __init__(self, sock, context):
+        self._sock = sock
+        self._context = context
+
+    def __getattr__(self, name):
+        return getattr(self._sock, name)
+
+    def _save_session(self):
+        # Python 2 has no session resumption
+        session = getattr(self._sock, 'session', None)
+        if session is not None:
+            self._context.session = session
+
+    def shutdown(self, how):
+        self._save_session()
+        self._sock.shutdown(how)
+
+    def close(self):
+        self._save_session()
+        self._sock.close()
+
+
+class _Entry(object):
+    __slots__ = ('ilo', 'password', 'released')
+
+    def __init__(self, ilo, password, released):
+        self.ilo = ilo
+        self.password = password
+        self.released = released
+
+
+class IloPool(object):
+    """
+    Idle Ilo objects keyed by (ilo_host, ilo_port, ilo_user).
+
+    A pooled Ilo keeps its detected protocol, saving a round trip per scrape, and resumes its TLS
+    session. RIBCL has no session of its own, every request still carries the login. An Ilo is
+    handed to one scrape at a time, entries idle for longer than idle_timeout are dropped and at
+    most max_size entries are kept, least recently used first out.
+
+    With backend='redfish' the pooled objects are redfish.RedfishClient, which keep their HTTPS
+    connection open, and are closed when they are dropped. With backend='auto' the backend of each
+    iLO is picked by its get_fw_version() and remembered until the iLO's entry is invalidated.
+    """
+
+    def __init__(self, max_size=256, idle_timeout=300, timeout=10, backend='ribcl'):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.backend = backend
+        self._idle = OrderedDict()
+        # (ilo_host, ilo_port) -> backend detected with backend='auto'
+        self._backends = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _close(*ilos):
+        """
+        Closes the connection of the dropped RedfishClient among ilos, hpilo.Ilo keeps none
+        """
+        for ilo in ilos:
+            close = getattr(ilo, 'close', None)
+            if close is not None:
+                try:
+                    close()
+                except Exception:
+                    pass
+
+    def _evict_idle(self, now):
+        """
+        Removes the entries idle for idle_timeout, returns their objects to be closed outside of the lock
+        """
+        evicted = []
+        while self._idle:
+            key, entry = next(iter(self._idle.items()))
+            if now - entry.released < self.idle_timeout:
+                break
+            del self._idle[key]
+            evicted.append(entry.ilo)
+        return evicted
+
+    def acquire(self, ilo_host, ilo_port, ilo_user, ilo_password):
+        key = (ilo_host, ilo_port, ilo_user)
+        with self._lock:
+            evicted = self._evict_idle(time.time())
+            entry = self._idle.pop(key, None)
+        self._close(*evicted)
+        if entry is not None:
+            if entry.password == ilo_password:
+                return entry.ilo
+            self._close(entry.ilo)
+        ilo = None
+        backend = self.backend
+        if backend == 'auto':
+            backend = self._backends.get((ilo_host, ilo_port))
+            if backend is None:
+                ilo = self._ribcl(ilo_host, ilo_port, ilo_user, ilo_password)
+                backend = self._backends[(ilo_host, ilo_port)] = self._detect(ilo)
+        if backend == 'redfish':
+            return redfish.RedfishClient(ilo_host, ilo_user, ilo_password, port=ilo_port, timeout=self.timeout)
+        return ilo or self._ribcl(ilo_host, ilo_port, ilo_user, ilo_password)
+
+    def _ribcl(self, ilo_host, ilo_port, ilo_user, ilo_password):
+        return hpilo.Ilo(hostname=ilo_host, login=ilo_user, password=ilo_password, port=ilo_port,
+                         timeout=self.timeout, ssl_context=ResumingContext(collector.SSL_CONTEXT))
+
+    @staticmethod
+    def _detect(ilo):
+        """
+        Picks the backend of an iLO from its generation and firmware, over RIBCL which they all speak
+        """
+        try:
+            with time_call('get_fw_version', ilo.hostname):
+                return redfish.backend_for(ilo.get_fw_version())
+        except Exception as e:
+            count_error(ilo.hostname, e)
+            raise
+
+    def release(self, ilo):
+        key = (ilo.hostname, ilo.port, ilo.login)
+        with self._lock:
+            # a concurrent scrape of the same iLO may have released one already
+            replaced = self._idle.pop(key, None)
+            self._idle[key] = _Entry(ilo, ilo.password, time.time())
+            evicted = [replaced.ilo] if replaced is not None else []
+            while len(self._idle) > self.max_size:
+                evicted.append(self._idle.popitem(last=False)[1].ilo)
+        self._close(*evicted)
+
+    def invalidate(self, ilo_host, ilo_port, ilo_user):
+        with self._lock:
+            entry = self._idle.pop((ilo_host, ilo_port, ilo_user), None)
+            # detected again on the next scrape, the iLO may have been reset into another firmware
+            self._backends.pop((ilo_host, ilo_port), None)
+        if entry is not None:
+            self._close(entry.ilo)
+
+    def __len__(self):
+        return len(self._idle)
+
+    @contextmanager
+    def session(self, ilo_host, ilo_port, ilo_user, ilo_password):
+        """
+        Lends an Ilo for the duration of the with block
+        """
+        ilo = self.acquire(ilo_host, ilo_port, ilo_user, ilo_password)
+        try:
+            yield ilo
+        except INVALIDATING_ERRORS:
+            self.invalidate(ilo_host, ilo_port, ilo_user)
+            self._close(ilo)
+            raise
+        except Exception:
+            # not pooled again, its connection may be in any state
+            self._close(ilo)
+            raise
+        self.release(ilo)
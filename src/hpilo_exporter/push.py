@@ -0,0 +1,304 @@
+"""
+Pushes the series of polled iLOs to a Prometheus remote write endpoint or a Pushgateway
+"""
+from collections import deque
+import socket
+import struct
+import threading
+import time
+
+try:
+    import snappy
+except ImportError:
+    # requests are framed as uncompressed snappy blocks without python-snappy
+    snappy = None
+
+from hpilo_exporter.collector import COLLECTORS
+from hpilo_exporter.instrumentation import enable, PUSH_DROPPED, PUSH_QUEUE, PUSH_RETRIES, PUSHED_SAMPLES
+from hpilo_exporter.metrics import GAUGES, ILOMetrics, OPTIONAL_GAUGES
+from hpilo_exporter.util import print_err
+
+try:
+    from urllib2 import build_opener, HTTPError, HTTPHandler, Request, URLError
+    from urllib import quote_plus
+except ImportError:
+    # Python 3
+    from urllib.error import HTTPError, URLError
+    from urllib.request import build_opener, HTTPHandler, Request
+    from urllib.parse import quote_plus
+
+# gauge key -> (metric name, label names)
+FAMILIES = dict([(key, (name, labelnames)) for key, name, documentation, labelnames in GAUGES] +
+                [(key, (name, labelnames)) for key, (name, documentation, labelnames) in OPTIONAL_GAUGES.items()])
+
+PUSH_TIMEOUT = 30
+
+
+def _bytes(value):
+    return value if isinstance(value, bytes) else value.encode('utf-8')
+
+
+def _varint(value):
+    out = bytearray()
+    while value > 0x7f:
+        out.append(value & 0x7f | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _message(number, payload):
+    # length-delimited field
+    return _varint(number << 3 | 2) + _varint(len(payload)) + payload
+
+
+def encode_write_request(timeseries):
+    """
+    Encodes a remote write WriteRequest protobuf message
+
+    :param timeseries: (labels, samples) pairs, labels a list of (name, value) sorted by name
+                       and samples a list of (value, timestamp in milliseconds)
+    """
+    encoded = []
+    for labels, samples in timeseries:
+        fields = [_message(1, _message(1, _bytes(name)) + _message(2, _bytes(value))) for name, value in labels]
+        # Sample: double value = 1, int64 timestamp = 2
+        fields.extend(_message(2, b'\x09' + struct.pack('<d', value) + b'\x10' + _varint(timestamp))
+                      for value, timestamp in samples)
+        encoded.append(_message(1, b''.join(fields)))
+    return b''.join(encoded)
+
+
+def snappy_compress(data):
+    """
+    Compresses data in the snappy block format remote write requires, or only frames it as
+    snappy literals when python-snappy isn't installed
+    """
+    if snappy is not None:
+        return snappy.compress(data)
+    out = [_varint(len(data))]
+    for start in range(0, len(data), 65536):
+        chunk = data[start:start + 65536]
+        length = len(chunk) - 1
+        if length < 60:
+            out.append(struct.pack('<B', length << 2))
+        elif length < 256:
+            out.append(struct.pack('<BB', 60 << 2, length))
+        else:
+            out.append(struct.pack('<BH', 61 << 2, length))
+        out.append(chunk)
+    return b''.join(out)
+
+
+class RemoteWrite(object):
+    """
+    Sends batches of series in remote write requests
+    """
+
+    def __init__(self, url, job):
+        self.url = url
+        self.job = job
+        self._opener = build_opener(HTTPHandler)
+
+    def timeseries(self, ilo_host, series):
+        timestamp = int(series.timestamp * 1000)
+        for columns in series.families:
+            name, labelnames = FAMILIES[columns.key]
+            for label_values, value in zip(columns.label_values, columns.values):
+                labels = sorted([('__name__', name), ('instance', ilo_host), ('job', self.job)] +
+                                list(zip(labelnames, label_values)))
+                yield labels, [(value, timestamp)]
+
+    def send(self, batch):
+        body = snappy_compress(encode_write_request(
+            timeseries for ilo_host, series in batch for timeseries in self.timeseries(ilo_host, series)))
+        request = Request(self.url, data=body, headers={
+            'Content-Encoding': 'snappy',
+            'Content-Type': 'application/x-protobuf',
+            'X-Prometheus-Remote-Write-Version': '0.1.0',
+        })
+        self._opener.open(request, timeout=PUSH_TIMEOUT).close()
+
+
+class Pushgateway(object):
+    """
+    Replaces the metrics of each iLO of a batch in its job/instance group of a Pushgateway
+    """
+
+    def __init__(self, url, job):
+        self.url = url.rstrip('/')
+        self.job = job
+        self._opener = build_opener(HTTPHandler)
+
+    def send(self, batch):
+        """
+        Pushes each iLO of batch, a failure is raised with the number of iLOs pushed before it as its pushed attribute
+        """
+        for pushed, (ilo_host, series) in enumerate(batch):
+            metrics = ILOMetrics()
+            metrics.watch_snapshot(series, COLLECTORS)
+            request = Request('{}/metrics/job/{}/instance/{}'.format(self.url, quote_plus(self.job),
+                                                                      quote_plus(ilo_host)),
+                              data=metrics.generate(),
+                              headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+            request.get_method = lambda: 'PUT'
+            try:
+                self._opener.open(request, timeout=PUSH_TIMEOUT).close()
+            except Exception as e:
+                e.pushed = pushed
+                raise
+
+    def delete(self, ilo_host):
+        """
+        Deletes the group of ilo_host, once it isn't polled anymore
+        """
+        request = Request('{}/metrics/job/{}/instance/{}'.format(self.url, quote_plus(self.job), quote_plus(ilo_host)))
+        request.get_method = lambda: 'DELETE'
+        self._opener.open(request, timeout=PUSH_TIMEOUT).close()
+
+
+class Pusher(object):
+    """
+    Queues the series of every poll and pushes them from a background thread, batch_size samples
+    at a time or whatever is queued every flush_interval seconds.
+
+    At most queue_size samples wait, the oldest polls are dropped first. A push that fails is retried
+    max_retries times, waiting backoff seconds doubled on every failure up to max_backoff, then dropped.
+    """
+
+    def __init__(self, sink, batch_size=5000, flush_interval=10, queue_size=100000, max_retries=5, backoff=1,
+                 max_backoff=60):
+        self.sink = sink
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue_size = queue_size
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._queue = deque()
+        self._queued = 0
+        # hosts whose series the sink is to delete
+        self._deletes = []
+        self._condition = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+        enable(PUSHED_SAMPLES, PUSH_DROPPED, PUSH_RETRIES, PUSH_QUEUE)
+
+    def enqueue(self, ilo_host, series):
+        """
+        Queues the series of a poll of ilo_host, a listener of Poller.on_poll
+        """
+        samples = len(series)
+        if samples > self.queue_size:
+            PUSH_DROPPED.labels(reason='queue_full').inc(samples)
+            return
+        with self._condition:
+            while self._queued + samples > self.queue_size:
+                self._drop(self._queue.popleft()[1], 'queue_full')
+            self._queue.append((ilo_host, series))
+            self._queued += samples
+            PUSH_QUEUE.set(self._queued)
+            if self._queued >= self.batch_size:
+                self._condition.notify()
+
+    def forget(self, ilo_host):
+        """
+        Drops the queued polls of ilo_host and has the sink delete its series if it keeps them,
+        a listener of Poller.on_evict
+        """
+        with self._condition:
+            for entry in [entry for entry in self._queue if entry[0] == ilo_host]:
+                self._queue.remove(entry)
+                self._drop(entry[1], 'evicted')
+            PUSH_QUEUE.set(self._queued)
+            if hasattr(self.sink, 'delete'):
+                self._deletes.append(ilo_host)
+
+    def delete(self):
+        """
+        Deletes the series of the forgotten hosts from the sink
+        """
+        with self._condition:
+            deletes, self._deletes = self._deletes, []
+        for ilo_host in deletes:
+            try:
+                self.sink.delete(ilo_host)
+            except (URLError, socket.error) as e:
+                print_err("deleting the pushed metrics of {} failed: {}".format(ilo_host, e))
+
+    def _drop(self, series, reason):
+        self._queued -= len(series)
+        PUSH_DROPPED.labels(reason=reason).inc(len(series))
+
+    def _take(self):
+        """
+        Waits for batch_size samples, or flush_interval seconds, and dequeues up to batch_size samples
+        """
+        deadline = time.time() + self.flush_interval
+        batch = []
+        with self._condition:
+            while self._queued < self.batch_size and not self._stop.is_set():
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            samples = 0
+            while self._queue and (not batch or samples + len(self._queue[0][1]) <= self.batch_size):
+                entry = self._queue.popleft()
+                batch.append(entry)
+                samples += len(entry[1])
+            self._queued -= samples
+            PUSH_QUEUE.set(self._queued)
+        return batch
+
+    def push(self, batch):
+        """
+        Sends batch, retrying with backoff, and drops what can't be sent
+        """
+        backoff = self.backoff
+        attempt = 0
+        while batch:
+            try:
+                self.sink.send(batch)
+                PUSHED_SAMPLES.inc(sum(len(series) for ilo_host, series in batch))
+                return True
+            except (URLError, socket.error) as e:
+                # a Pushgateway batch fails at one iLO, those before it were pushed
+                pushed = getattr(e, 'pushed', 0)
+                PUSHED_SAMPLES.inc(sum(len(series) for ilo_host, series in batch[:pushed]))
+                batch = batch[pushed:]
+                # the receiver refusing the samples won't change its mind
+                retry = not isinstance(e, HTTPError) or e.code == 429 or e.code >= 500
+                if not retry or attempt >= self.max_retries or self._stop.is_set():
+                    print_err("push failed, dropping {} polls: {}".format(len(batch), e))
+                    PUSH_DROPPED.labels(reason='failed').inc(sum(len(series) for ilo_host, series in batch))
+                    return False
+            print_err("push failed, retrying in {}s".format(backoff))
+            PUSH_RETRIES.inc()
+            attempt += 1
+            self._stop.wait(backoff)
+            backoff = min(backoff * 2, self.max_backoff)
+        return True
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._take()
+            try:
+                if batch:
+                    self.push(batch)
+                # after the batch, which may hold polls of the forgotten hosts
+                self.delete()
+            except Exception as e:
+                # such as a malformed response or a value that can't be encoded, the thread must go on
+                print_err("push failed, dropping {} polls: {}".format(len(batch), e))
+                PUSH_DROPPED.labels(reason='error').inc(sum(len(series) for ilo_host, series in batch))
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='pusher')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        with self._condition:
+            self._condition.notify()
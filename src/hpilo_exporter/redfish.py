@@ -0,0 +1,405 @@
+"""
+Redfish backend, answering the exporter's RIBCL queries from the Redfish API of iLO4 2.x and later
+"""
+from base64 import b64encode
+import json
+import re
+import socket
+
+import hpilo
+
+from hpilo_exporter import collector
+from hpilo_exporter.util import print_err
+
+try:
+    from httplib import HTTPException, HTTPSConnection
+except ImportError:
+    # Python 3
+    from http.client import HTTPException, HTTPSConnection
+
+SYSTEM = '/redfish/v1/Systems/1/'
+CHASSIS = '/redfish/v1/Chassis/1/'
+MANAGER = '/redfish/v1/Managers/1/'
+
+# Redfish health -> the RIBCL status metrics.translate maps to the same value
+HEALTH = {'OK': 'OK', 'Warning': 'Degraded', 'Critical': 'Failed'}
+
+# AggregateHealthStatus member -> HEALTH_AT_A_GLANCE entry
+AGGREGATE_HEALTH = {
+    'BiosOrHardwareHealth': 'bios_hardware',
+    'Fans': 'fans',
+    'Memory': 'memory',
+    'Network': 'network',
+    'PowerSupplies': 'power_supplies',
+    'Processors': 'processor',
+    'SmartStorageBattery': 'battery',
+    'Storage': 'storage',
+    'Temperatures': 'temperature',
+}
+
+DIMM_STATUS = {'GoodInUse': 'Good, In Use', 'GoodPartiallyInUse': 'Good, Partially In Use', 'NotPresent': 'Not Present'}
+
+# MinimumVoltageVoltsX10 truncates the standard DIMM voltages RIBCL reports
+DIMM_VOLTAGE = {12: '1.20 v', 13: '1.35 v', 15: '1.50 v'}
+
+# SmartStorage LogicalDrive Raid -> RIBCL FAULT_TOLERANCE
+FAULT_TOLERANCE = {
+    '0': 'RAID 0',
+    '1': 'RAID 1/RAID 1+0',
+    '10': 'RAID 1/RAID 1+0',
+    '1ADM': 'RAID 1 (ADM)',
+    '10ADM': 'RAID 10 (ADM)',
+    '5': 'RAID 5',
+    '6': 'RAID 6 (ADG)',
+    '50': 'RAID 50',
+    '60': 'RAID 60',
+}
+
+
+def backend_for(fw_version):
+    """
+    Returns the backend suited to an iLO from its get_fw_version() result: 'redfish' from iLO4 2.x on, 'ribcl' before
+    """
+    match = re.match(r'iLO\s*(\d+)', fw_version.get('management_processor', ''))
+    if match is None:
+        return 'ribcl'
+    generation = int(match.group(1))
+    try:
+        major = int(str(fw_version.get('firmware_version', '')).split('.')[0])
+    except ValueError:
+        major = 0
+    return 'redfish' if generation > 4 or (generation == 4 and major >= 2) else 'ribcl'
+
+
+def oem(resource):
+    # iLO4 files its extensions under Hp, later iLOs under Hpe
+    extensions = resource.get('Oem') or {}
+    return extensions.get('Hpe') or extensions.get('Hp') or {}
+
+
+def status(resource):
+    """
+    Returns the RIBCL status of a resource from its Redfish Status
+    """
+    state = resource.get('Status') or {}
+    if state.get('State') == 'Absent':
+        return 'Absent'
+    return HEALTH.get(state.get('Health'), 'Unknown')
+
+
+def smart_memory(dimm):
+    """
+    Returns the RIBCL HP_SMART_MEMORY of a DIMM: iLO4 flags it with HPMemory, later iLOs list HpeSmartMemory
+    in its Attributes
+    """
+    extensions = oem(dimm)
+    if 'HPMemory' in extensions:
+        return 'Yes' if extensions['HPMemory'] else 'No'
+    if 'Attributes' in extensions:
+        return 'Yes' if 'HpeSmartMemory' in extensions['Attributes'] else 'No'
+    return 'N/A'
+
+
+def minimum_voltage(dimm):
+    volts = oem(dimm).get('MinimumVoltageVoltsX10')
+    if not volts:
+        return 'N/A'
+    return DIMM_VOLTAGE.get(volts, '%.2f v' % (volts / 10.0))
+
+
+def memory_type(dimm):
+    # RIBCL reports "DIMM DDR4" where Redfish has DDR4 or DDR4_SDRAM
+    device_type = dimm.get('MemoryDeviceType')
+    if not device_type:
+        return 'N/A'
+    return 'DIMM ' + device_type.replace('_SDRAM', '')
+
+
+def reading(value, unit):
+    # RIBCL readings are (value, unit) tuples, or 'N/A' for sensors without one
+    if value is None:
+        return 'N/A'
+    return int(value), unit
+
+
+class RedfishClient(object):
+    """
+    Backend querying the Redfish API of an iLO over one kept-alive HTTPS connection.
+
+    It has the hostname, port, login and password attributes and the query methods of hpilo.Ilo,
+    so IloPool, InventoryCache and collector.collect take either, and the queries return
+    python-hpilo's result format so ILOMetrics exports the same metrics from both. Each request
+    carries basic authentication: the iLO only has a few Redfish sessions, and a pooled client may
+    be dropped without logging out.
+    """
+
+    def __init__(self, hostname, login, password, port=443, timeout=10, ssl_context=None):
+        self.hostname = hostname
+        self.login = login
+        self.password = password
+        self.port = port
+        self.timeout = timeout
+        self.ssl_context = ssl_context or collector.SSL_CONTEXT
+        self._authorization = 'Basic ' + b64encode(('%s:%s' % (login, password)).encode('utf-8')).decode('ascii')
+        self._connection = None
+        # documents already fetched by the running fetch(), several queries read the same ones
+        self._documents = {}
+        self._pruned = ()
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def get(self, path):
+        """
+        Returns the JSON document at path, reconnecting once if the iLO closed the kept-alive connection
+        """
+        if path in self._documents:
+            return self._documents[path]
+        while True:
+            fresh = self._connection is None
+            if fresh:
+                self._connection = HTTPSConnection(self.hostname, self.port, timeout=self.timeout,
+                                                   context=self.ssl_context)
+            try:
+                self._connection.request('GET', path, headers={'Authorization': self._authorization,
+                                                               'Accept': 'application/json'})
+                response = self._connection.getresponse()
+                body = response.read()
+                break
+            except socket.timeout:
+                self.close()
+                raise
+            except (socket.error, HTTPException) as e:
+                self.close()
+                if fresh:
+                    raise hpilo.IloCommunicationError("Error communicating with %s:%d: %s"
+                                                      % (self.hostname, self.port, e))
+        if response.status == 401:
+            raise hpilo.IloLoginFailed("Login failed")
+        if response.status != 200:
+            raise hpilo.IloError("GET %s returned HTTP %d" % (path, response.status))
+        document = self._documents[path] = json.loads(body.decode('utf-8'))
+        return document
+
+    def expand(self, path):
+        """
+        Returns a collection with its members' documents, fetched in the same request if the iLO supports $expand
+        """
+        collection = self.get(path + '?$expand=.')
+        collection['Members'] = [member if len(member) > 1 else self.get(member['@odata.id'])
+                                 for member in collection.get('Members', [])]
+        return collection
+
+    def fetch(self, queries, prune=()):
+        """
+        Runs the queries like collector.fetch_sequential, skipping the embedded health sections in prune
+        """
+        self._pruned = prune
+        try:
+            return collector.fetch_sequential(self, queries)
+        finally:
+            self._documents = {}
+            self._pruned = ()
+
+    def get_product_name(self):
+        return self.get(SYSTEM).get('Model')
+
+    def get_server_name(self):
+        return self.get(SYSTEM).get('HostName') or ''
+
+    def get_host_data(self):
+        system = self.get(SYSTEM)
+        # the SMBIOS system and HPE information records, which both carry the serial number
+        return [{'type': 1, 'Subject': 'System Information', 'Product Name': system.get('Model'),
+                 'Serial Number': system.get('SerialNumber')},
+                {'type': 226, 'Subject': 'HPE Information', 'Serial Number': system.get('SerialNumber')}]
+
+    def get_host_power_status(self):
+        return (self.get(SYSTEM).get('PowerState') or 'Unknown').upper()
+
+    def get_fw_version(self):
+        manager = self.get(MANAGER)
+        # "iLO 5" and "iLO 5 v1.40"
+        return {'management_processor': (manager.get('Model') or '').replace(' ', ''),
+                'firmware_version': (manager.get('FirmwareVersion') or '').rsplit('v', 1)[-1]}
+
+    def get_oa_info(self):
+        raise hpilo.IloError("Onboard Administrator info is not available over Redfish")
+
+    def get_power_readings(self):
+        control = (self.get(CHASSIS + 'Power/').get('PowerControl') or [{}])[0]
+        metrics = control.get('PowerMetrics') or {}
+        readings = {'present_power_reading': control.get('PowerConsumedWatts'),
+                    'average_power_reading': metrics.get('AverageConsumedWatts'),
+                    'maximum_power_reading': metrics.get('MaxConsumedWatts'),
+                    'minimum_power_reading': metrics.get('MinConsumedWatts')}
+        return dict((key, (value, 'Watts')) for key, value in readings.items() if value is not None)
+
+    def get_embedded_health(self):
+        """
+        Builds the GET_EMBEDDED_HEALTH_DATA sections that are not pruned, a section whose resources
+        can't be read is left out like on an iLO that has no data for it
+        """
+        sections = (
+            ('HEALTH_AT_A_GLANCE', self._health_at_a_glance),
+            ('FANS', self._fans),
+            ('TEMPERATURE', self._temperature),
+            ('POWER_SUPPLIES', self._power_supplies),
+            ('PROCESSORS', self._processors),
+            ('MEMORY', self._memory),
+            ('NIC_INFORMATION', self._nics),
+            ('STORAGE', self._storage),
+        )
+        health = {'health_at_a_glance': None}
+        for tag, section in sections:
+            if tag in self._pruned:
+                continue
+            try:
+                section(health)
+            except collector.FATAL_ERRORS:
+                raise
+            except Exception as e:
+                print_err("reading {} of {} over Redfish failed: {}".format(tag, self.hostname, e))
+        return health
+
+    def _health_at_a_glance(self, health):
+        aggregate = oem(self.get(SYSTEM)).get('AggregateHealthStatus') or {}
+        health['health_at_a_glance'] = dict((AGGREGATE_HEALTH[name], {'status': status(value)})
+                                            for name, value in aggregate.items() if name in AGGREGATE_HEALTH)
+
+    def _fans(self, health):
+        fans = {}
+        for fan in self.get(CHASSIS + 'Thermal/').get('Fans') or []:
+            name = fan.get('Name') or fan.get('FanName')
+            fans[name] = {'label': name, 'speed': reading(fan.get('Reading', fan.get('CurrentReading')), 'Percentage'),
+                          'status': status(fan)}
+        health['fans'] = fans
+
+    def _temperature(self, health):
+        temperature = {}
+        for sensor in self.get(CHASSIS + 'Thermal/').get('Temperatures') or []:
+            temperature[sensor['Name']] = {'label': sensor['Name'], 'location': sensor.get('PhysicalContext', 'N/A'),
+                                           'status': status(sensor),
+                                           'currentreading': reading(sensor.get('ReadingCelsius'), 'Celsius'),
+                                           'caution': reading(sensor.get('UpperThresholdCritical'), 'Celsius'),
+                                           'critical': reading(sensor.get('UpperThresholdFatal'), 'Celsius')}
+        health['temperature'] = temperature
+
+    def _power_supplies(self, health):
+        power = self.get(CHASSIS + 'Power/')
+        supplies = {}
+        for index, supply in enumerate(power.get('PowerSupplies') or []):
+            label = 'Power Supply %d' % (oem(supply).get('BayNumber') or index + 1)
+            supplies[label] = {'label': label, 'status': status(supply),
+                               'present': 'No' if status(supply) == 'Absent' else 'Yes',
+                               'model': supply.get('Model', 'N/A'), 'spare': supply.get('SparePartNumber', 'N/A'),
+                               'serial_number': supply.get('SerialNumber', 'N/A'),
+                               'capacity': '%s Watts' % supply.get('PowerCapacityWatts', 'N/A'),
+                               'firmware_version': supply.get('FirmwareVersion', 'N/A')}
+        for index, battery in enumerate(oem(power).get('SmartStorageBattery') or []):
+            label = 'Battery %d' % (battery.get('Index') or index + 1)
+            supplies[label] = {'label': label, 'status': status(battery),
+                               'present': 'No' if status(battery) == 'Absent' else 'Yes',
+                               'model': battery.get('Model', 'N/A'), 'spare': battery.get('SparePartNumber', 'N/A'),
+                               'serial_number': battery.get('SerialNumber', 'N/A'),
+                               'capacity': '%s Watts' % battery.get('MaximumCapWatts', 'N/A'),
+                               'firmware_version': battery.get('FirmwareVersion', 'N/A')}
+        health['power_supplies'] = supplies
+        consumed = (power.get('PowerControl') or [{}])[0].get('PowerConsumedWatts')
+        if consumed is not None:
+            health['power_supply_summary'] = {'present_power_reading': '%d Watts' % consumed}
+
+    def _processors(self, health):
+        processors = {}
+        for processor in self.expand(SYSTEM + 'Processors/')['Members']:
+            label = processor.get('Socket') or 'Proc %s' % processor.get('Id')
+            speed = oem(processor).get('RatedSpeedMHz') or processor.get('MaxSpeedMHz')
+            processors[label] = {'label': label, 'name': processor.get('Model', 'N/A'), 'status': status(processor),
+                                 'speed': '%s MHz' % speed if speed else 'N/A'}
+        health['processors'] = processors
+
+    def _memory(self, health):
+        memory = self.expand(SYSTEM + 'Memory/')
+        details = {}
+        for dimm in memory['Members']:
+            location = dimm.get('MemoryLocation') or {}
+            extensions = oem(dimm)
+            dimm_status = DIMM_STATUS.get(extensions.get('DIMMStatus'))
+            if dimm_status is None:
+                dimm_status = 'Not Present' if status(dimm) == 'Absent' else status(dimm)
+            details.setdefault('CPU_%s' % location.get('Socket'), {})['socket %s' % location.get('Slot')] = {
+                'socket': location.get('Slot'), 'status': dimm_status,
+                'size': '%s MB' % dimm['CapacityMiB'] if dimm.get('CapacityMiB') else 'N/A',
+                'frequency': '%s MHz' % dimm['OperatingSpeedMhz'] if dimm.get('OperatingSpeedMhz') else 'N/A',
+                'hp_smart_memory': 'N/A' if dimm_status == 'Not Present' else smart_memory(dimm),
+                'minimum_voltage': minimum_voltage(dimm),
+                'part': {'number': (dimm.get('PartNumber') or 'N/A').strip()},
+                'ranks': dimm.get('RankCount', 'N/A'),
+                'technology': dimm.get('BaseModuleType', 'N/A'),
+                'type': memory_type(dimm),
+            }
+        summary = {}
+        for board in oem(memory).get('MemoryList') or []:
+            summary['cpu_%s' % board.get('BoardCpuNumber')] = {
+                'number_of_sockets': board.get('BoardNumberOfSockets'),
+                'total_memory_size': ('%d GB' % (board['BoardTotalMemorySize'] // 1024)
+                                      if board.get('BoardTotalMemorySize') else 'N/A'),
+                'operating_frequency': ('%s MHz' % board['BoardOperationalFrequency']
+                                        if board.get('BoardOperationalFrequency') else 'N/A'),
+                'operating_voltage': ('%.2f v' % (board['BoardOperationalVoltage'] / 1000.0)
+                                      if board.get('BoardOperationalVoltage') else 'N/A'),
+            }
+        health['memory'] = {'memory_details': details, 'memory_details_summary': summary}
+
+    def _nics(self, health):
+        # only the server's ports: RIBCL's NIC_INFORMATION doesn't list the iLO's own under Managers
+        nics = {}
+        for interface in self.expand(SYSTEM + 'EthernetInterfaces/')['Members']:
+            state = interface.get('Status') or {}
+            if interface.get('LinkStatus') == 'LinkDown':
+                nic_status = 'Link Down'
+            elif state.get('State') == 'Disabled':
+                nic_status = 'Disabled'
+            elif state.get('Health') == 'OK':
+                nic_status = 'OK'
+            else:
+                nic_status = 'Unknown'
+            addresses = [address.get('Address') for address in interface.get('IPv4Addresses') or []
+                         if address.get('Address')]
+            name = interface.get('Name') or interface.get('Id')
+            nics[name] = {'network_port': name, 'location': name, 'status': nic_status,
+                          'mac_address': interface.get('MACAddress', 'N/A'),
+                          'ip_address': addresses[0] if addresses else 'N/A'}
+        health['nic_information'] = nics
+
+    def _storage(self, health):
+        storage = {}
+        for controller in self.expand(SYSTEM + 'SmartStorage/ArrayControllers/')['Members']:
+            links = controller.get('Links') or {}
+            label = 'Controller in %s' % controller.get('Location', controller.get('Id'))
+            entry = storage[label] = {'label': label, 'model': controller.get('Model', ''),
+                                      'status': status(controller), 'controller_status': status(controller),
+                                      'serial_number': controller.get('SerialNumber', 'N/A'),
+                                      'drive_enclosures': [], 'logical_drives': []}
+            if controller.get('CacheModuleStatus'):
+                entry['cache_module_status'] = status({'Status': controller['CacheModuleStatus']})
+            if 'StorageEnclosures' in links:
+                entry['drive_enclosures'] = [{'label': enclosure.get('Location', 'N/A'), 'status': status(enclosure)}
+                                             for enclosure in self.expand(links['StorageEnclosures']['@odata.id'])['Members']]
+            if 'LogicalDrives' not in links:
+                continue
+            for drive in self.expand(links['LogicalDrives']['@odata.id'])['Members']:
+                drives = (drive.get('Links') or {}).get('DataDrives')
+                entry['logical_drives'].append({
+                    'label': '%02d' % drive.get('LogicalDriveNumber', 0), 'status': status(drive),
+                    'capacity': '%d GiB' % (drive.get('CapacityMiB', 0) // 1024),
+                    'fault_tolerance': FAULT_TOLERANCE.get(drive.get('Raid'), 'RAID %s' % drive.get('Raid', 'N/A')),
+                    'physical_drives': [{'status': status(disk), 'model': disk.get('Model', ''),
+                                         'capacity': '%d GiB' % (disk.get('CapacityMiB', 0) // 1024),
+                                         'location': disk.get('Location', 'N/A'),
+                                         'serial_number': disk.get('SerialNumber', 'N/A')}
+                                        for disk in (self.expand(drives['@odata.id'])['Members'] if drives else [])],
+                })
+        health['storage'] = storage
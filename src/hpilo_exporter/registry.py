@@ -0,0 +1,157 @@
+"""
+Named iLO targets and their credential profiles, read from a YAML or JSON file and reloaded when it changes
+"""
+import json
+import os
+import threading
+
+try:
+    import yaml
+except ImportError:
+    # YAML configs need PyYAML, JSON ones work without
+    yaml = None
+
+from hpilo_exporter.poller import Target
+from hpilo_exporter.util import print_err
+
+
+def load_config(path):
+    """
+    Reads a config file, as YAML if its name ends in .yml or .yaml and as JSON otherwise
+    """
+    with open(path) as f:
+        text = f.read()
+    if path.endswith(('.yml', '.yaml')):
+        if yaml is None:
+            raise ValueError("reading {} requires PyYAML".format(path))
+        return yaml.safe_load(text) or {}
+    return json.loads(text)
+
+
+def parse_config(config):
+    """
+    Builds the targets of a config, a dict of target name to Target.
+
+    A target is a host name or a mapping with host, port, credentials (the name of a profile,
+    "default" if omitted), user and password. Its port, user and password default to the ones of
+    its profile, the port to 443.
+    """
+    profiles = config.get('credentials') or {}
+    targets = {}
+    for name, entry in (config.get('targets') or {}).items():
+        if not isinstance(entry, dict):
+            entry = {'host': entry}
+        profile = profiles.get(entry.get('credentials', 'default'))
+        if profile is None:
+            if 'credentials' in entry:
+                raise ValueError("target {} uses unknown credentials {}".format(name, entry['credentials']))
+            profile = {}
+        ilo_user = entry.get('user', profile.get('user'))
+        ilo_password = entry.get('password', profile.get('password'))
+        if not ilo_user or not ilo_password:
+            raise ValueError("target {} has no user or password".format(name))
+        targets[str(name)] = Target(str(entry.get('host', name)), int(entry.get('port', profile.get('port', 443))),
+                                    str(ilo_user), str(ilo_password))
+    return targets
+
+
+class TargetRegistry(object):
+    """
+    Targets of a config file by name, for scrapes with target=name instead of credentials in the URL.
+
+    The file is read again on request_reload(), or when its modification time changed, checked
+    every check_interval seconds by a background thread. A file that fails to load leaves the
+    previous targets in place. The listeners of on_change are called with the previous Target of
+    every target that changed or was removed, so what is kept about it can be dropped, then those
+    of on_reload without arguments.
+    """
+
+    def __init__(self, path, check_interval=5):
+        self.path = path
+        self.check_interval = check_interval
+        self._targets = {}
+        self._mtime = None
+        self._listeners = []
+        self._reload_listeners = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.reload()
+
+    def get(self, name):
+        """
+        Returns the Target named name, or None if there is none
+        """
+        return self._targets.get(name)
+
+    def targets(self):
+        """
+        Returns the targets, by name order
+        """
+        targets = self._targets
+        return [targets[name] for name in sorted(targets)]
+
+    def on_change(self, listener):
+        self._listeners.append(listener)
+
+    def on_reload(self, listener):
+        self._reload_listeners.append(listener)
+
+    def reload(self):
+        """
+        Reads the file again and swaps the targets in.
+
+        :return: the names of the targets that changed or were removed
+        """
+        with self._lock:
+            # recorded first so that a broken file is reported once, not at every check
+            self._mtime = os.stat(self.path).st_mtime
+            targets = parse_config(load_config(self.path))
+            previous, self._targets = self._targets, targets
+        changed = [name for name, target in previous.items()
+                   if name not in targets or targets[name].connection() != target.connection()]
+        for name in changed:
+            for listener in self._listeners:
+                listener(previous[name])
+        for listener in self._reload_listeners:
+            listener()
+        return changed
+
+    def check(self, force=False):
+        """
+        Reloads the file if it changed since it was read, or if force is set, and logs the errors
+        """
+        try:
+            if force or os.stat(self.path).st_mtime != self._mtime:
+                changed = self.reload()
+                print_err("Reloaded {}: {} targets, {} changed".format(self.path, len(self._targets), len(changed)))
+        except Exception as e:
+            print_err("reloading {} failed, keeping the previous targets: {}".format(self.path, e))
+
+    def request_reload(self, *args):
+        """
+        Has the background thread reload the file now, safe to call from a signal handler
+        """
+        self._wakeup.set()
+
+    def _watch(self):
+        while True:
+            self._wakeup.wait(self.check_interval)
+            if self._stop.is_set():
+                return
+            force = self._wakeup.is_set()
+            self._wakeup.clear()
+            self.check(force)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._watch, name='registry')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+
+    def __len__(self):
+        return len(self._targets)
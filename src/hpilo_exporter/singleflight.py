@@ -0,0 +1,72 @@
+"""
+Coalesces concurrent calls with the same key into one
+"""
+import threading
+import time
+
+
+class _Call(object):
+    __slots__ = ('done', 'result', 'error', 'finished')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.finished = None
+
+
+class SingleFlight(object):
+    """
+    Runs one call per key at a time, callers arriving while it runs wait for it and share its result
+    or exception. A successful result is also handed out for ttl seconds after the call finished.
+    """
+
+    def __init__(self, ttl=0):
+        self.ttl = ttl
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._swept = time.time()
+
+    def _sweep(self, now):
+        # drops the results kept for keys nobody asked for again, at most once per ttl
+        if now - self._swept < self.ttl:
+            return
+        self._swept = now
+        for key, call in list(self._calls.items()):
+            if call.finished is not None and now - call.finished >= self.ttl:
+                del self._calls[key]
+
+    def do(self, key, fn, *args):
+        """
+        Returns fn(*args), or the result of the call with the same key that is running or recent.
+
+        :return: (result, shared) where shared tells if another caller's call produced it
+        """
+        now = time.time()
+        with self._lock:
+            self._sweep(now)
+            call = self._calls.get(key)
+            if call is not None and call.finished is not None and now - call.finished >= self.ttl:
+                call = None
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn(*args)
+        except Exception as e:
+            call.error = e
+        with self._lock:
+            call.finished = time.time()
+            if (call.error is not None or not self.ttl) and self._calls.get(key) is call:
+                del self._calls[key]
+        call.done.set()
+        if call.error is not None:
+            raise call.error
+        return call.result, False
@@ -0,0 +1,118 @@
+"""
+Compact storage of the series of polled iLOs, instead of their whole snapshots
+"""
+from array import array
+import threading
+
+try:
+    from sys import intern
+except ImportError:
+    # Python 2, where intern is a builtin
+    pass
+
+from hpilo_exporter.metrics import HEALTH_GAUGES, ILOMetrics
+
+
+class _Columns(object):
+    """
+    Series of one gauge of one iLO: the label values of each series, and their values in the same order
+    """
+    __slots__ = ('key', 'label_values', 'values')
+
+    def __init__(self, key, label_values, values):
+        self.key = key
+        self.label_values = label_values
+        self.values = values
+
+
+class HostSeries(object):
+    """
+    Series of one polled iLO, what ILOMetrics would set from its snapshot, and when it was collected
+    """
+    __slots__ = ('timestamp', 'product_name', 'server_name', 'server_serial_num', 'families')
+
+    def __init__(self, timestamp, product_name, server_name, server_serial_num, families):
+        self.timestamp = timestamp
+        self.product_name = product_name
+        self.server_name = server_name
+        self.server_serial_num = server_serial_num
+        self.families = families
+
+    def restore(self, metrics, keys):
+        """
+        Sets the series of the gauges keys of metrics, an ILOMetrics
+        """
+        for columns in self.families:
+            if columns.key in keys:
+                gauge = metrics.gauges.get(columns.key) or metrics.optional_gauge(columns.key)
+                gauge.samples.update(zip(columns.label_values, columns.values))
+
+    def healthy(self):
+        """
+        Whether the health at a glance of the iLO reports no problem, absent components aside
+        """
+        return all(value <= 0 for columns in self.families if columns.key in HEALTH_GAUGES for value in columns.values)
+
+    def __len__(self):
+        return sum(len(columns.values) for columns in self.families)
+
+
+def _intern(value):
+    return intern(value) if isinstance(value, str) else value
+
+
+class SnapshotStore(object):
+    """
+    Last series of each polled iLO, by host.
+
+    A snapshot is walked once when it is stored and only its series are kept. Label values are
+    interned, so the product and server names and the part numbers repeated in every series of
+    every host are stored once, a label tuple equal to the one of the previous poll is reused,
+    and the values of a gauge are one array of doubles.
+    """
+
+    def __init__(self):
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def put(self, ilo_host, snapshot, timestamp, collectors=None):
+        """
+        Stores the series of snapshot, returned by collector.collect, in place of the previous ones of ilo_host
+
+        :param collectors: names of the sections the snapshot was collected for, collector.DEFAULT_COLLECTORS if None
+        """
+        metrics = ILOMetrics()
+        metrics.watch_snapshot(snapshot, collectors)
+        previous = self.get(ilo_host)
+        previous_labels = dict((columns.key, columns.label_values)
+                               for columns in (previous.families if previous is not None else ()))
+        families = []
+        for key, gauge in metrics.gauges.items():
+            if not gauge.samples:
+                continue
+            label_values = tuple(tuple(_intern(value) for value in labels) for labels in gauge.samples)
+            if previous_labels.get(key) == label_values:
+                label_values = previous_labels[key]
+            families.append(_Columns(key, label_values, array('d', gauge.samples.values())))
+        series = HostSeries(timestamp, _intern(metrics.product_name), _intern(metrics.server_name),
+                            _intern(metrics.server_serial_num), tuple(families))
+        with self._lock:
+            self._hosts[ilo_host] = series
+        return series
+
+    def get(self, ilo_host):
+        """
+        Returns the HostSeries of ilo_host, or None if none was stored
+        """
+        with self._lock:
+            return self._hosts.get(ilo_host)
+
+    def evict(self, ilo_host):
+        """
+        Drops the series of ilo_host, once it isn't polled anymore
+        """
+        with self._lock:
+            return self._hosts.pop(ilo_host, None) is not None
+
+    def __len__(self):
+        return len(self._hosts)
@@ -0,0 +1,58 @@
+"""
+Writes a response body as it is produced, with chunked transfer encoding and optional gzip
+"""
+import zlib
+
+
+def accepts_gzip(accept_encoding):
+    """
+    Tells whether an Accept-Encoding header value allows a gzip response
+    """
+    for coding in (accept_encoding or '').split(','):
+        coding, _, params = coding.partition(';')
+        if coding.strip().lower() != 'gzip':
+            continue
+        params = params.strip().replace(' ', '')
+        if params.startswith('q='):
+            try:
+                return float(params[2:]) > 0
+            except ValueError:
+                return False
+        return True
+    return False
+
+
+class ChunkedWriter(object):
+    """
+    File-like wrapper of wfile sending every write as soon as it is made.
+
+    Without chunked, the body is delimited by closing the connection, as HTTP/1.0 clients expect.
+    With gzip, each write is flushed to a byte boundary so the client can decompress it right away.
+    """
+
+    def __init__(self, wfile, chunked=True, gzip=False):
+        self.wfile = wfile
+        self.chunked = chunked
+        # wbits 16 + MAX_WBITS writes a gzip header and trailer instead of a zlib one
+        self.compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if gzip else None
+
+    def _send(self, data):
+        if not data:
+            return
+        if self.chunked:
+            self.wfile.write(('%x\r\n' % len(data)).encode('ascii'))
+            self.wfile.write(data)
+            self.wfile.write(b'\r\n')
+        else:
+            self.wfile.write(data)
+
+    def write(self, data):
+        if self.compressor is not None:
+            data = self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        self._send(data)
+
+    def close(self):
+        if self.compressor is not None:
+            self._send(self.compressor.flush())
+        if self.chunked:
+            self.wfile.write(b'0\r\n\r\n')
@@ -0,0 +1,112 @@
+import unittest
+
+import hpilo
+
+from hpilo_exporter import collector
+
+QUERIES = [
+    ('product_name', 'get_product_name'),
+    ('server_name', 'get_server_name'),
+    ('host_power_status', 'get_host_power_status'),
+]
+
+OK = '<RESPONSE STATUS="0x0000" MESSAGE=\'No error\' />\r\n'
+
+PRODUCT_NAME = '<GET_PRODUCT_NAME><PRODUCT_NAME VALUE="ProLiant DL380p Gen8"/></GET_PRODUCT_NAME>\r\n'
+SERVER_NAME = '<SERVER_NAME VALUE="server.example.com"/>\r\n'
+HOST_POWER = '<GET_HOST_POWER HOST_POWER="ON"/>\r\n'
+NOT_SUPPORTED = '<RESPONSE STATUS="0x003C" MESSAGE=\'Feature not supported\' />\r\n'
+LOGIN_FAILED = '<RESPONSE STATUS="0x005F" MESSAGE=\'Login failed.\' />\r\n'
+
+EMBEDDED_HEALTH = '''<GET_EMBEDDED_HEALTH_DATA>
+<FANS>
+<FAN><LABEL VALUE = "Fan 1"/><STATUS VALUE = "OK"/></FAN>
+</FANS>
+<TEMPERATURE>
+<TEMP><LABEL VALUE = "01-Inlet Ambient"/><STATUS VALUE = "OK"/></TEMP>
+</TEMPERATURE>
+<HEALTH_AT_A_GLANCE>
+<FANS STATUS= "OK"/>
+<TEMPERATURE STATUS= "OK"/>
+</HEALTH_AT_A_GLANCE>
+</GET_EMBEDDED_HEALTH_DATA>
+'''
+
+
+def document(*elements):
+    return '<?xml version="1.0"?>\r\n<RIBCL VERSION="2.23">\r\n%s</RIBCL>\r\n' % ''.join(elements)
+
+
+class ParseBatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.ilo = hpilo.Ilo('ilo.example.com', 'admin', 'admin')
+        self.ilo.protocol = hpilo.ILO_RAW
+        xml, self.processors = collector.prepare_batch(self.ilo, QUERIES)
+
+    def parse(self, *documents):
+        return collector.parse_batch(self.ilo, ''.join(documents), self.processors, QUERIES)
+
+    def test_results_by_query(self):
+        results = self.parse(document(OK),
+                             document(OK, PRODUCT_NAME),
+                             document(OK, SERVER_NAME),
+                             document(OK, HOST_POWER))
+        self.assertEqual(results, {'product_name': 'ProLiant DL380p Gen8', 'server_name': 'server.example.com',
+                                   'host_power_status': 'ON'})
+
+    def test_error_fails_its_own_query(self):
+        results = self.parse(document(OK, PRODUCT_NAME),
+                             document(NOT_SUPPORTED),
+                             document(OK, HOST_POWER))
+        self.assertEqual(results['product_name'], 'ProLiant DL380p Gen8')
+        self.assertIsInstance(results['server_name'], hpilo.IloFeatureNotSupported)
+        self.assertEqual(results['host_power_status'], 'ON')
+
+    def test_missing_document_does_not_shift_results(self):
+        results = self.parse(document(OK, PRODUCT_NAME),
+                             document(OK, HOST_POWER))
+        self.assertEqual(results['product_name'], 'ProLiant DL380p Gen8')
+        self.assertIsInstance(results['server_name'], hpilo.IloError)
+        self.assertEqual(results['host_power_status'], 'ON')
+
+    def test_extra_document_is_skipped(self):
+        results = self.parse(document(OK, PRODUCT_NAME),
+                             document(OK, PRODUCT_NAME),
+                             document(OK, SERVER_NAME),
+                             document(OK, HOST_POWER))
+        self.assertEqual(results, {'product_name': 'ProLiant DL380p Gen8', 'server_name': 'server.example.com',
+                                   'host_power_status': 'ON'})
+
+    def test_truncated_response(self):
+        results = self.parse(document(OK, PRODUCT_NAME))
+        self.assertEqual(results['product_name'], 'ProLiant DL380p Gen8')
+        self.assertIsInstance(results['server_name'], hpilo.IloError)
+        self.assertIsInstance(results['host_power_status'], hpilo.IloError)
+
+    def test_login_failure_fails_the_batch(self):
+        with self.assertRaises(hpilo.IloLoginFailed):
+            self.parse(document(LOGIN_FAILED))
+
+
+class PruneEmbeddedHealthTest(unittest.TestCase):
+
+    def test_drops_sections_keeps_health_at_a_glance(self):
+        pruned = collector.prune_embedded_health(EMBEDDED_HEALTH, ['FANS'])
+        self.assertNotIn('Fan 1', pruned)
+        self.assertIn('01-Inlet Ambient', pruned)
+        self.assertIn('<FANS STATUS= "OK"/>', pruned)
+
+    def test_other_documents_untouched(self):
+        self.assertEqual(collector.prune_embedded_health(PRODUCT_NAME, ['FANS']), PRODUCT_NAME)
+
+    def test_pruned_response_parses(self):
+        ilo = hpilo.Ilo('ilo.example.com', 'admin', 'admin')
+        ilo.protocol = hpilo.ILO_RAW
+        queries = [('embedded_health', 'get_embedded_health')]
+        xml, processors = collector.prepare_batch(ilo, queries)
+        results = collector.parse_batch(ilo, document(OK, EMBEDDED_HEALTH), processors, queries, prune=['FANS'])
+        health = results['embedded_health']
+        self.assertNotIn('fans', health)
+        self.assertEqual(list(health['temperature']), ['01-Inlet Ambient'])
+        self.assertEqual(health['health_at_a_glance']['fans'], {'status': 'OK'})
@@ -0,0 +1,64 @@
+from array import array
+import os
+import shutil
+import tempfile
+import unittest
+
+from hpilo_exporter.journal import EventJournal, read_events
+from hpilo_exporter.store import _Columns, HostSeries
+
+SERVER = ('ProLiant DL380p Gen8', 'server.example.com')
+
+
+def series(timestamp, fans):
+    """
+    HostSeries with the fan statuses given as a list of (fan, status)
+    """
+    label_values = [SERVER + (fan, 'CZJ3100XXX') for fan, status in fans]
+    values = array('d', [status for fan, status in fans])
+    return HostSeries(timestamp, SERVER[0], SERVER[1], 'CZJ3100XXX', [_Columns('fan', label_values, values)])
+
+
+class EventJournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'journal')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_record_round_trip(self):
+        journal = EventJournal(self.path, capacity=16)
+        journal.record('ilo1', None, series(1, [('Fan 1', 0), ('Fan 2', 0)]))
+        journal.record('ilo1', series(1, [('Fan 1', 0), ('Fan 2', 0)]), series(2, [('Fan 1', 2), ('Fan 3', 0)]))
+        events = list(read_events([self.path]))
+        self.assertEqual([(event['time'], event['ilo_host'], event['metric'], event['component'],
+                           event['from'], event['to']) for event in events], [
+            (2, 'ilo1', 'hpilo_fan_status', 'fan="Fan 1"', 0, 2),
+            (2, 'ilo1', 'hpilo_fan_status', 'fan="Fan 3"', None, 0),
+            (2, 'ilo1', 'hpilo_fan_status', 'fan="Fan 2"', 0, None),
+        ])
+
+    def test_unchanged_series_records_nothing(self):
+        journal = EventJournal(self.path, capacity=16)
+        journal.record('ilo1', series(1, [('Fan 1', 0)]), series(2, [('Fan 1', 0)]))
+        self.assertEqual(list(read_events([self.path])), [])
+
+    def test_since_and_limit(self):
+        journal = EventJournal(self.path, capacity=16)
+        for timestamp in range(1, 6):
+            journal.append(timestamp, 'ilo1', 'fan', 0, 2, 'fan="Fan 1"')
+        self.assertEqual([event['time'] for event in read_events([self.path], since=2)], [3, 4, 5])
+        self.assertEqual([event['time'] for event in read_events([self.path], limit=2)], [1, 2])
+
+    def test_oldest_records_overwritten(self):
+        journal = EventJournal(self.path, capacity=4)
+        for timestamp in range(1, 7):
+            journal.append(timestamp, 'ilo1', 'fan', 0, 2, 'fan="Fan 1"')
+        self.assertEqual([event['time'] for event in read_events([self.path])], [3, 4, 5, 6])
+
+    def test_reopened_journal_appended_to(self):
+        EventJournal(self.path, capacity=4).append(1, 'ilo1', 'fan', 0, 2, 'fan="Fan 1"')
+        EventJournal(self.path, capacity=4).append(2, 'ilo1', 'fan', 2, 0, 'fan="Fan 1"')
+        self.assertEqual([(event['from'], event['to']) for event in read_events([self.path])], [(0, 2), (2, 0)])
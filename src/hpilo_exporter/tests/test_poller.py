@@ -0,0 +1,94 @@
+import heapq
+import threading
+import time
+import unittest
+
+from hpilo_exporter.poller import Poller, Target
+
+
+class RecordingWorkers(object):
+    """
+    Stands in for the poller's ThreadPool, records the calls instead of running them
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    def apply_async(self, func, args):
+        self.calls.append((func.__name__, args))
+
+
+class RecordingPoller(Poller):
+    """
+    Poller whose polls only record their target
+    """
+
+    def __init__(self, *args, **kwargs):
+        Poller.__init__(self, *args, **kwargs)
+        self.polled = []
+        self.polled_event = threading.Event()
+
+    def poll(self, target):
+        self.polled.append(target)
+        self.polled_event.set()
+
+
+def target(ilo_host):
+    return Target(ilo_host, 443, 'admin', 'admin')
+
+
+class PollerEvictTest(unittest.TestCase):
+
+    def setUp(self):
+        self.first, self.second = target('127.0.0.2'), target('127.0.0.3')
+        self.poller = Poller([self.first, self.second], 60, pool=None)
+        self.poller._workers = RecordingWorkers()
+        self.poller._subnets = {'127.0.0.2': '127.0.0', '127.0.0.3': '127.0.0'}
+        self.evicted = []
+        self.poller.on_evict(self.evicted.append)
+
+    def queue(self, *targets):
+        for due, queued in enumerate(targets):
+            heapq.heappush(self.poller._due, (1, due, next(self.poller._order), queued))
+
+    def test_evict_drops_target_and_due_entries(self):
+        self.queue(self.first, self.second)
+        self.poller.evict('127.0.0.2')
+        self.assertEqual(list(self.poller.targets), ['127.0.0.3'])
+        self.assertEqual([entry[3] for entry in self.poller._due], [self.second])
+        self.assertNotIn('127.0.0.2', self.poller._subnets)
+        self.assertEqual(self.evicted, ['127.0.0.2'])
+
+    def test_evict_unknown_host(self):
+        self.poller.evict('127.0.0.9')
+        self.assertEqual(len(self.poller.targets), 2)
+        self.assertEqual(self.evicted, [])
+
+    def test_dispatch_skips_stale_entries(self):
+        # an entry left over from before the host was evicted and added again
+        readded = target('127.0.0.2')
+        self.queue(self.first, readded)
+        self.poller.targets['127.0.0.2'] = readded
+        self.poller._dispatch()
+        self.assertEqual(self.poller._workers.calls, [('_poll_scheduled', (readded, 1, '127.0.0'))])
+        self.assertEqual(self.poller._due, [])
+
+
+class PollerReAddTest(unittest.TestCase):
+
+    def test_readded_target_polled_alone(self):
+        first = target('127.0.0.2')
+        poller = RecordingPoller([first], 0.05, pool=None)
+        poller.start()
+        try:
+            self.assertTrue(poller.polled_event.wait(5))
+            poller.evict('127.0.0.2')
+            readded = target('127.0.0.2')
+            poller.add(readded)
+            time.sleep(0.5)
+        finally:
+            poller.stop()
+        after = poller.polled[poller.polled.index(readded):]
+        self.assertNotIn(first, after)
+        # one poll per interval at most, a leftover entry would double them
+        self.assertLessEqual(len(after), 0.5 / 0.05 + 2)
@@ -0,0 +1,128 @@
+from array import array
+import struct
+import unittest
+
+from hpilo_exporter import push
+from hpilo_exporter.store import _Columns, HostSeries
+
+
+def varint(data, position):
+    value = shift = 0
+    while True:
+        byte = bytearray(data[position:position + 1])[0]
+        position += 1
+        value |= (byte & 0x7f) << shift
+        shift += 7
+        if byte < 0x80:
+            return value, position
+
+
+def uncompress(data):
+    """
+    Decodes a snappy block, literals and copies, after the snappy format description
+    """
+    length, position = varint(data, 0)
+    data = bytearray(data)
+    out = bytearray()
+    while position < len(data):
+        tag = data[position]
+        position += 1
+        if tag & 3 == 0:
+            size = tag >> 2
+            if size >= 60:
+                count = size - 59
+                size = sum(byte << (8 * index) for index, byte in enumerate(data[position:position + count]))
+                position += count
+            out += data[position:position + size + 1]
+            position += size + 1
+            continue
+        if tag & 3 == 1:
+            size, offset = (tag >> 2 & 7) + 4, (tag >> 5) << 8 | data[position]
+            position += 1
+        elif tag & 3 == 2:
+            size, offset = (tag >> 2) + 1, struct.unpack_from('<H', data, position)[0]
+            position += 2
+        else:
+            size, offset = (tag >> 2) + 1, struct.unpack_from('<I', data, position)[0]
+            position += 4
+        for index in range(size):
+            out.append(out[-offset])
+    assert len(out) == length
+    return bytes(out)
+
+
+def fields(data):
+    """
+    Yields the (field number, value) of a protobuf message, the value of a length-delimited field as bytes
+    """
+    position = 0
+    while position < len(data):
+        key, position = varint(data, position)
+        if key & 7 == 2:
+            size, position = varint(data, position)
+            yield key >> 3, data[position:position + size]
+            position += size
+        elif key & 7 == 1:
+            yield key >> 3, struct.unpack_from('<d', data, position)[0]
+            position += 8
+        elif key & 7 == 0:
+            value, position = varint(data, position)
+            yield key >> 3, value
+        else:
+            raise ValueError("unexpected wire type {}".format(key & 7))
+
+
+def decode(data):
+    """
+    Returns the (labels, samples) of a remote write WriteRequest in the form encode_write_request takes
+    """
+    timeseries = []
+    for number, encoded in fields(data):
+        labels, samples = [], []
+        for field, value in fields(encoded):
+            if field == 1:
+                label = dict(fields(value))
+                labels.append((label[1].decode('utf-8'), label[2].decode('utf-8')))
+            elif field == 2:
+                sample = dict(fields(value))
+                samples.append((sample.get(1, 0.0), sample.get(2, 0)))
+        timeseries.append((labels, samples))
+    return timeseries
+
+
+class RemoteWriteEncodingTest(unittest.TestCase):
+
+    def round_trip(self, timeseries):
+        return decode(uncompress(push.snappy_compress(push.encode_write_request(timeseries))))
+
+    def test_round_trip(self):
+        timeseries = [
+            ([('__name__', 'hpilo_fan_status'), ('fan', 'Fan 1'), ('instance', 'ilo1')], [(2.0, 1700000000123)]),
+            ([('__name__', 'hpilo_temperature_value'), ('sensor', u'01-Inlet Ambient \u00b0C')], [(-21.5, 1)]),
+            ([('__name__', 'hpilo_up')], [(0.0, 0), (1.0, 2 ** 40)]),
+        ]
+        self.assertEqual(self.round_trip(timeseries), timeseries)
+
+    def test_large_request(self):
+        # over 64KiB, the literals are framed in several chunks
+        timeseries = [([('__name__', 'hpilo_storage_pd_health_status'), ('physical_drive', 'Port 1I Box %d Bay %d'
+                                                                          % (i // 24, i % 24))], [(float(i), i)])
+                      for i in range(5000)]
+        self.assertGreater(len(push.encode_write_request(timeseries)), 65536)
+        self.assertEqual(self.round_trip(timeseries), timeseries)
+
+    def test_literal_lengths(self):
+        for size in (1, 60, 61, 256, 257, 65536, 65537):
+            data = bytes(bytearray(index % 251 for index in range(size)))
+            self.assertEqual(uncompress(push.snappy_compress(data)), data)
+
+    def test_series_of_a_poll(self):
+        label_values = [('ProLiant DL380p Gen8', 'server.example.com', 'Fan 1', 'CZJ3100XXX')]
+        series = HostSeries(1700000000.5, 'ProLiant DL380p Gen8', 'server.example.com', 'CZJ3100XXX',
+                            [_Columns('fan', label_values, array('d', [2]))])
+        sink = push.RemoteWrite('http://127.0.0.1:9091/api/v1/write', 'hpilo')
+        self.assertEqual(self.round_trip(sink.timeseries('ilo1', series)), [
+            ([('__name__', 'hpilo_fan_status'), ('fan', 'Fan 1'), ('instance', 'ilo1'), ('job', 'hpilo'),
+              ('product_name', 'ProLiant DL380p Gen8'), ('server_name', 'server.example.com'),
+              ('server_serial_num', 'CZJ3100XXX')], [(2.0, 1700000000500)]),
+        ])
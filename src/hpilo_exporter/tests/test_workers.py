@@ -0,0 +1,26 @@
+import unittest
+
+from hpilo_exporter.workers import HashRing
+
+KEYS = ['ilo-%d.example.com' % i for i in range(2000)]
+
+
+class HashRingTest(unittest.TestCase):
+
+    def test_same_owner_in_every_ring(self):
+        first, second = HashRing(range(4)), HashRing(range(4))
+        self.assertEqual([first.node(key) for key in KEYS], [second.node(key) for key in KEYS])
+
+    def test_keys_spread_over_nodes(self):
+        ring = HashRing(range(4))
+        counts = [0] * 4
+        for key in KEYS:
+            counts[ring.node(key)] += 1
+        for count in counts:
+            self.assertGreater(count, len(KEYS) / 4 / 2)
+
+    def test_keys_of_remaining_nodes_stay(self):
+        before, after = HashRing(range(4)), HashRing(range(3))
+        for key in KEYS:
+            if before.node(key) != 3:
+                self.assertEqual(after.node(key), before.node(key))
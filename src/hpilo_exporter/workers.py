@@ -0,0 +1,158 @@
+"""
+Pre-forked worker processes sharing the exporter's port, each owning a slice of the iLOs
+"""
+import bisect
+import glob
+import hashlib
+import os
+import signal
+import socket
+import sys
+import tempfile
+import time
+import traceback
+
+from hpilo_exporter.util import print_err
+
+# seconds a worker waits for the response to a request it passed to the iLO's owner
+FORWARD_TIMEOUT = 300
+
+
+def prepare_multiprocess_dir():
+    """
+    Points prometheus_client's multiprocess mode to an empty directory, before anything imports prometheus_client:
+    PROMETHEUS_MULTIPROC_DIR if set, cleared of the files of a previous run, or a new temporary one
+    """
+    path = os.environ.get('PROMETHEUS_MULTIPROC_DIR') or os.environ.get('prometheus_multiproc_dir')
+    if path:
+        for name in glob.glob(os.path.join(path, '*.db')):
+            os.remove(name)
+    else:
+        path = os.environ['PROMETHEUS_MULTIPROC_DIR'] = tempfile.mkdtemp(prefix='hpilo_exporter-')
+    return path
+
+
+def multiprocess_registry():
+    """
+    Returns a registry of the exporter metrics of all workers together, and of the process and
+    platform metrics of the calling worker
+    """
+    from prometheus_client import CollectorRegistry, PlatformCollector, ProcessCollector
+    from prometheus_client.multiprocess import MultiProcessCollector
+    registry = CollectorRegistry()
+    MultiProcessCollector(registry)
+    ProcessCollector(registry=registry)
+    PlatformCollector(registry=registry)
+    return registry
+
+
+class HashRing(object):
+    """
+    Consistent hash ring of nodes, each placed at replicas points so keys spread evenly
+    and a node's keys stay with it whatever the other nodes are
+    """
+
+    def __init__(self, nodes, replicas=64):
+        self._points = sorted((self._hash('%s-%d' % (node, i)), node) for node in nodes for i in range(replicas))
+        self._hashes = [point for point, node in self._points]
+
+    @staticmethod
+    def _hash(key):
+        # not hash(), which differs between processes
+        return int(hashlib.md5(key.encode('utf-8')).hexdigest()[:8], 16)
+
+    def node(self, key):
+        """
+        Returns the node owning key, the first one clockwise from its hash
+        """
+        index = bisect.bisect(self._hashes, self._hash(key)) % len(self._points)
+        return self._points[index][1]
+
+
+def reuse_port(server_class):
+    """
+    Returns a subclass of server_class binding its socket with SO_REUSEPORT, so that several
+    processes listen on the same port and the kernel spreads the connections among them
+    """
+
+    class ReusePortServer(server_class):
+        def server_bind(self):
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            server_class.server_bind(self)
+
+    return ReusePortServer
+
+
+class Supervisor(object):
+    """
+    Forks count workers running work(index) and forks a worker again when it dies.
+    SIGHUP is passed on to the workers, SIGTERM and Ctrl+C stop them.
+    """
+
+    def __init__(self, count, work):
+        self.count = count
+        self.work = work
+        self._pids = {}
+
+    def _spawn(self, index):
+        pid = os.fork()
+        if pid:
+            self._pids[pid] = index
+            return
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        # until the worker installs a handler, if it has a config to reload, SIGHUP must not kill it
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        status = 0
+        try:
+            self.work(index)
+        except KeyboardInterrupt:
+            pass
+        except Exception:
+            traceback.print_exc()
+            status = 1
+        finally:
+            sys.stderr.flush()
+            os._exit(status)
+
+    def _reaped(self, pid):
+        from prometheus_client import multiprocess
+        # drops the gauges of the dead worker from the live* aggregations
+        multiprocess.mark_process_dead(pid)
+        return self._pids.pop(pid, None)
+
+    def _forward(self, signum, frame):
+        for pid in self._pids:
+            os.kill(pid, signum)
+
+    def _terminate(self, signum, frame):
+        raise SystemExit(0)
+
+    def run(self):
+        signal.signal(signal.SIGHUP, self._forward)
+        signal.signal(signal.SIGTERM, self._terminate)
+        for index in range(self.count):
+            self._spawn(index)
+        try:
+            while True:
+                pid, status = os.wait()
+                index = self._reaped(pid)
+                if index is not None:
+                    print_err("worker {} (pid {}) exited with status {}, restarting it".format(index, pid, status))
+                    # a worker failing at startup must not make this a busy loop
+                    time.sleep(1)
+                    self._spawn(index)
+        except (KeyboardInterrupt, SystemExit):
+            self.stop()
+
+    def stop(self):
+        for pid in list(self._pids):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+        for pid in list(self._pids):
+            try:
+                os.waitpid(pid, 0)
+            except OSError:
+                pass
+            self._reaped(pid)